@@ -1,18 +1,14 @@
 import asyncio
-import json
 import streamlit as st
-from astrapy import DataAPIClient
-
-from astrapy import DataAPIClient
-from astrapy.constants import VectorMetric
-from astrapy.info import CollectionVectorServiceOptions
-
-from openai import OpenAI, AsyncOpenAI
 
 import reporeader
-import attributes
-
-import instructor
+import vectorstore
+import symbolindex
+import jobs
+import documentation
+import resources
+import clients
+import tracing
 
 # Initialize the github repo helper class
 if "repo" not in st.session_state:
@@ -40,29 +36,96 @@ if "architectural_summary" not in st.session_state:
     st.session_state.architectural_summary = "Please select a repository and click generate documentation."
 if "domain_model" not in st.session_state:
     st.session_state.domain_model = "Please select a repository and click generate documentation."
-
-# Cache the Astra DB Vector Store and collection
-@st.cache_resource(show_spinner='Connecting to Astra')
-def load_vector_store_collection():
-    # Connect to the Vector Store
-    client = DataAPIClient(st.secrets['ASTRA_TOKEN'])
-    db = client.get_database_by_api_endpoint(st.secrets['ASTRA_API_ENDPOINT'])
-    # Create or get a collection
-    collection = db.create_collection(
-        "uservice",
-        metric=VectorMetric.COSINE,
-        service=CollectionVectorServiceOptions(
-            provider="openai",
-            model_name="text-embedding-ada-002",
-            authentication={
-                "providerKey": f"{st.secrets['ASTRA_OPENAI_KEY']}.providerKey",
-            },
-        ),
-        check_exists=False
-    )
-    return collection
+# Trace ids of the last runs in this session, shown by show_debug()
+if "traces" not in st.session_state:
+    st.session_state.traces = {}
+
+# Finished spans are also appended to TRACE_PATH when it's set
+tracing.configure(st.secrets.get('TRACE_PATH'))
+
+# Pooled API clients, shared by all sessions so connections are reused
+@st.cache_resource
+def load_client_registry():
+    return clients.ClientRegistry(st.secrets)
+
+# Cache the Astra DB Vector Store and collection, or the local vector store when VECTOR_STORE is "local"
+@st.cache_resource(show_spinner='Connecting to the vector store')
+def load_vector_store_collection() -> vectorstore.VectorStore:
+    return resources.load_vector_store_collection(st.secrets, load_client_registry())
 collection = load_vector_store_collection()
 
+# File contents by blob SHA, shared by all sessions
+@st.cache_resource
+def load_content_store():
+    return resources.load_content_store(st.secrets)
+content_store = load_content_store()
+
+# Generated documentation, shared by all sessions and users
+@st.cache_resource
+def load_result_cache():
+    return resources.load_result_cache(st.secrets)
+result_cache = load_result_cache()
+
+# File and directory summaries of map-reduce documentation, shared by all sessions
+@st.cache_resource
+def load_summary_cache():
+    return resources.load_summary_cache(st.secrets)
+summary_cache = load_summary_cache()
+
+# BM25 indexes of the ingested repositories, shared by all sessions
+@st.cache_resource
+def load_lexical_indexes():
+    return resources.load_lexical_indexes(st.secrets)
+lexical_indexes = load_lexical_indexes()
+
+# Symbol and dependency indexes of the ingested repositories, shared by all sessions
+@st.cache_resource
+def load_symbol_indexes():
+    return resources.load_symbol_indexes(st.secrets)
+symbol_indexes = load_symbol_indexes()
+
+# The ingested repositories and when they were last used, for pruning with batch.py --prune-days
+@st.cache_resource
+def load_catalog():
+    return resources.load_catalog(st.secrets)
+catalog = load_catalog()
+
+# Shared by all sessions, so the limits hold for the whole app and not per browser tab
+@st.cache_resource
+def load_rate_limiter():
+    return resources.load_rate_limiter(st.secrets)
+
+@st.cache_resource
+def load_attributes_client():
+    return resources.load_attributes_client(load_client_registry())
+
+@st.cache_resource
+def load_chat_client():
+    return resources.load_chat_client(load_client_registry())
+
+# Keeps the context of every advisor prompt within CONTEXT_TOKENS
+context_builder = resources.load_context_builder(st.secrets)
+
+# Everything ingestion and the advisor use, the same code runs headless in batch.py
+app_resources = resources.Resources(st.secrets, collection, content_store, result_cache, lexical_indexes, symbol_indexes, load_rate_limiter(), load_attributes_client(), load_chat_client(), context_builder, load_client_registry(), summary_cache, catalog)
+
+# Repositories are loaded by background workers shared by all sessions, so a rerun or refresh doesn't abort a load
+@st.cache_resource
+def load_job_queue():
+    queue = jobs.JobQueue(st.secrets.get('JOB_QUEUE_PATH', '.cache/jobs.sqlite'), app_resources, workers=int(st.secrets.get('JOB_WORKERS', 2)))
+    queue.start()
+    return queue
+job_queue = load_job_queue()
+
+# The job is in the URL, so a refreshed page picks up the load it was following
+if "job_id" not in st.session_state:
+    st.session_state.job_id = st.query_params.get("job")
+    job = job_queue.get(st.session_state.job_id) if st.session_state.job_id else None
+    if job is None:
+        st.session_state.job_id = None
+    else:
+        st.session_state.repo = jobs.make_reader(job["repo"], job["options"], st.secrets['GITHUB_TOKEN'], load_client_registry())
+
 async def load_sidebar():
     with st.sidebar:
         st.header("Repository")
@@ -70,77 +133,64 @@ async def load_sidebar():
             github_key = st.text_input("GitHub key", value=st.secrets['GITHUB_TOKEN'])
             github_repo = st.text_input("GitHub repo", value=st.secrets['GITHUB_REPO'])
             github_extensions = st.text_input("Process file types", value=".md, .py", help="Comma delimited string of file extensions to process")
+            fetch_mode = st.selectbox("Fetch mode", reporeader.MODES, help="tarball: one download, tree: one listing call plus one call per file, api: walk directory by directory, local: read a local clone")
+            local_path = st.text_input("Local path", value="", help="Path to a local clone or working directory, only used with the local fetch mode")
+            incremental = st.checkbox("Incremental sync", value=True, help="Only process files that changed since the last load, uncheck to reload everything")
 
             submitted = st.form_submit_button("Submit")
             if submitted:
-                # Just dump the data as we'll load it again
-                result = collection.delete_many(
-                    {
-                        "name": github_repo
-                    }
-                )
-
-                st.success('Reading repository and vectorizing data into Astra DB. Please hang on...')
-                st.session_state.repo.connect(github_key)
-                st.session_state.repo.setRepository(github_repo)
+                st.success('Reading repository and vectorizing data into Astra DB in the background, progress is shown under Repository data.')
+                st.session_state.repo.setMode(fetch_mode)
+                if fetch_mode == reporeader.MODE_LOCAL:
+                    st.session_state.repo.setLocalPath(local_path, github_repo)
+                else:
+                    st.session_state.repo.connect(github_key, github=load_client_registry().github(github_key), session=load_client_registry().http())
+                    st.session_state.repo.setRepository(github_repo)
                 st.session_state.repo.setExtensions(github_extensions)
-                await generate_repository_data()
-
-async def generate_repository_data():
-    contents_output = "The provided repository contains the following files and information:\n"
-    contents = st.session_state.repo.getRepositoryContents()
-    for c in contents:
-        contents_output += f"- {c.name}\n"
-        repository_data_placeholder.markdown(contents_output)
-
-        # Create the JSON documnent containing information of the file
-        context = {
-            "type": "vectordata",
-            "name": st.session_state.repo.getName(),
-            "topics": st.session_state.repo.getTopics(),
-            "stars": st.session_state.repo.getStars(),
-            "filename": c.name,
-            "path": c.path,
-            "$vectorize": f"Repository name: {st.session_state.repo.getName()}\nFile name: {c.name}\nFile size: {c.size}\nContent {c.decoded_content.decode()}"            
-        }
-
-        # Create attributes for the file and add it to the JSON document
-        attributes = await generate_attributes({"filename": c.name, "content": c.decoded_content.decode()})
-        for attribute in attributes:
-                if attribute[1] != "":
-                    contents_output += f"\t- {attribute[0]}: {attribute[1]}\n"
-        context["attributes"] = attributes.model_dump_json()
-
-        # Load the JSON document into Astra DB
-        collection.insert_one(context)
-
-    st.session_state.repository_data = contents_output
-    st.session_state.repository_loaded = True
-
-async def generate_attributes(context: str):
-    client = instructor.from_openai(OpenAI(api_key=st.secrets['OPENAI_API_KEY']))
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_model=attributes.Attributes,
-        messages=[
-            {"role": "system", "content": f"""You're a programmer and you specialize in understanding all kinds of code.
-Your task is to extract relevant attributes like langauge, number of functions defined, classes, and more. Only do this for actual code.
-Use only the following context: {context}"""},
-            {"role": "user", "content": "Extract the requested attributes from the provided code. Do not process README.md files"}
-        ]
-    )
-
-    return response
-    
+                submit_repository(github_key, {"mode": fetch_mode, "extensions": github_extensions, "local_path": local_path, "full": not incremental})
+
+        # Loads of all sessions, several repositories are loaded at once
+        with st.expander("Jobs"):
+            st.dataframe([{"repository": j["repo"], "status": j["status"], "attempts": j["attempts"]} for j in job_queue.list(10)], hide_index=True)
+
+def submit_repository(token: str, options: dict):
+    st.session_state.job_id = job_queue.submit(st.session_state.repo.getName(), options, token=token)
+    st.query_params["job"] = st.session_state.job_id
+    st.session_state.repository_data = "Waiting for the repository to be loaded..."
+    st.session_state.repository_loaded = False
+
+# Polls the job of the session while it runs, the whole page is rerun once it's done
+@st.fragment(run_every=2)
+def show_job():
+    job = job_queue.get(st.session_state.job_id)
+    if job["status"] in (jobs.QUEUED, jobs.RUNNING):
+        st.info(f"Loading {job['repo']}: {job['status']}" + (f", attempt {job['attempts']}" if job["attempts"] > 1 else ""))
+        st.markdown(job["progress"] or "Waiting for a worker...")
+        return
+    st.session_state.job_id = None
+    if job["status"] == jobs.DONE:
+        st.session_state.repository_data = job["result"]
+        st.session_state.repository_loaded = True
+        if job["trace_id"]:
+            st.session_state.traces["Load repository"] = job["trace_id"]
+    else:
+        st.session_state.repository_data = f"Loading {job['repo']} failed: {job['error']}"
+    st.rerun()
+
 async def show_repository_data():
     print("In show_repository_data()")
+    if st.session_state.job_id:
+        with tab1:
+            show_job()
+        return
     repository_data_placeholder.markdown(st.session_state.repository_data)
     if st.session_state.repository_loaded:
+        mode = tab1.radio("Documentation mode", documentation.DOCUMENTATION_MODES, horizontal=True, help="retrieval: each section from the files a search returns, map-reduce: from summaries of every file and directory, only changed files are summarized again")
+        force = tab1.checkbox("Force regenerate", value=False, help="Ignore documentation generated earlier for the same code and prompts")
         submitted = tab1.button("Generate documentation")
         if submitted:
             tab1.success('Generating documentation based on source code in the repository. Please hang on...')
-            await generateDocumentation()
+            await generateDocumentation(force=force, mode=mode)
 
 async def show_overview():
     overview_placeholder.markdown(st.session_state.overview)
@@ -151,84 +201,75 @@ async def show_architectural_summary():
 async def show_domain_model():
     domain_model_placeholder.markdown(st.session_state.domain_model)
 
-async def generateDocumentation():
-    result = await asyncio.gather(
-        advisor(
-            f"Find generic information about the {st.session_state.repo.getName()} repository",
-            "Provide a short summary of the code in a maximum of 100 words",
-            overview_placeholder
-        ),
-        advisor(
-            f"Find the main code for the {st.session_state.repo.getName()} repository",
-            "Provide an architectural summary of the application",
-            architectural_summary_placeholder
-        ),
-        advisor(
-            f"Find the main code for the {st.session_state.repo.getName()} repository",
-            "Show me the domain model of the application in a structured way (like uml)",
-            domain_model_placeholder
+# Generated documentation is cached across sessions, see documentation.advisor()
+async def generateDocumentation(force: bool = False, mode: str = "retrieval"):
+    with tracing.span("generate documentation") as run:
+        st.session_state.traces["Generate documentation"] = run.trace_id
+        result = await documentation.generate_documentation(
+            app_resources,
+            st.session_state.repo,
+            {
+                "overview": overview_placeholder,
+                "architectural_summary": architectural_summary_placeholder,
+                "domain_model": domain_model_placeholder
+            },
+            force=force,
+            mode=mode
         )
-    )
 
-    st.session_state.overview = result[0]
+    st.session_state.overview = result["overview"]
     await show_overview()
 
-    st.session_state.architectural_summary = result[1]
+    st.session_state.architectural_summary = result["architectural_summary"]
     await show_architectural_summary()
 
-    st.session_state.domain_model = result[2]
+    st.session_state.domain_model = result["domain_model"]
     await show_domain_model()
 
-async def advisor(search, question, placeholder):
-    # First find relevant information from the Vector Database
-    results = collection.find(
-        {},
-        vectorize=search, # embedding to search for
-        limit=5,
-        projection={"name", "filename", "path"} # only return these fields from the document
-    )
-
-    context = []
-    for result in results:
-        print (f"Result: {result['path']}")
-        contents = st.session_state.repo.getRepositoryContent(result["path"]).decoded_content.decode()
-        context.append(contents)
-
-    # Now pass the context to the Chat Completion
-    client = AsyncOpenAI(api_key=st.secrets['OPENAI_API_KEY'])
-
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You're an IT architect and programmer specialized in migrations of microservices."},
-            {"role": "system", "content": f"When constructing your answer to the question, take into account the following context: {context}"},
-            {"role": "user", "content": f"Question: {question}"}
-        ],
-        stream=True
-    )
-
-    print(response)
-    streaming_content = ""
-    async for chunk in response:
-        chunk_content = chunk.choices[0].delta.content
-        if chunk_content is not None:
-            streaming_content += chunk_content
-            placeholder.markdown(f"{streaming_content}▌")
-
-    return streaming_content[:-1]
-
 async def show_chat():
     if st.session_state.repository_loaded:
+        mode = tab5.radio("Retrieval mode", documentation.RETRIEVAL_MODES, horizontal=True, help="hybrid: BM25 and vector search fused, vector: embeddings only, lexical: BM25 only")
         question = tab5.text_input("What is your question about the code")
+        tab5.caption(f"Context is retrieved with {mode} search")
         answer_placeholder = tab5.empty()
         if question:
-            result = await advisor(
-                question,
-                question,
-                answer_placeholder
-            )
+            # Navigation questions are answered from the symbol index without calling the LLM,
+            # in a thread as showing where something is used reads the files it's used in
+            repo = st.session_state.repo
+            index = symbol_indexes.get(repo.getName())
+            answer = await asyncio.to_thread(symbolindex.answer_question, index, question, lambda path: documentation.load_content(app_resources, repo, {"path": path, "sha": index.files[path]["sha"]}).decode(errors="replace"))
+            if answer is not None:
+                answer_placeholder.markdown(answer)
+                tab5.caption("Answered from the symbol index")
+                return
+            with tracing.span("chat") as run:
+                st.session_state.traces["Chat"] = run.trace_id
+                result = await documentation.advisor(
+                    app_resources,
+                    st.session_state.repo,
+                    question,
+                    question,
+                    answer_placeholder,
+                    mode=mode
+                )
             answer_placeholder = result
 
+# Where the time of the last runs in this session went, stage by stage
+async def show_debug():
+    with st.sidebar.expander("Debug"):
+        st.caption("Seconds are summed over all calls of a stage, stages that run concurrently add up to more than the total")
+        for title, trace_id in st.session_state.traces.items():
+            breakdown = tracing.tracer.breakdown(trace_id)
+            if breakdown["name"] is None:
+                continue
+            st.markdown(f"**{title}**: {breakdown['seconds']:.2f}s")
+            st.dataframe([{"stage": s["stage"], "calls": s["calls"], "seconds": round(s["seconds"], 3), "max seconds": round(s["max_seconds"], 3)} for s in breakdown["stages"]], hide_index=True)
+            if breakdown["counts"]:
+                st.json(breakdown["counts"], expanded=False)
+            if breakdown["attributes"].get("dropped"):
+                st.caption("Left out of the context: " + "; ".join(breakdown["attributes"]["dropped"]))
+        st.download_button("Prometheus metrics", tracing.tracer.prometheus(), file_name="metrics.prom", mime="text/plain")
+
 async def main():
     await load_sidebar()
     await show_repository_data()
@@ -236,6 +277,7 @@ async def main():
     await show_architectural_summary()
     await show_domain_model()
     await show_chat()
+    await show_debug()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import reporeader
+import ingestion
+import documentation
+import ratelimit
+import resources
+import tracing
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    # Before Python 3.11, the toml package comes with Streamlit
+    tomllib = None
+    import toml
+
+#
+# Headless batch documentation of many repositories, without Streamlit. Repositories are spread over a pool of
+# worker processes, each one ingests its repository with the same concurrent pipeline as the app and generates
+# the documentation sections at once. All workers take from one shared rate limiter, so the API limits hold for
+# the whole run. Every repository gets a status.json, documentation.md and documentation.json in the output
+# directory, and a rerun skips what's already documented at the current commit.
+#
+# python batch.py owner/repo1 owner/repo2 --file repos.txt --output docs --workers 8
+#
+
+# Set in every worker process by _initWorker
+_resources = None
+
+def _initWorker(secrets: dict, limiter: ratelimit.RateLimiter):
+    global _resources
+    _resources = resources.Resources.load(secrets, rate_limiter=limiter)
+    tracing.configure(secrets.get('TRACE_PATH'))
+
+def output_directory(output: str, name: str) -> str:
+    return os.path.join(output, re.sub(r'[^A-Za-z0-9_.-]', '_', name))
+
+def read_status(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, "status.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def to_markdown(name: str, commit: str, sections: dict, repository_data: str) -> str:
+    parts = [f"# {name}\n", f"Commit {commit or 'n/a'}\n"]
+    for key, title, _, _ in documentation.SECTIONS:
+        parts.append(f"## {title}\n\n{sections[key].strip()}\n")
+    parts.append(f"## Repository data\n\n{repository_data.strip()}\n")
+    return "\n".join(parts)
+
+# Runs in a worker process, failures are recorded in the status instead of raised
+def document_repository(spec: str, options: dict) -> dict:
+    return asyncio.run(_documentRepository(spec, options))
+
+async def _documentRepository(spec: str, options: dict) -> dict:
+    repo = reporeader.RepoReader()
+    repo.setMode(options["mode"])
+    if options["mode"] == reporeader.MODE_LOCAL:
+        repo.setLocalPath(spec)
+    repo.setExtensions(options["extensions"])
+    status = {"repo": spec, "name": spec if options["mode"] != reporeader.MODE_LOCAL else repo.getName(), "commit": None, "documentation": options["documentation"], "status": "running", "started": time.time()}
+    directory = output_directory(options["output"], status["name"])
+
+    try:
+        if options["mode"] != reporeader.MODE_LOCAL:
+            repo.connect(options["token"], github=_resources.client_registry.github(options["token"]), session=_resources.client_registry.http())
+            await asyncio.to_thread(repo.setRepository, spec)
+        status["commit"] = await asyncio.to_thread(repo.getCommitSha)
+
+        # Resume: what was documented at this commit in the same way before is done
+        previous = read_status(directory)
+        if not options["force"] and previous.get("status") == "done" and previous.get("commit") == status["commit"] and previous.get("documentation", "retrieval") == options["documentation"]:
+            return {**previous, "skipped": True}
+        write_json(os.path.join(directory, "status.json"), status)
+
+        # Ingestion is incremental, so after a failure only the files that weren't stored yet are processed again,
+        # and sections generated before come from the result cache
+        with tracing.span("batch", repo=spec) as run:
+            repository_data = await ingestion.ingest_repository(_resources, repo, full=options["full"])
+            sections = await documentation.generate_documentation(_resources, repo, force=options["force"], priority=ratelimit.BACKGROUND, mode=options["documentation"])
+    except Exception as e:
+        status.update(status="failed", error=f"{type(e).__name__}: {e}", finished=time.time())
+        write_json(os.path.join(directory, "status.json"), status)
+        return status
+
+    with open(os.path.join(directory, "documentation.md"), "w") as f:
+        f.write(to_markdown(repo.getName(), status["commit"], sections, repository_data))
+    # Where the time went, stage by stage
+    write_json(os.path.join(directory, "trace.json"), tracing.tracer.breakdown(run.trace_id))
+    write_json(os.path.join(directory, "documentation.json"), {
+        "name": repo.getName(),
+        "commit": status["commit"],
+        "model": resources.MODEL,
+        "documentation": options["documentation"],
+        "sections": sections,
+        "repository_data": repository_data
+    })
+    status.update(status="done", finished=time.time())
+    write_json(os.path.join(directory, "status.json"), status)
+    return status
+
+def load_secrets(path: str) -> dict:
+    if tomllib is None:
+        return toml.load(path)
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+# Repositories from the command line and the file, one per line, blank lines and # comments are skipped
+def read_repositories(repos: list, file: str = None) -> list:
+    repos = list(repos)
+    if file:
+        with open(file) as f:
+            repos += [line.split("#", 1)[0].strip() for line in f]
+    return list(dict.fromkeys(r for r in repos if r))
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate documentation for many repositories without the UI")
+    parser.add_argument("repos", nargs="*", help="Repository names, or paths to local clones with --mode local")
+    parser.add_argument("-f", "--file", help="File with one repository per line")
+    parser.add_argument("-o", "--output", default="docs", help="Directory the documentation is written to")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="Settings, the same file the app uses")
+    parser.add_argument("--mode", default=reporeader.MODE_TARBALL, choices=reporeader.MODES, help="How repositories are fetched")
+    parser.add_argument("--documentation", default="retrieval", choices=documentation.DOCUMENTATION_MODES, help="Ground the sections on search results, or on summaries of every file")
+    parser.add_argument("--extensions", default=".md, .py", help="Comma delimited string of file extensions to process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes, each documents one repository at a time")
+    parser.add_argument("--concurrency", type=int, help="Files processed at once per repository, defaults to OPENAI_CONCURRENCY")
+    parser.add_argument("--full", action="store_true", help="Reload every file instead of only the changed ones")
+    parser.add_argument("--force", action="store_true", help="Document repositories again even when done at the current commit")
+    parser.add_argument("--prune-days", type=float, help="First remove the repositories that weren't loaded or asked about for this many days")
+    args = parser.parse_args(argv)
+
+    repos = read_repositories(args.repos, args.file)
+    if not repos and args.prune_days is None:
+        parser.error("no repositories given")
+    secrets = load_secrets(args.secrets)
+    if args.prune_days is not None:
+        pruned = ingestion.prune_repositories(resources.Resources.load(secrets), args.prune_days)
+        print(f"Removed {len(pruned)} repositories not used for {args.prune_days:g} days" + (f": {', '.join(pruned)}" if pruned else ""), flush=True)
+        if not repos:
+            return 0
+    if args.concurrency:
+        secrets["OPENAI_CONCURRENCY"] = args.concurrency
+    workers = max(1, min(args.workers, len(repos)))
+    if secrets.get('VECTOR_STORE', 'astra') == 'local' and workers > 1:
+        # The local vector store is a set of files owned by one process
+        print("The local vector store can't be shared between processes, using 1 worker", file=sys.stderr)
+        workers = 1
+
+    options = {
+        "mode": args.mode,
+        "extensions": args.extensions,
+        "documentation": args.documentation,
+        "token": secrets.get('GITHUB_TOKEN', ''),
+        "output": args.output,
+        "full": args.full,
+        "force": args.force
+    }
+    results = []
+    with multiprocessing.Manager() as manager:
+        limiter = ratelimit.SharedRateLimiter(
+            manager,
+            requests_per_minute=int(secrets.get('OPENAI_RPM', 500)),
+            tokens_per_minute=int(secrets.get('OPENAI_TPM', 30000)),
+            reserve=float(secrets.get('OPENAI_INTERACTIVE_RESERVE', 0.1))
+        )
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(secrets, limiter)) as pool:
+            futures = {pool.submit(document_repository, repo, options): repo for repo in repos}
+            for future in as_completed(futures):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    # The worker itself died, e.g. out of memory
+                    status = {"repo": futures[future], "status": "failed", "error": f"{type(e).__name__}: {e}"}
+                results.append(status)
+                state = "skipped" if status.get("skipped") else status["status"]
+                print(f"[{len(results)}/{len(repos)}] {status['repo']}: {state}" + (f" ({status['error']})" if status.get("error") else ""), flush=True)
+
+    write_json(os.path.join(args.output, "index.json"), {"repositories": sorted(results, key=lambda s: s["repo"])})
+    failed = [s for s in results if s["status"] == "failed"]
+    print(f"Documented {len(results) - len(failed)} of {len(repos)} repositories, {len(failed)} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import contentstore
+import doccache
+import documentation
+import fakes
+import ingestion
+import lexical
+import ratelimit
+import reporeader
+import resources
+import symbolindex
+import tracing
+import vectorstore
+
+#
+# Offline benchmark of ingestion and the advisor against the stand-ins in fakes.py, so throughput, latency and API
+# call counts can be compared between changes without touching GitHub, OpenAI or Astra DB.
+#
+# python benchmark.py --files 500 --queries 20 --latency 0.2
+#
+
+QUESTIONS = [
+    "How are payments validated",
+    "Where is the customer created",
+    "What does the order service do",
+    "How is the session cache invalidated",
+    "Which classes handle invoices",
+]
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+# Resources like the app's, with the fakes for every service and the stores in a temporary directory
+def fake_resources(directory: str, counter: fakes.CallCounter, args) -> resources.Resources:
+    client = fakes.FakeOpenAI(counter, latency=args.latency, token_latency=args.token_latency)
+    secrets = {"OPENAI_CONCURRENCY": args.concurrency, "ASTRA_BATCH_SIZE": 50, "CHUNK_TOKENS": 512, "CHUNK_OVERLAP": 64}
+    collection = fakes.FakeCollection(counter, latency=args.astra_latency)
+    if args.per_repository:
+        partitions = {}
+        collection = vectorstore.PartitionedVectorStore(
+            lambda key: partitions.setdefault(key, fakes.FakeCollection(counter, latency=args.astra_latency)),
+            lambda: list(partitions),
+            lambda key: partitions.pop(key, None)
+        )
+    return resources.Resources(
+        secrets,
+        collection,
+        contentstore.ContentStore(os.path.join(directory, "contents")),
+        doccache.ResultCache(os.path.join(directory, "results.sqlite")),
+        lexical.LexicalIndexes(os.path.join(directory, "lexical")),
+        symbolindex.SymbolIndexes(os.path.join(directory, "symbols")),
+        ratelimit.RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm),
+        client,
+        client,
+        resources.load_context_builder(secrets)
+    )
+
+# A reader for a repository of the fake GitHub, tarballs are served by a FakeSession
+def fake_reader(github: fakes.FakeGithub, name: str, mode: str, session: fakes.FakeSession) -> reporeader.RepoReader:
+    repo = reporeader.RepoReader()
+    repo.github_handle = github
+    repo.session = session
+    repo.setMode(mode)
+    repo.setRepository(name)
+    repo.setExtensions(".md, .py")
+    return repo
+
+async def run(args) -> dict:
+    counter = fakes.CallCounter()
+    name = "benchmark/synthetic"
+    files = fakes.synthetic_repository(args.files, seed=args.seed)
+    github = fakes.FakeGithub({name: fakes.FakeRepository(name, files, counter, latency=args.github_latency)}, counter)
+    session = fakes.FakeSession(github, counter, latency=args.github_latency)
+    repo = fake_reader(github, name, args.mode, session)
+
+    report = {"files": len(files), "mode": args.mode, "repositories": args.repositories}
+    with tempfile.TemporaryDirectory() as directory:
+        shared = fake_resources(directory, counter, args)
+
+        # Other repositories in the same collection, searches of the benchmarked one shouldn't get slower
+        for number in range(1, args.repositories):
+            other = f"benchmark/other{number}"
+            github.repositories[other] = fakes.FakeRepository(other, fakes.synthetic_repository(args.files, seed=args.seed + number), latency=0)
+            await ingestion.ingest_repository(shared, fake_reader(github, other, args.mode, session), full=True)
+        counter.reset()
+
+        start = time.perf_counter()
+        with tracing.span("benchmark") as trace:
+            await ingestion.ingest_repository(shared, repo, full=True)
+        elapsed = time.perf_counter() - start
+        stages = {s["stage"]: round(s["seconds"], 3) for s in tracing.tracer.breakdown(trace.trace_id)["stages"]}
+        report["ingestion"] = {"seconds": round(elapsed, 3), "files_per_second": round(len(files) / elapsed, 1), "calls": counter.snapshot(), "stages": stages}
+
+        # A second load of the unchanged repository only has to compare blob SHAs
+        before = counter.snapshot()
+        start = time.perf_counter()
+        await ingestion.ingest_repository(shared, repo)
+        after = counter.snapshot()
+        report["incremental"] = {"seconds": round(time.perf_counter() - start, 3), "calls": {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)}}
+
+        before = after
+        latencies = {}
+        for mode in args.retrieval:
+            latencies[mode] = []
+            for number in range(args.queries):
+                question = QUESTIONS[number % len(QUESTIONS)]
+                start = time.perf_counter()
+                await documentation.advisor(shared, repo, question, question, mode=mode)
+                latencies[mode].append(time.perf_counter() - start)
+        after = counter.snapshot()
+        report["advisor"] = {
+            mode: {"p50_ms": round(percentile(values, 0.5) * 1000, 1), "p95_ms": round(percentile(values, 0.95) * 1000, 1)}
+            for mode, values in latencies.items()
+        }
+        report["advisor"]["calls"] = {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)}
+
+    report["memory"] = await peak_memory(args)
+    return report
+
+# Peak memory of a load and a few questions, in a pass of its own: tracemalloc slows down allocations several
+# times over, so it's never on while throughput and latency are measured
+async def peak_memory(args) -> dict:
+    counter = fakes.CallCounter()
+    name = "benchmark/synthetic"
+    github = fakes.FakeGithub({name: fakes.FakeRepository(name, fakes.synthetic_repository(args.files, seed=args.seed), counter)}, counter)
+    repo = fake_reader(github, name, args.mode, fakes.FakeSession(github, counter))
+    with tempfile.TemporaryDirectory() as directory:
+        shared = fake_resources(directory, counter, args)
+        tracemalloc.start()
+        try:
+            await ingestion.ingest_repository(shared, repo, full=True)
+            for mode in args.retrieval:
+                await documentation.advisor(shared, repo, QUESTIONS[0], QUESTIONS[0], mode=mode)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"python_peak_mb": round(peak / 1024 / 1024, 1), "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and the advisor against local stand-ins for GitHub, OpenAI and Astra DB")
+    parser.add_argument("--files", type=int, default=200, help="Files in the synthetic repository")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", default=reporeader.MODE_TREE, choices=(reporeader.MODE_TARBALL, reporeader.MODE_TREE, reporeader.MODE_API), help="How the repository is fetched")
+    parser.add_argument("--concurrency", type=int, default=8, help="Files processed at once")
+    parser.add_argument("--repositories", type=int, default=1, help="Repositories ingested in the same collection, only the first one is measured")
+    parser.add_argument("--per-repository", action="store_true", help="Keep a collection per repository instead of one shared collection")
+    parser.add_argument("--queries", type=int, default=10, help="Advisor calls per retrieval mode")
+    parser.add_argument("--retrieval", nargs="+", default=["vector", "hybrid"], choices=documentation.RETRIEVAL_MODES)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per OpenAI call")
+    parser.add_argument("--token-latency", type=float, default=0.001, help="Seconds per streamed token")
+    parser.add_argument("--github-latency", type=float, default=0.02, help="Seconds per GitHub call")
+    parser.add_argument("--astra-latency", type=float, default=0.02, help="Seconds per Astra DB call")
+    parser.add_argument("--rpm", type=int, default=100000, help="Requests per minute of the rate limiter")
+    parser.add_argument("--tpm", type=int, default=100000000, help="Tokens per minute of the rate limiter")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON only")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"Repository: {report['files']} files, {args.mode} mode, {report['repositories']} repositories in the {'partitioned' if args.per_repository else 'shared'} collection")
+    print(f"Ingestion: {report['ingestion']['seconds']}s, {report['ingestion']['files_per_second']} files/s")
+    print("Ingestion stages (seconds summed over concurrent calls): " + ", ".join(f"{k}={v}" for k, v in report["ingestion"]["stages"].items()))
+    print(f"Incremental reload: {report['incremental']['seconds']}s")
+    for mode, latency in report["advisor"].items():
+        if mode != "calls":
+            print(f"Advisor ({mode}): p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms")
+    print(f"Peak memory: {report['memory']['python_peak_mb']} MB traced, {report['memory']['max_rss_mb']} MB RSS")
+    for stage in ("ingestion", "incremental"):
+        print(f"API calls ({stage}): " + ", ".join(f"{k}={v}" for k, v in report[stage]["calls"].items()))
+    print("API calls (advisor): " + ", ".join(f"{k}={v}" for k, v in report["advisor"]["calls"].items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import threading
+import time
+
+#
+# The repositories that were ingested, with the commit they're at and when they were last loaded or asked about,
+# so repositories nobody uses anymore can be removed from the vector collection and the indexes.
+#
+
+class RepositoryCatalog():
+    """Ingested repositories in SQLite"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS repositories (name TEXT PRIMARY KEY, commit_sha TEXT, files INTEGER, ingested REAL, used REAL)")
+        self.lock = threading.Lock()
+
+    # Record a load of the repository
+    def ingested(self, name: str, commit: str, files: int):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO repositories (name, commit_sha, files, ingested, used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET commit_sha = excluded.commit_sha, files = excluded.files, ingested = excluded.ingested, used = excluded.used",
+                (name, commit, files, now, now)
+            )
+            self.connection.commit()
+
+    # Record a question or documentation run about the repository
+    def used(self, name: str):
+        with self.lock:
+            self.connection.execute("UPDATE repositories SET used = ? WHERE name = ?", (time.time(), name))
+            self.connection.commit()
+
+    def get(self, name: str) -> dict:
+        return next((r for r in self.list() if r["name"] == name), None)
+
+    def list(self) -> list:
+        with self.lock:
+            rows = self.connection.execute("SELECT name, commit_sha, files, ingested, used FROM repositories ORDER BY name").fetchall()
+        return [{"name": name, "commit": commit, "files": files, "ingested": ingested, "used": used} for name, commit, files, ingested, used in rows]
+
+    # Repositories not loaded or asked about in the last max_age seconds
+    def stale(self, max_age: float) -> list:
+        with self.lock:
+            rows = self.connection.execute("SELECT name FROM repositories WHERE used < ? ORDER BY used", (time.time() - max_age,)).fetchall()
+        return [name for name, in rows]
+
+    def remove(self, name: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM repositories WHERE name = ?", (name,))
+            self.connection.commit()
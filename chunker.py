@@ -0,0 +1,109 @@
+import ast
+import re
+
+from pydantic import BaseModel
+
+import extractors
+import tokens
+
+#
+# Splits files in chunks before they're vectorized, so large files don't exceed the input of the embedding model
+# and retrieval returns the relevant part of a file instead of the whole file.
+# Code is split on functions and classes and Markdown on headings, sections that are still too large are split
+# in token sized windows that overlap.
+#
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+MARKDOWN_HEADING = re.compile(r'^#{1,6}\s')
+
+class Chunk(BaseModel):
+    index: int
+    text: str
+    start_line: int
+    end_line: int
+    symbol: str = ""            # The function, class or heading the chunk starts at
+
+# Line numbers (1-based) where a new section starts, with the name of what starts there
+def find_boundaries(filename: str, content: str) -> dict:
+    boundaries = {}
+    if filename.lower().endswith((".md", ".markdown")):
+        for number, line in enumerate(content.splitlines(), start=1):
+            if MARKDOWN_HEADING.match(line):
+                boundaries[number] = line.lstrip("#").strip()
+        return boundaries
+
+    if filename.lower().endswith((".py", ".pyw", ".pyi")):
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None:
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    # Keep decorators with what they decorate
+                    start = min([d.lineno for d in node.decorator_list] + [node.lineno])
+                    boundaries.setdefault(start, node.name)
+            return boundaries
+
+    analysis = extractors.analyze(filename, content)
+    if analysis is not None and analysis.symbols:
+        for symbol in analysis.symbols:
+            boundaries.setdefault(symbol.line, symbol.name)
+    return boundaries
+
+def chunk_file(filename: str, content: str, max_tokens: int = 512, overlap: int = 64) -> list[Chunk]:
+    lines = content.splitlines(keepends=True)
+    if not lines:
+        return []
+    if tokens.count_tokens(content, EMBEDDING_MODEL) <= max_tokens:
+        return [Chunk(index=0, text=content, start_line=1, end_line=len(lines))]
+
+    boundaries = find_boundaries(filename, content)
+    starts = sorted({1} | {line for line in boundaries if 1 <= line <= len(lines)})
+    sections = [(start, (starts[i + 1] - 1) if i + 1 < len(starts) else len(lines)) for i, start in enumerate(starts)]
+    counts = [tokens.count_tokens(line, EMBEDDING_MODEL) for line in lines]
+
+    chunks = []
+    def add(start: int, end: int):
+        chunks.append(Chunk(index=len(chunks), text="".join(lines[start - 1:end]), start_line=start, end_line=end, symbol=boundaries.get(start, "")))
+
+    # Pack whole sections together as long as they fit, split the ones that don't fit on their own
+    current_start, current_tokens = None, 0
+    for start, end in sections:
+        size = sum(counts[start - 1:end])
+        if current_start is not None and current_tokens + size > max_tokens:
+            add(current_start, start - 1)
+            current_start, current_tokens = None, 0
+        if size > max_tokens:
+            for window_start, window_end in _windows(counts, start, end, max_tokens, overlap):
+                add(window_start, window_end)
+            continue
+        if current_start is None:
+            current_start = start
+        current_tokens += size
+    if current_start is not None:
+        add(current_start, len(lines))
+
+    # A single line over the limit, e.g. minified code, gets cut to the limit
+    for chunk in chunks:
+        if counts[chunk.start_line - 1] > max_tokens and chunk.start_line == chunk.end_line:
+            chunk.text = tokens.truncate_tokens(chunk.text, max_tokens, EMBEDDING_MODEL)
+    return chunks
+
+# Windows of lines of at most max_tokens, each window repeating the last overlap tokens of the previous one
+def _windows(counts: list, start: int, end: int, max_tokens: int, overlap: int):
+    window_start = start
+    while window_start <= end:
+        size, window_end = 0, window_start
+        while window_end <= end and (size + counts[window_end - 1] <= max_tokens or window_end == window_start):
+            size += counts[window_end - 1]
+            window_end += 1
+        yield window_start, window_end - 1
+        if window_end > end:
+            return
+        # Step back over lines until we have the overlap, but always move forward
+        back, next_start = 0, window_end
+        while next_start - 1 > window_start + 1 and back + counts[next_start - 2] <= overlap:
+            back += counts[next_start - 2]
+            next_start -= 1
+        window_start = next_start
\ No newline at end of file
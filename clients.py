@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import inspect
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from astrapy import DataAPIClient
+from github import Auth, Github
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+import instructor
+
+#
+# One set of API clients per process, so every session and every call reuses the same keep-alive connection
+# pools instead of opening new connections and TLS handshakes. The app caches the registry with
+# st.cache_resource, the batch CLI creates one per worker process.
+#
+# Async clients hold connections that belong to the event loop they were first used in, while Streamlit runs
+# every script run, and the job queue and batch CLI every load, in a loop of its own. So the async clients live on
+# one long-lived loop in a background thread, and callers in any loop reach them through a LoopBound proxy.
+#
+
+_END = object()
+
+class BackgroundLoop():
+    """An event loop running in a daemon thread for as long as the process"""
+
+    def __init__(self, name: str = "api-clients"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    # Await a coroutine on this loop from any other loop, cancelling the caller cancels it as well
+    async def run(self, coroutine):
+        if asyncio.get_running_loop() is self.loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+class LoopBound():
+    """Proxy for an async client living on a BackgroundLoop. Awaiting one of its calls runs the call on that loop,
+    and async iterators the call returns, like streamed completions, are read on that loop too."""
+
+    def __init__(self, target, loop: BackgroundLoop):
+        self._target = target
+        self._loop = loop
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            return lambda *args, **kwargs: self._call(value, *args, **kwargs)
+        if isinstance(value, (str, bytes, int, float, bool, type(None))):
+            return value
+        return LoopBound(value, self._loop)
+
+    def _call(self, fn, *args, **kwargs):
+        result = fn(*args, **kwargs)
+        if inspect.isawaitable(result):
+            return self._await(result)
+        return result
+
+    async def _await(self, awaitable):
+        async def run():
+            return await awaitable
+        result = await self._loop.run(run())
+        if hasattr(result, "__aiter__"):
+            return LoopBoundIterator(result, self._loop)
+        return result
+
+class LoopBoundIterator():
+    """An async iterator of a BackgroundLoop, every item is fetched on that loop"""
+
+    def __init__(self, iterable, loop: BackgroundLoop):
+        self._iterator = iterable.__aiter__()
+        self._loop = loop
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # StopAsyncIteration can't cross a future as is, so the end is passed as a value
+        async def next_item():
+            try:
+                return await self._iterator.__anext__()
+            except StopAsyncIteration:
+                return _END
+        item = await self._loop.run(next_item())
+        if item is _END:
+            raise StopAsyncIteration
+        return item
+
+class ClientRegistry():
+    """Pooled OpenAI, GitHub and Astra DB clients, created once and shared"""
+
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.max_connections = int(secrets.get('HTTP_MAX_CONNECTIONS', 32))
+        self.keepalive_expiry = float(secrets.get('HTTP_KEEPALIVE_SECONDS', 30))
+        self.clients = {}
+        # Reentrant as some clients are built from others
+        self.lock = threading.RLock()
+
+    def _get(self, key, factory):
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = factory()
+            return self.clients[key]
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections, keepalive_expiry=self.keepalive_expiry)
+
+    # Retries are left to ratelimit.retry_with_backoff, so they're aware of the shared rate limiter
+    def openai(self) -> OpenAI:
+        return self._get("openai", lambda: OpenAI(api_key=self.secrets['OPENAI_API_KEY'], max_retries=0, http_client=DefaultHttpxClient(limits=self._limits())))
+
+    # The loop the async clients live on, started on first use
+    def backgroundLoop(self) -> BackgroundLoop:
+        return self._get("loop", BackgroundLoop)
+
+    def _asyncOpenai(self) -> AsyncOpenAI:
+        return self._get("async_openai_client", lambda: AsyncOpenAI(api_key=self.secrets['OPENAI_API_KEY'], max_retries=0, http_client=DefaultAsyncHttpxClient(limits=self._limits())))
+
+    def asyncOpenai(self) -> LoopBound:
+        return self._get("async_openai", lambda: LoopBound(self._asyncOpenai(), self.backgroundLoop()))
+
+    # AsyncOpenAI with instructor's response_model support, on the same connection pool
+    def instructor(self) -> LoopBound:
+        return self._get("instructor", lambda: LoopBound(instructor.from_openai(self._asyncOpenai()), self.backgroundLoop()))
+
+    def github(self, token: str) -> Github:
+        key = ("github", hashlib.sha256(token.encode()).hexdigest())
+        def create():
+            options = {"pool_size": int(self.secrets.get('GITHUB_POOL_SIZE', 16))}
+            if 'GITHUB_SECONDS_BETWEEN_REQUESTS' in self.secrets:
+                options["seconds_between_requests"] = float(self.secrets['GITHUB_SECONDS_BETWEEN_REQUESTS'])
+            return Github(auth=Auth.Token(token), **options) if token else Github(**options)
+        return self._get(key, create)
+
+    # For downloads outside the GitHub API, e.g. tarballs
+    def http(self) -> requests.Session:
+        def create():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_connections)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            return session
+        return self._get("http", create)
+
+    def astra(self):
+        return self._get("astra", lambda: DataAPIClient(self.secrets['ASTRA_TOKEN']))
+
+    def astraDatabase(self):
+        return self._get("astra_database", lambda: self.astra().get_database_by_api_endpoint(self.secrets['ASTRA_API_ENDPOINT']))
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+#
+# Content-addressed store for file contents keyed by git blob SHA. It's filled while ingesting, so answering
+# a question doesn't need to download the files from GitHub again. Recently used contents stay in memory,
+# everything is kept on disk as well so it survives restarts and is shared by all sessions.
+#
+
+class ContentStore():
+    """Blob SHA -> file content, with an LRU memory tier in front of a disk tier"""
+
+    def __init__(self, directory: str, max_memory_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, sha: str) -> str:
+        return os.path.join(self.directory, sha[:2], sha[2:])
+
+    def _remember(self, sha: str, content: bytes):
+        with self.lock:
+            if sha in self.memory:
+                self.memory.move_to_end(sha)
+                return
+            if len(content) > self.max_memory_bytes:
+                return
+            self.memory[sha] = content
+            self.memory_bytes += len(content)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+
+    def put(self, sha: str, content: bytes):
+        path = self._path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so a reader never sees half a file
+            handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(handle, "wb") as f:
+                f.write(content)
+            os.replace(temporary, path)
+        self._remember(sha, content)
+
+    def get(self, sha: str) -> bytes:
+        with self.lock:
+            content = self.memory.get(sha)
+            if content is not None:
+                self.memory.move_to_end(sha)
+                self.stats["memory_hits"] += 1
+                return content
+        try:
+            with open(self._path(sha), "rb") as f:
+                content = f.read()
+        except OSError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["disk_hits"] += 1
+        self._remember(sha, content)
+        return content
+
+    def __contains__(self, sha: str) -> bool:
+        return sha in self.memory or os.path.exists(self._path(sha))
\ No newline at end of file
@@ -0,0 +1,129 @@
+import re
+
+from pydantic import BaseModel
+
+import chunker
+import tokens
+
+#
+# Assembles the context for the advisor prompt from the retrieved hits within a token budget.
+# Overlapping hits of the same file are merged, hits larger than an excerpt should be (e.g. whole files) are
+# narrowed to the function or class that matches the question best, hits are taken in rank order and the
+# last one that doesn't fit is trimmed, so the prompt size is predictable. What didn't make it is recorded.
+#
+
+# A part of a file to put in the context, lines are 1-based and inclusive
+class Excerpt(BaseModel):
+    path: str
+    start_line: int
+    end_line: int
+    text: str
+    rank: int = 0               # Position in the retrieval results, lower is better
+    symbol: str = ""
+
+class Context(BaseModel):
+    text: str
+    tokens: int
+    used: list[Excerpt]
+    dropped: list[str]          # Why hits were left out, e.g. "app.py:10-80 over budget"
+
+class ContextBuilder():
+    """Turns ranked excerpts into a context string of at most budget tokens"""
+
+    def __init__(self, model: str = "gpt-4o", budget: int = 6000, max_excerpt_tokens: int = 1500, min_excerpt_tokens: int = 100):
+        self.model = model
+        self.budget = budget
+        self.max_excerpt_tokens = max_excerpt_tokens
+        # Don't bother trimming an excerpt to less than this
+        self.min_excerpt_tokens = min_excerpt_tokens
+
+    # Merge excerpts of the same file that overlap or touch, keeping the best rank
+    def deduplicate(self, excerpts: list) -> tuple:
+        merged = []
+        dropped = []
+        for excerpt in sorted(excerpts, key=lambda e: (e.path, e.start_line)):
+            previous = merged[-1] if merged else None
+            if previous is not None and previous.path == excerpt.path and excerpt.start_line <= previous.end_line + 1:
+                if excerpt.end_line <= previous.end_line:
+                    dropped.append(f"{excerpt.path}:{excerpt.start_line}-{excerpt.end_line} duplicate")
+                else:
+                    # Only add the lines the previous excerpt doesn't have yet
+                    extra = excerpt.text.splitlines(keepends=True)[previous.end_line + 1 - excerpt.start_line:]
+                    if previous.text and not previous.text.endswith("\n"):
+                        previous.text += "\n"
+                    previous.text += "".join(extra)
+                    previous.end_line = excerpt.end_line
+                previous.rank = min(previous.rank, excerpt.rank)
+                if not previous.symbol:
+                    previous.symbol = excerpt.symbol
+                continue
+            merged.append(excerpt.model_copy())
+        return sorted(merged, key=lambda e: e.rank), dropped
+
+    def format(self, excerpt: Excerpt) -> str:
+        title = f"{excerpt.path} (lines {excerpt.start_line}-{excerpt.end_line})"
+        if excerpt.symbol:
+            title += f" {excerpt.symbol}"
+        return f"### {title}\n```\n{excerpt.text.rstrip()}\n```\n"
+
+    # Replace an excerpt that's too large by its symbol-level chunk with the most words of the query
+    def narrow(self, excerpt: Excerpt, query: str) -> Excerpt:
+        if tokens.count_tokens(excerpt.text, self.model) <= self.max_excerpt_tokens:
+            return excerpt
+        words = set(_words(query))
+        chunks = chunker.chunk_file(excerpt.path, excerpt.text, max_tokens=self.max_excerpt_tokens, overlap=0)
+        best = max(chunks, key=lambda c: (len(words & set(_words(c.text + " " + c.symbol))), -c.index))
+        return excerpt.model_copy(update={
+            "text": best.text,
+            "start_line": excerpt.start_line + best.start_line - 1,
+            "end_line": excerpt.start_line + best.end_line - 1,
+            "symbol": best.symbol or excerpt.symbol
+        })
+
+    def build(self, excerpts: list, query: str = "") -> Context:
+        excerpts, dropped = self.deduplicate(excerpts)
+        used = []
+        parts = []
+        total = 0
+        for excerpt in excerpts:
+            narrowed = self.narrow(excerpt, query)
+            if narrowed.end_line - narrowed.start_line != excerpt.end_line - excerpt.start_line:
+                dropped.append(f"{excerpt.path}:{excerpt.start_line}-{excerpt.end_line} narrowed to lines {narrowed.start_line}-{narrowed.end_line}")
+            excerpt = narrowed
+            part = self.format(excerpt)
+            size = tokens.count_tokens(part, self.model)
+            remaining = self.budget - total
+            if size > remaining:
+                # Trim to the lines that fit, the header and fences take a few tokens of their own
+                trimmed = None
+                if remaining >= self.min_excerpt_tokens:
+                    trimmed = self.trim(excerpt, remaining - tokens.count_tokens(self.format(excerpt.model_copy(update={"text": ""})), self.model))
+                if trimmed is None:
+                    dropped.append(f"{excerpt.path}:{excerpt.start_line}-{excerpt.end_line} over budget")
+                    continue
+                dropped.append(f"{excerpt.path}:{trimmed.end_line + 1}-{excerpt.end_line} trimmed")
+                excerpt = trimmed
+                part = self.format(excerpt)
+                size = tokens.count_tokens(part, self.model)
+            used.append(excerpt)
+            parts.append(part)
+            total += size
+        return Context(text="\n".join(parts), tokens=total, used=used, dropped=dropped)
+
+    # Keep the first lines of the excerpt that fit in max_tokens
+    def trim(self, excerpt: Excerpt, max_tokens: int) -> Excerpt:
+        kept = []
+        size = 0
+        for line in excerpt.text.splitlines(keepends=True):
+            line_tokens = tokens.count_tokens(line, self.model)
+            if size + line_tokens > max_tokens:
+                break
+            kept.append(line)
+            size += line_tokens
+        if not kept:
+            return None
+        return excerpt.model_copy(update={"text": "".join(kept), "end_line": excerpt.start_line + len(kept) - 1})
+
+# Lower case words of a text, identifiers are split on camelCase and snake_case
+def _words(text: str) -> list:
+    return [w.lower() for w in re.findall(r'[A-Za-z][a-z0-9]*|[A-Z]+(?![a-z])|\d+', text) if len(w) > 2]
\ No newline at end of file
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+#
+# Persistent cache for generated documentation. Results are keyed by repository, commit, model, prompt and a
+# fingerprint of the retrieved context, so any session asking the same question about the same code gets the
+# stored answer instead of waiting for the LLM again.
+#
+
+class ResultCache():
+    """Generated results in SQLite, evicted after ttl seconds or when there are more than max_entries"""
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 1000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self.lock = threading.Lock()
+        # Eviction runs every evict_every puts instead of on every put, so the cache can hold that many entries
+        # above max_entries, and summarizing a large repository doesn't scan the table for every file
+        self.evict_every = max(1, max_entries // 100)
+        self.puts = 0
+
+    @staticmethod
+    def key(repo: str, commit: str, model: str, prompt, context_fingerprint: str) -> str:
+        return hashlib.sha256(json.dumps([repo, commit, model, prompt, context_fingerprint], sort_keys=True).encode()).hexdigest()
+
+    # Fingerprint of what was retrieved, e.g. the path, blob SHA and lines of every hit
+    @staticmethod
+    def fingerprint(items: list) -> str:
+        return hashlib.sha256(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> str:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.connection.commit()
+                return None
+            self.connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)", (key, value, now, now))
+            self.puts += 1
+            if self.puts % self.evict_every == 0:
+                self._evict(now)
+            self.connection.commit()
+
+    # Drop expired results, then the least recently used ones above the limit, both walk an index
+    def _evict(self, now: float):
+        self.connection.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        self.connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.connection.commit()
\ No newline at end of file
@@ -0,0 +1,207 @@
+import asyncio
+import time
+
+import contextbuilder
+import doccache
+import lexical
+import mapreduce
+import ratelimit
+import streamrenderer
+import tokens
+import tracing
+from resources import MODEL
+
+#
+# Retrieval and answer generation for the advisor, and the prompts of the generated documentation.
+# Used by the Streamlit app and the batch CLI, the repository is any RepoReader and answers are streamed into
+# a placeholder when there is one.
+#
+
+SYSTEM_PROMPT = "You're an IT architect and programmer specialized in migrations of microservices."
+
+# The sections of the generated documentation: key, title, search string and question, {name} is the repository
+SECTIONS = [
+    ("overview", "Overview", "Find generic information about the {name} repository", "Provide a short summary of the code in a maximum of 100 words"),
+    ("architectural_summary", "Architectural summary", "Find the main code for the {name} repository", "Provide an architectural summary of the application"),
+    ("domain_model", "Domain model", "Find the main code for the {name} repository", "Show me the domain model of the application in a structured way (like uml)"),
+]
+
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+# How the documentation is grounded: on the files a search for every section returns, or on summaries of every
+# file of the repository (see mapreduce.py), which costs a call per changed file but covers all of the code
+DOCUMENTATION_MODES = ("retrieval", "map-reduce")
+
+# Generate all sections at once, placeholders maps section keys to where their answers are rendered.
+# Generated documentation is cached across sessions, see advisor()
+async def generate_documentation(resources, repo, placeholders: dict = None, force: bool = False, priority: int = ratelimit.INTERACTIVE, mode: str = "retrieval") -> dict:
+    placeholders = placeholders or {}
+    with tracing.span("documentation", repo=repo.getName(), force=force, mode=mode):
+        if mode == "map-reduce":
+            if resources.catalog is not None:
+                await asyncio.to_thread(resources.catalog.used, repo.getName())
+            documenter = mapreduce.MapReduceDocumenter(
+                resources,
+                repo,
+                lambda path, sha: load_content(resources, repo, {"path": path, "sha": sha}).decode(errors="replace"),
+                priority=priority,
+                concurrency=int(resources.secrets.get('OPENAI_CONCURRENCY', 8)),
+                budget=resources.context_builder.budget
+            )
+            return await documenter.generate(SECTIONS, SYSTEM_PROMPT, placeholders, force)
+        result = await asyncio.gather(*(
+            advisor(
+                resources,
+                repo,
+                search.format(name=repo.getName()),
+                question,
+                placeholders.get(key),
+                cache=True,
+                force=force,
+                priority=priority
+            )
+            for key, _, search, question in SECTIONS
+        ))
+    return {key: answer for (key, _, _, _), answer in zip(SECTIONS, result)}
+
+# With cache set, the answer is stored by repository, commit, model, prompt and retrieved context,
+# and served from the cache next time unless force is set. Someone waiting for the answer makes it interactive,
+# so it goes before background requests like attribute extraction.
+async def advisor(resources, repo, search, question, placeholder = None, cache: bool = False, force: bool = False, mode: str = "vector", priority: int = ratelimit.INTERACTIVE):
+    if resources.catalog is not None:
+        await asyncio.to_thread(resources.catalog.used, repo.getName())
+    with tracing.span("advisor", repo=repo.getName(), mode=mode, question=question) as root:
+        return await _advisor(resources, repo, search, question, placeholder, cache, force, mode, priority, root)
+
+async def _advisor(resources, repo, search, question, placeholder, cache: bool, force: bool, mode: str, priority: int, root):
+    # First find relevant information from the Vector Database and/or the lexical index
+    with tracing.span("advisor.retrieve", mode=mode):
+        results = retrieve(resources, repo, search, mode)
+
+    # Results are chunks, so only use the lines of the file they cover
+    excerpts = []
+    files = {}
+    retrieved = []
+    with tracing.span("advisor.load"):
+        for rank, result in enumerate(results):
+            print (f"Result: {result['path']}")
+            retrieved.append([result["path"], result.get("sha"), result.get("start_line"), result.get("end_line")])
+            if result["path"] not in files:
+                files[result["path"]] = load_content(resources, repo, result).decode(errors="replace").splitlines(keepends=True)
+            lines = files[result["path"]]
+            start_line, end_line = result.get("start_line", 1), result.get("end_line", len(lines))
+            excerpts.append(contextbuilder.Excerpt(path=result["path"], start_line=start_line, end_line=end_line, text="".join(lines[start_line - 1:end_line]), rank=rank, symbol=result.get("symbol", "")))
+
+        # Definitions of symbols mentioned in the question come first
+        excerpts = symbol_excerpts(resources, repo, f"{search} {question}") + excerpts
+        retrieved += [[e.path, e.start_line, e.end_line] for e in excerpts if e.rank < 0]
+
+    # Fit the excerpts in the token budget of the prompt
+    with tracing.span("advisor.context"):
+        context = resources.context_builder.build(excerpts, query=f"{search} {question}")
+    # What didn't fit goes in the trace, so the export and the Debug panel show what the answer was built without
+    root.set(context_tokens=context.tokens, excerpts=len(context.used), dropped=context.dropped)
+
+    if cache:
+        cache_key = doccache.ResultCache.key(repo.getName(), repo.getCommitSha(), MODEL, [SYSTEM_PROMPT, search, question], doccache.ResultCache.fingerprint(retrieved))
+        cached = None if force else resources.result_cache.get(cache_key)
+        root.set(cached=cached is not None)
+        if cached is not None:
+            if placeholder is not None:
+                placeholder.markdown(cached)
+            return cached
+
+    # Now pass the context to the Chat Completion
+    client = resources.chat_client
+
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": f"When constructing your answer to the question, take into account the following context:\n{context.text}"},
+        {"role": "user", "content": f"Question: {question}"}
+    ]
+    # The answer counts against the same limits as attribute extraction, which matters when many repositories are documented at once
+    requested = None
+
+    async def call():
+        nonlocal requested
+        with tracing.span("advisor.rate_limit"):
+            await resources.rate_limiter.acquire(context.tokens + ratelimit.estimate_tokens(SYSTEM_PROMPT + question) + 1000, priority=priority)
+        tracing.count("openai.calls", operation="chat")
+        tracing.count("openai.tokens_in", sum(tokens.count_tokens(m["content"], MODEL) for m in messages))
+        requested = time.monotonic()
+        return await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            stream=True
+        )
+
+    with tracing.span("advisor.generate"):
+        response = await ratelimit.retry_with_backoff(call, limiter=resources.rate_limiter)
+
+        # Time to first token, from the request until the first text came in
+        async def timed(response):
+            first = True
+            async for chunk in response:
+                if first and chunk.choices and chunk.choices[0].delta.content:
+                    tracing.record("advisor.first_token", time.monotonic() - requested)
+                    first = False
+                yield chunk
+
+        # Render the answer while it streams in, with throttled updates of the placeholder
+        answer = await streamrenderer.render_stream(timed(response), placeholder)
+        tracing.count("openai.tokens_out", tokens.count_tokens(answer, MODEL))
+
+    if cache:
+        resources.result_cache.put(cache_key, answer)
+    return answer
+
+# The best matching chunks, by vector search, BM25 or both fused with reciprocal rank fusion
+def retrieve(resources, repo, search: str, mode: str = "vector", limit: int = 5) -> list:
+    rankings = []
+    chunks = {}
+    tracing.count("advisor.retrievals", mode=mode)
+    if mode in ("hybrid", "vector"):
+        with tracing.span("retrieve.vector"):
+            results = resources.collection.find(
+                {"name": repo.getName()}, # only this repository
+                vectorize=search, # embedding to search for
+                limit=limit * 2 if mode == "hybrid" else limit,
+                projection={"name", "filename", "path", "sha", "start_line", "end_line", "symbol"} # only return these fields from the document
+            )
+        ranking = []
+        for result in results:
+            key = (result["path"], result.get("start_line"))
+            chunks.setdefault(key, result)
+            ranking.append(key)
+        rankings.append(ranking)
+    if mode in ("hybrid", "lexical"):
+        ranking = []
+        with tracing.span("retrieve.lexical"):
+            hits = resources.lexical_indexes.get(repo.getName()).search(search, limit * 2 if mode == "hybrid" else limit)
+        for _, _, metadata in hits:
+            key = (metadata["path"], metadata.get("start_line"))
+            chunks.setdefault(key, metadata)
+            ranking.append(key)
+        rankings.append(ranking)
+    return [chunks[key] for key in lexical.reciprocal_rank_fusion(rankings)[:limit]]
+
+# Excerpts with the definitions of the known symbols a text mentions, ranked before anything retrieved.
+# Ranks go up from -max_symbols * 2 in order of relevance, so the first symbol mentioned is the last to be trimmed.
+def symbol_excerpts(resources, repo, text: str, max_symbols: int = 3) -> list:
+    index = resources.symbol_indexes.get(repo.getName())
+    excerpts = []
+    for name in index.mentioned(text)[:max_symbols]:
+        for path, symbol in index.define(name)[:2]:
+            start_line, end_line = index.definitionRange(path, symbol)
+            lines = load_content(resources, repo, {"path": path, "sha": index.files[path]["sha"]}).decode(errors="replace").splitlines(keepends=True)
+            excerpts.append(contextbuilder.Excerpt(path=path, start_line=start_line, end_line=min(end_line, len(lines)), text="".join(lines[start_line - 1:end_line]), rank=-max_symbols * 2 + len(excerpts), symbol=symbol["name"]))
+    return excerpts
+
+# Contents come from the content store, GitHub is only asked for files stored before the store existed
+def load_content(resources, repo, result: dict) -> bytes:
+    content = resources.content_store.get(result["sha"]) if result.get("sha") else None
+    if content is None:
+        content = repo.getRepositoryContent(result["path"]).decoded_content
+        if result.get("sha"):
+            resources.content_store.put(result["sha"], content)
+    return content
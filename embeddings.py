@@ -0,0 +1,74 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+#
+# Client-side embeddings with a persistent cache, so text that was embedded before (unchanged files, vendored
+# files shared between repositories, the fixed documentation searches) is never sent to the embedding model again.
+#
+
+class EmbeddingCache():
+    """hash(model, text) -> vector, kept in SQLite"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    def getMany(self, keys: list) -> dict:
+        found = {}
+        with self.lock:
+            # Stay under SQLite's limit of variables per statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def putMany(self, items: dict):
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()])
+            self.connection.commit()
+
+class CachedEmbedding():
+    """Wraps an embedding function (like vectorstore.OpenAIEmbedding) so only cache misses are embedded, in batches"""
+
+    def __init__(self, embedding, cache: EmbeddingCache, model: str = None, batch_size: int = 256):
+        self.embedding = embedding
+        self.cache = cache
+        self.model = model or getattr(embedding, "model", "default")
+        self.batch_size = batch_size
+        self.stats = {"hits": 0, "misses": 0, "requests": 0}
+
+    def __call__(self, texts: list) -> np.ndarray:
+        keys = [EmbeddingCache.key(self.model, text) for text in texts]
+        vectors = self.cache.getMany(list(set(keys)))
+
+        # Identical texts in one call are embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        self.stats["hits"] += len(texts) - sum(1 for key in keys if key in missing)
+        self.stats["misses"] += len(missing)
+
+        missing_keys = list(missing)
+        for i in range(0, len(missing_keys), self.batch_size):
+            batch = missing_keys[i:i + self.batch_size]
+            embedded = self.embedding([missing[key] for key in batch])
+            self.stats["requests"] += 1
+            computed = dict(zip(batch, np.asarray(embedded, dtype=np.float32)))
+            self.cache.putMany(computed)
+            vectors.update(computed)
+
+        return np.stack([vectors[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
\ No newline at end of file
@@ -0,0 +1,257 @@
+import ast
+import re
+from typing import Optional
+
+from pydantic import BaseModel
+
+import attributes
+
+#
+# Static analysis to fill attributes.Attributes straight from the source, so the LLM is only needed
+# for languages we can't parse. Analyzers are picked by file extension and can be added with register().
+#
+
+# A function, method or class found in a file
+class Symbol(BaseModel):
+    name: str
+    kind: str                   # function, method or class
+    signature: str
+    line: int
+    parent: str = ""            # The class a method belongs to
+
+# Result of analyzing one file, a field is None when the analyzer can't compute it
+class Analysis(BaseModel):
+    language: str
+    symbols: Optional[list[Symbol]] = None
+    dependencies: Optional[list[str]] = None
+
+    def missing(self) -> list:
+        return [field for field in ("symbols", "dependencies") if getattr(self, field) is None]
+
+    # Turn the analysis into Attributes, taking fields we couldn't compute from the fallback (usually the LLM)
+    def toAttributes(self, fallback: attributes.Attributes = None) -> attributes.Attributes:
+        values = fallback.model_dump() if fallback is not None else {"function_count": 0, "functions": [], "classes_count": 0, "classes": [], "dependencies": []}
+        values["language"] = self.language
+        if self.symbols is not None:
+            functions = [s.signature for s in self.symbols if s.kind in ("function", "method")]
+            classes = [s.signature for s in self.symbols if s.kind == "class"]
+            values.update(function_count=len(functions), functions=functions, classes_count=len(classes), classes=classes)
+        if self.dependencies is not None:
+            values["dependencies"] = self.dependencies
+        return attributes.Attributes(**values)
+
+class PythonAnalyzer():
+    """Exact analysis of Python files using the ast module"""
+    language = "Python"
+
+    def analyze(self, content: str) -> Optional[Analysis]:
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            # Python 2 or otherwise broken code, leave it to the LLM
+            return None
+
+        symbols = []
+        dependencies = []
+        self._visit(tree, symbols, "")
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                dependencies.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                dependencies.append("." * node.level + (node.module or ""))
+        return Analysis(language=self.language, symbols=symbols, dependencies=_unique(dependencies))
+
+    def _visit(self, node, symbols: list, parent: str):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                signature = f"{child.name}({ast.unparse(child.args)})"
+                if child.returns is not None:
+                    signature += f" -> {ast.unparse(child.returns)}"
+                symbols.append(Symbol(name=child.name, kind="method" if parent else "function", signature=signature, line=child.lineno, parent=parent))
+                self._visit(child, symbols, "")
+            elif isinstance(child, ast.ClassDef):
+                signature = child.name
+                if child.bases:
+                    signature += f"({', '.join(ast.unparse(base) for base in child.bases)})"
+                constructor = next((n for n in child.body if isinstance(n, ast.FunctionDef) and n.name == "__init__"), None)
+                if constructor is not None:
+                    signature += f": __init__({ast.unparse(constructor.args)})"
+                symbols.append(Symbol(name=child.name, kind="class", signature=signature, line=child.lineno))
+                self._visit(child, symbols, child.name)
+            else:
+                self._visit(child, symbols, parent)
+
+class RegexAnalyzer():
+    """Lightweight analysis for languages without a parser at hand: comments are lexed out, then declarations are matched line by line"""
+
+    # Strings are matched too so comment markers inside them are left alone
+    C_COMMENTS = r'//[^\n]*|/\*.*?\*/'
+    HASH_COMMENTS = r'#[^\n]*'
+    STRINGS = r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+    KEYWORDS = {"if", "for", "while", "switch", "catch", "return", "function", "else", "new", "do", "try", "sizeof", "elif", "when"}
+
+    def __init__(self, language: str, functions: list, classes: str, constructor: str, imports: list, comments: str = C_COMMENTS):
+        self.language = language
+        self.functions = [re.compile(p, re.MULTILINE) for p in functions]
+        self.classes = re.compile(classes, re.MULTILINE)
+        self.constructor = constructor
+        self.imports = [re.compile(p, re.MULTILINE | re.DOTALL) for p in imports]
+        self.lexer = re.compile(f"{self.STRINGS}|{comments}", re.DOTALL)
+
+    # Blank out comments while keeping line numbers intact
+    def _stripComments(self, content: str) -> str:
+        def blank(match):
+            token = match.group(0)
+            if token[0] in "\"'":
+                return token
+            return "\n" * token.count("\n")
+        return self.lexer.sub(blank, content)
+
+    def analyze(self, content: str) -> Optional[Analysis]:
+        code = self._stripComments(content)
+        symbols = []
+
+        class_matches = list(self.classes.finditer(code))
+        class_names = {m.group(1) for m in class_matches}
+        for i, match in enumerate(class_matches):
+            name = match.group(1)
+            signature = name
+            # Look for the constructor between this class and the next one
+            end = class_matches[i + 1].start() if i + 1 < len(class_matches) else len(code)
+            if self.constructor:
+                constructor = re.search(self.constructor.format(name=re.escape(name)), code[match.end():end], re.MULTILINE)
+                if constructor:
+                    signature += f": {constructor.group(0).strip().rstrip('{').strip()}"
+            symbols.append(Symbol(name=name, kind="class", signature=signature, line=_line(code, match.start())))
+
+        seen = set()
+        for pattern in self.functions:
+            for match in pattern.finditer(code):
+                name = match.group(1)
+                if name in self.KEYWORDS or name in class_names or match.start(1) in seen:
+                    continue
+                seen.add(match.start(1))
+                params = match.group(2) if match.lastindex and match.lastindex >= 2 and match.group(2) else "()"
+                symbols.append(Symbol(name=name, kind="function", signature=f"{name}{params if params.startswith('(') else f'({params})'}", line=_line(code, match.start(1))))
+        symbols.sort(key=lambda s: s.line)
+
+        dependencies = []
+        for pattern in self.imports:
+            for match in pattern.finditer(code):
+                dependencies.extend(d.strip() for d in re.findall(r'"([^"]+)"', match.group(1)) or [match.group(1)])
+        return Analysis(language=self.language, symbols=symbols, dependencies=_unique(dependencies))
+
+class TextAnalyzer():
+    """Documentation and configuration files, they have no code attributes"""
+
+    def __init__(self, language: str):
+        self.language = language
+
+    def analyze(self, content: str) -> Optional[Analysis]:
+        return Analysis(language=self.language, symbols=[], dependencies=[])
+
+def _line(text: str, offset: int) -> int:
+    return text.count("\n", 0, offset) + 1
+
+def _unique(items: list) -> list:
+    return list(dict.fromkeys(item for item in items if item))
+
+# Extension -> analyzer
+ANALYZERS = {}
+
+def register(analyzer, *extensions: str):
+    for extension in extensions:
+        ANALYZERS[extension.lower()] = analyzer
+
+def get_analyzer(filename: str):
+    name = filename.lower()
+    extension = name[name.rfind("."):] if "." in name else name
+    return ANALYZERS.get(extension)
+
+# Analyze a file, None when there's no analyzer for it or it couldn't be parsed
+def analyze(filename: str, content: str) -> Optional[Analysis]:
+    analyzer = get_analyzer(filename)
+    if analyzer is None:
+        return None
+    return analyzer.analyze(content)
+
+register(PythonAnalyzer(), ".py", ".pyw", ".pyi")
+register(RegexAnalyzer(
+    "JavaScript",
+    functions=[
+        r'^[ \t]*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)\s*(\([^)]*\))',
+        r'^[ \t]*(?:export\s+)?(?:const|let|var)\s+(\w+)\s*=\s*(?:async\s+)?(\([^)]*\)|\w+)\s*=>',
+        r'^[ \t]+(?:static\s+)?(?:async\s+)?(?:get\s+|set\s+)?(\w+)\s*(\([^)]*\))\s*\{',
+    ],
+    classes=r'^[ \t]*(?:export\s+)?(?:default\s+)?class\s+(\w+)',
+    constructor=r'\bconstructor\s*\([^)]*\)',
+    imports=[r'\bimport\s+(?:[\w*{}\s,]+\s+from\s+)?[\'"]([^\'"]+)[\'"]', r'\brequire\(\s*[\'"]([^\'"]+)[\'"]\s*\)'],
+), ".js", ".jsx", ".mjs", ".cjs")
+register(RegexAnalyzer(
+    "TypeScript",
+    functions=[
+        r'^[ \t]*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)\s*(?:<[^>]*>)?\s*(\([^)]*\))',
+        r'^[ \t]*(?:export\s+)?(?:const|let|var)\s+(\w+)\s*(?::[^=]+)?=\s*(?:async\s+)?(\([^)]*\))[^=]*=>',
+        r'^[ \t]+(?:(?:public|private|protected|static|readonly|abstract|async)\s+)*(\w+)\s*(?:<[^>]*>)?\s*(\([^)]*\))\s*(?::[^{;]+)?\{',
+    ],
+    classes=r'^[ \t]*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?(?:class|interface)\s+(\w+)',
+    constructor=r'\bconstructor\s*\([^)]*\)',
+    imports=[r'\bimport\s+(?:type\s+)?(?:[\w*{}\s,]+\s+from\s+)?[\'"]([^\'"]+)[\'"]', r'\brequire\(\s*[\'"]([^\'"]+)[\'"]\s*\)'],
+), ".ts", ".tsx")
+register(RegexAnalyzer(
+    "Java",
+    functions=[r'^[ \t]*(?:(?:public|protected|private|static|final|abstract|synchronized|native|default)\s+)*(?:<[^>]*>\s+)?[\w<>\[\],.?]+\s+(\w+)\s*(\([^)]*\))\s*(?:throws[^{;]*)?\{'],
+    classes=r'^[ \t]*(?:(?:public|protected|private|static|final|abstract|sealed)\s+)*(?:class|interface|enum|record)\s+(\w+)',
+    constructor=r'\b{name}\s*\([^)]*\)\s*(?:throws[^{{]*)?\{{',
+    imports=[r'^[ \t]*import\s+(?:static\s+)?([\w.*]+)\s*;'],
+), ".java")
+register(RegexAnalyzer(
+    "C#",
+    functions=[r'^[ \t]*(?:(?:public|protected|private|internal|static|virtual|override|abstract|async|sealed|extern|unsafe)\s+)*[\w<>\[\],.?]+\s+(\w+)\s*(\([^)]*\))\s*(?:where[^{]*)?\{'],
+    classes=r'^[ \t]*(?:(?:public|protected|private|internal|static|abstract|sealed|partial)\s+)*(?:class|interface|struct|record|enum)\s+(\w+)',
+    constructor=r'\b{name}\s*\([^)]*\)\s*(?::[^{{]*)?\{{',
+    imports=[r'^[ \t]*using\s+(?:static\s+)?([\w.]+)\s*;'],
+), ".cs")
+register(RegexAnalyzer(
+    "Go",
+    functions=[r'^func\s+(?:\([^)]*\)\s*)?(\w+)\s*(?:\[[^\]]*\])?\s*(\([^)]*\))'],
+    classes=r'^type\s+(\w+)\s+(?:struct|interface)\b',
+    constructor=r'^func\s+New{name}\s*\([^)]*\)',
+    imports=[r'^import\s+(?:\w+\s+)?("[^"]+")', r'^import\s*\((.*?)\)'],
+), ".go")
+register(RegexAnalyzer(
+    "Ruby",
+    functions=[r'^[ \t]*def\s+((?:self\.)?\w+[?!=]?)\s*(\([^)]*\))?'],
+    classes=r'^[ \t]*(?:class|module)\s+((?:\w+::)*\w+)',
+    constructor=r'\bdef\s+initialize\s*(?:\([^)]*\))?',
+    imports=[r'^[ \t]*require(?:_relative)?\s*\(?\s*[\'"]([^\'"]+)[\'"]'],
+    comments=RegexAnalyzer.HASH_COMMENTS,
+), ".rb")
+register(RegexAnalyzer(
+    "PHP",
+    functions=[r'\bfunction\s+&?\s*(\w+)\s*(\([^)]*\))'],
+    classes=r'^[ \t]*(?:(?:abstract|final|readonly)\s+)*(?:class|interface|trait|enum)\s+(\w+)',
+    constructor=r'\bfunction\s+__construct\s*\([^)]*\)',
+    imports=[r'^[ \t]*use\s+([\w\\]+)', r'\b(?:require|include)(?:_once)?\s*\(?\s*[\'"]([^\'"]+)[\'"]'],
+    comments=RegexAnalyzer.C_COMMENTS + "|" + RegexAnalyzer.HASH_COMMENTS,
+), ".php")
+register(RegexAnalyzer(
+    "Rust",
+    functions=[r'^[ \t]*(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?(?:extern\s+"[^"]*"\s+)?fn\s+(\w+)\s*(?:<[^>]*>)?\s*(\([^)]*\))'],
+    classes=r'^[ \t]*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait)\s+(\w+)',
+    constructor=r'\bfn\s+new\s*\([^)]*\)',
+    imports=[r'^[ \t]*(?:pub\s+)?use\s+([\w:]+)', r'^[ \t]*extern\s+crate\s+(\w+)'],
+), ".rs")
+register(RegexAnalyzer(
+    "C/C++",
+    # Type tokens and the spaces and pointer or reference sigils between them share no characters, so a line that
+    # isn't a definition fails in linear time instead of trying every way of splitting it
+    functions=[r'^(?!\s)(?:[\w:<>,]+[ \t\*&]+)+(\w+(?:::~?\w+)?)\s*(\([^;{)]*\))\s*(?:const\s*)?(?:noexcept\s*)?\{'],
+    classes=r'^[ \t]*(?:class|struct)\s+(\w+)\s*(?:final\s*)?(?::[^{;]*)?\{',
+    constructor=r'\b{name}\s*\([^;{{)]*\)\s*(?::[^{{]*)?\{{',
+    imports=[r'^[ \t]*#\s*include\s*[<"]([^>"]+)[>"]'],
+), ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh")
+register(TextAnalyzer("Markdown"), ".md", ".markdown", ".rst", ".txt")
+register(TextAnalyzer("JSON"), ".json")
+register(TextAnalyzer("YAML"), ".yml", ".yaml")
+register(TextAnalyzer("TOML"), ".toml")
\ No newline at end of file
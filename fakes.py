@@ -0,0 +1,290 @@
+import asyncio
+import base64
+import hashlib
+import io
+import random
+import tarfile
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import attributes
+import reporeader
+import tokens
+import vectorstore
+
+#
+# Local stand-ins for GitHub, OpenAI and Astra DB with the same surface the app uses, backed by synthetic
+# repositories. Every call is counted and can be given a latency, so the benchmark measures the app itself
+# and how many API calls it makes, without any network.
+#
+
+class CallCounter():
+    """Thread-safe counts of API calls, tokens and bytes, by name"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(sorted(self.counts.items()))
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+# A repository of Python modules and Markdown files, path -> content, the same for the same seed
+def synthetic_repository(files: int = 200, functions: int = 8, seed: int = 0) -> dict:
+    generator = random.Random(seed)
+    words = ["order", "customer", "invoice", "payment", "account", "report", "session", "token", "cache", "queue", "event", "user"]
+    repository = {"README.md": b"# Synthetic repository\n\nGenerated for benchmarks.\n"}
+    for number in range(files - 1):
+        package = f"pkg{number % 10}"
+        if number % 10 == 9:
+            repository[f"docs/{package}/notes{number}.md"] = "\n".join(f"## {w.title()}\n\nHow the {w} is handled.\n" for w in generator.sample(words, 4)).encode()
+            continue
+        noun = generator.choice(words)
+        lines = [f"import os\nfrom {package} import helpers\n\n", f"class {noun.title()}Service{number}():\n", f"    \"\"\"Handles {noun} requests\"\"\"\n\n", "    def __init__(self, client):\n        self.client = client\n\n"]
+        for function in range(functions):
+            verb = generator.choice(["get", "create", "update", "delete", "list", "validate"])
+            lines.append(f"    def {verb}{noun.title()}{function}(self, {noun}_id: str, payload: dict = None):\n")
+            lines += [f"        value = self.client.call('{verb}', {noun}_id, payload, {i})\n" for i in range(generator.randint(3, 12))]
+            lines.append("        return value\n\n")
+        repository[f"src/{package}/{noun}_{number}.py"] = "".join(lines).encode()
+    return repository
+
+def _sleep(latency: float):
+    if latency:
+        time.sleep(latency)
+
+class FakeContentFile():
+    """A PyGithub ContentFile, decoded_content counts as a call"""
+
+    def __init__(self, path: str, content: bytes = None, counter: CallCounter = None, latency: float = 0.0):
+        self.path = path
+        self.name = path.rsplit("/", 1)[-1]
+        self.type = "dir" if content is None else "file"
+        self.size = len(content) if content is not None else 0
+        self.sha = reporeader.git_blob_sha(content) if content is not None else hashlib.sha1(path.encode()).hexdigest()
+        self._content = content
+        self.counter = counter
+        self.latency = latency
+
+    @property
+    def decoded_content(self) -> bytes:
+        self.counter.add("github.decoded_content")
+        self.counter.add("github.bytes", len(self._content))
+        _sleep(self.latency)
+        return self._content
+
+class FakeRepository():
+    """A PyGithub Repository over an in-memory repository, for the api and tree modes"""
+
+    def __init__(self, name: str, files: dict, counter: CallCounter = None, latency: float = 0.0):
+        self.name = name
+        self.full_name = name
+        self.default_branch = "main"
+        self.stargazers_count = 42
+        self.files = files
+        self.counter = counter or CallCounter()
+        self.latency = latency
+        self.commit = hashlib.sha1("".join(sorted(files)).encode()).hexdigest()
+        self.blobs = {reporeader.git_blob_sha(content): content for content in files.values()}
+
+    def _call(self, name: str):
+        self.counter.add(f"github.{name}")
+        _sleep(self.latency)
+
+    def get_topics(self) -> list:
+        self._call("get_topics")
+        return ["benchmark", "synthetic"]
+
+    def get_branch(self, branch: str):
+        self._call("get_branch")
+        return SimpleNamespace(name=branch, commit=SimpleNamespace(sha=self.commit))
+
+    # The entries of a directory, or the file itself
+    def get_contents(self, path: str = ""):
+        self._call("get_contents")
+        path = path.strip("/")
+        if path in self.files:
+            return FakeContentFile(path, self.files[path], self.counter, self.latency)
+        prefix = path + "/" if path else ""
+        entries = {}
+        for file_path in self.files:
+            if file_path.startswith(prefix):
+                name, _, rest = file_path[len(prefix):].partition("/")
+                entries[prefix + name] = None if rest else self.files[file_path]
+        return [FakeContentFile(p, content, self.counter, self.latency) for p, content in sorted(entries.items())]
+
+    def get_git_tree(self, sha: str, recursive: bool = False):
+        self._call("get_git_tree")
+        tree = [SimpleNamespace(path=path, type="blob", sha=reporeader.git_blob_sha(content), size=len(content)) for path, content in sorted(self.files.items())]
+        return SimpleNamespace(sha=sha, tree=tree, raw_data={"truncated": False})
+
+    def get_git_blob(self, sha: str):
+        self._call("get_git_blob")
+        content = self.blobs[sha]
+        self.counter.add("github.bytes", len(content))
+        return SimpleNamespace(sha=sha, content=base64.b64encode(content).decode(), encoding="base64")
+
+    # Served by a FakeSession, like GitHub redirects the link to codeload
+    def get_archive_link(self, archive_format: str, ref: str = None) -> str:
+        self._call("get_archive_link")
+        return f"https://codeload.fake/{self.name}/{archive_format}/{ref or self.default_branch}"
+
+    # The repository as GitHub's tarball, with every path under a "<owner>-<repo>-<sha>/" folder, built once
+    def tarball(self) -> bytes:
+        if not hasattr(self, "_tarball"):
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+                folder = f"{self.name.replace('/', '-')}-{self.commit[:7]}"
+                for path, content in sorted(self.files.items()):
+                    info = tarfile.TarInfo(f"{folder}/{path}")
+                    info.size = len(content)
+                    archive.addfile(info, io.BytesIO(content))
+            self._tarball = buffer.getvalue()
+        return self._tarball
+
+class FakeGithub():
+    """A PyGithub Github handle serving FakeRepositories by name"""
+
+    def __init__(self, repositories: dict, counter: CallCounter = None):
+        self.repositories = repositories
+        self.counter = counter or CallCounter()
+
+    def get_user(self):
+        return SimpleNamespace(get_repo=self.get_repo)
+
+    def get_repo(self, name: str) -> FakeRepository:
+        self.counter.add("github.get_repo")
+        return self.repositories[name]
+
+class FakeResponse():
+    """A streamed requests response"""
+
+    def __init__(self, content: bytes):
+        self.raw = io.BytesIO(content)
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.raw.close()
+
+class FakeSession():
+    """A requests session serving the archive links of a FakeGithub's repositories, for the tarball mode"""
+
+    def __init__(self, github: FakeGithub, counter: CallCounter = None, latency: float = 0.0):
+        self.github = github
+        self.counter = counter or CallCounter()
+        self.latency = latency
+
+    def get(self, url: str, headers: dict = None, stream: bool = False, timeout: float = None) -> FakeResponse:
+        name = url.split("/", 3)[3].rsplit("/", 2)[0]
+        content = self.github.repositories[name].tarball()
+        self.counter.add("github.tarball")
+        self.counter.add("github.bytes", len(content))
+        _sleep(self.latency)
+        return FakeResponse(content)
+
+class FakeCompletions():
+    """chat.completions of an AsyncOpenAI client, and of instructor when a response_model is given"""
+
+    def __init__(self, counter: CallCounter, latency: float = 0.5, token_latency: float = 0.002, answer_tokens: int = 200):
+        self.counter = counter
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+
+    async def create(self, model: str = None, messages: list = (), stream: bool = False, response_model = None, **kwargs):
+        prompt_tokens = sum(tokens.count_tokens(m["content"], model or "gpt-4o") for m in messages)
+        self.counter.add("openai.chat")
+        self.counter.add("openai.tokens_in", prompt_tokens)
+        await asyncio.sleep(self.latency)
+        if response_model is not None:
+            self.counter.add("openai.tokens_out", 50)
+            return _structured(response_model)
+        self.counter.add("openai.tokens_out", self.answer_tokens)
+        if stream:
+            return self._stream()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=_answer(self.answer_tokens)))])
+
+    async def _stream(self):
+        for word in _answer(self.answer_tokens).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+class FakeEmbeddings():
+    """embeddings of a (sync) OpenAI client, vectors come from a HashingEmbedding"""
+
+    def __init__(self, counter: CallCounter, latency: float = 0.1):
+        self.counter = counter
+        self.latency = latency
+        self.embedding = vectorstore.HashingEmbedding(dimension=1536)
+
+    def create(self, model: str = None, input: list = ()):
+        self.counter.add("openai.embeddings")
+        self.counter.add("openai.embedded_texts", len(input))
+        _sleep(self.latency)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=vector.tolist()) for vector in self.embedding(list(input))])
+
+class FakeOpenAI():
+    """Stands in for OpenAI, AsyncOpenAI and instructor.from_openai(AsyncOpenAI)"""
+
+    def __init__(self, counter: CallCounter = None, latency: float = 0.5, token_latency: float = 0.002, answer_tokens: int = 200):
+        self.counter = counter or CallCounter()
+        self.chat = SimpleNamespace(completions=FakeCompletions(self.counter, latency, token_latency, answer_tokens))
+        self.embeddings = FakeEmbeddings(self.counter, latency / 5)
+
+class FakeCollection(vectorstore.VectorStore):
+    """A vector collection with the same find/insert_one/insert_many/delete_many surface, kept in a LocalVectorStore"""
+
+    def __init__(self, counter: CallCounter = None, latency: float = 0.02):
+        self.counter = counter or CallCounter()
+        self.latency = latency
+        self.store = vectorstore.LocalVectorStore()
+
+    def _call(self, name: str):
+        self.counter.add(f"astra.{name}")
+        _sleep(self.latency)
+
+    def insert_one(self, document: dict):
+        self._call("insert_one")
+        return self.store.insert_one(document)
+
+    def insert_many(self, documents: list, ordered: bool = False):
+        self._call("insert_many")
+        self.counter.add("astra.documents", len(documents))
+        return self.store.insert_many(documents, ordered=ordered)
+
+    def delete_many(self, filter: dict):
+        self._call("delete_many")
+        return self.store.delete_many(filter)
+
+    def find(self, filter: dict = None, vectorize: str = None, vector: list = None, limit: int = None, projection = None) -> list:
+        self._call("find")
+        return self.store.find(filter, vectorize=vectorize, vector=vector, limit=limit, projection=projection)
+
+    def vectorize(self, text: str) -> list:
+        return self.store.vectorize(text)
+
+# A plausible instance of a pydantic model, e.g. attributes.Attributes
+def _structured(response_model):
+    if response_model is attributes.Attributes:
+        return attributes.Attributes(language="Markdown", function_count=0, functions=[], classes_count=0, classes=[], dependencies=[])
+    defaults = {str: "", int: 0, float: 0.0, bool: False, list: []}
+    return response_model.model_construct(**{name: defaults.get(getattr(field.annotation, "__origin__", field.annotation), None) for name, field in response_model.model_fields.items()})
+
+def _answer(count: int) -> str:
+    words = ["The", "service", "layer", "handles", "orders", "and", "payments", "through", "a", "client."]
+    return " ".join(words[i % len(words)] for i in range(count))
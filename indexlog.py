@@ -0,0 +1,120 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+
+#
+# Saving of the per repository indexes (lexical.py, symbolindex.py). An index is written as a gzipped JSON snapshot,
+# after that only the files that changed are appended to a log next to it, so checkpointing every few files of a
+# long load costs what changed since the last checkpoint and not the size of the index. The log is folded into a
+# new snapshot once it holds as many files as the snapshot, like the log of vectorstore.LocalVectorStore.
+#
+
+class LoggedIndex():
+    """Snapshot and log persistence for an index of files.
+    Subclasses call _initLog(), call _changed(path) for every file they add or remove, and provide the data
+    of the whole index and of one file."""
+
+    def _initLog(self):
+        # Paths added, replaced or removed since the last save
+        self.changed = set()
+        # What's on disk: the id and number of files of the snapshot and the files logged after it,
+        # None when the next save has to write a snapshot
+        self.snapshot_id = None
+        self.snapshot = 0
+        self.logged = None
+        # Saves write in the order they took their changes
+        self.save_lock = threading.Lock()
+
+    def _changed(self, path: str):
+        self.changed.add(path)
+
+    # Everything has to be written again, e.g. after the index was cleared
+    def _resetLog(self):
+        self.changed = set()
+        self.logged = None
+
+    # The whole index as a dict that can be written as JSON, called under the lock of the index
+    def _snapshotData(self) -> dict:
+        raise NotImplementedError
+
+    # What the index holds for a file, None when it holds nothing, called under the lock of the index
+    def _fileData(self, path: str):
+        raise NotImplementedError
+
+    # Replace what the index holds for a file by data as returned by _fileData
+    def _restoreFile(self, path: str, data):
+        raise NotImplementedError
+
+    def _fileCount(self) -> int:
+        raise NotImplementedError
+
+    # Write the changes since the last save, as a new snapshot when the log has grown as large as the snapshot
+    def save(self, path: str):
+        with self.save_lock:
+            with self.lock:
+                snapshot = self.logged is None or self.logged + len(self.changed) > max(1000, self.snapshot)
+                if snapshot:
+                    snapshot_id = uuid.uuid4().hex
+                    data = {"snapshot": snapshot_id, **self._snapshotData()}
+                    files = self._fileCount()
+                elif self.changed:
+                    data = {"snapshot": self.snapshot_id, "files": {p: self._fileData(p) for p in sorted(self.changed)}}
+                changed, self.changed = self.changed, set()
+            try:
+                if snapshot:
+                    self._writeSnapshot(path, data)
+                    self.snapshot_id, self.snapshot, self.logged = snapshot_id, files, 0
+                elif changed:
+                    with open(path + ".log", "a") as f:
+                        f.write(json.dumps(data) + "\n")
+                    self.logged += len(changed)
+            except BaseException:
+                with self.lock:
+                    self.changed |= changed
+                raise
+
+    # Replacing the snapshot is what commits it, log entries of an older snapshot are ignored on load,
+    # so a crash at any point leaves a consistent index
+    def _writeSnapshot(self, path: str, data: dict):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with gzip.open(path + ".tmp", "wt") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+        if os.path.exists(path + ".log"):
+            os.remove(path + ".log")
+
+    # Apply the entries logged after the snapshot. When the last entry is torn, the next save writes a snapshot.
+    def _replayLog(self, path: str, snapshot_id: str):
+        entries = []
+        torn = False
+        if os.path.exists(path + ".log"):
+            with open(path + ".log") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        torn = True
+                        break
+        self.snapshot_id = snapshot_id
+        self.snapshot = self._fileCount()
+        self.logged = 0 if snapshot_id and not torn else None
+        for entry in entries:
+            if entry["snapshot"] != snapshot_id:
+                continue
+            for file_path, data in entry["files"].items():
+                self._restoreFile(file_path, data)
+            if self.logged is not None:
+                self.logged += len(entry["files"])
+        self.changed = set()
+
+def read_snapshot(path: str) -> dict:
+    with gzip.open(path, "rt") as f:
+        return json.load(f)
+
+# Remove the snapshot and log of an index
+def remove(path: str):
+    for name in (path, path + ".log"):
+        if os.path.exists(name):
+            os.remove(name)
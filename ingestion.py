@@ -0,0 +1,378 @@
+import asyncio
+import inspect
+from typing import Iterator
+
+import attributes
+import chunker
+import extractors
+import ratelimit
+import tokens
+import tracing
+from resources import MODEL
+from writebuffer import WriteBuffer
+
+#
+# Keeps the documents of a repository in the vector collection in sync with the repository itself.
+# Every document carries the blob SHA of its file and the commit it was ingested at, so on a resubmit
+# only changed files are processed again, removed files are deleted and everything else is skipped.
+#
+
+class RepositorySync():
+    """Incremental sync of one repository into the collection"""
+
+    def __init__(self, collection, name: str, commit: str, full: bool = False, batch_size: int = 50, indexed: dict = None):
+        self.collection = collection
+        self.name = name
+        self.commit = commit
+        # Path -> blob SHA of what the lexical and symbol indexes hold, a file is only skipped when they have it too
+        self.indexed = indexed if indexed is not None and not full else {}
+        self.seen = set()
+        self.unchanged = 0
+        self.removed = []
+        self.replaced = set()
+        self.buffer = WriteBuffer(collection, batch_size=batch_size, before_flush=self._deleteReplaced)
+
+        if full:
+            # Just dump the data as we'll load it again
+            self.collection.delete_many({"name": self.name})
+            self.ingested = {}
+        else:
+            self.ingested = self.loadIngested()
+
+    # Path -> blob SHA of everything currently stored for the repository
+    def loadIngested(self) -> dict:
+        ingested = {}
+        with tracing.span("ingest.load_ingested"):
+            for document in self.collection.find({"name": self.name}, projection={"path": True, "sha": True}):
+                ingested[document["path"]] = document.get("sha")
+        return ingested
+
+    # Pass through only the files that are new or have a different blob SHA
+    def changedFiles(self, files) -> Iterator:
+        for file in files:
+            self.seen.add(file.path)
+            if file.sha is not None and self.ingested.get(file.path) == file.sha and self.indexed.get(file.path) == file.sha:
+                self.unchanged += 1
+                continue
+            yield file
+
+    # Stamp the document with what it was built from and replace any older version of the file,
+    # a file can be stored as several documents (chunks) that all carry the same path and SHA.
+    # The old version is deleted once, with the first chunk, as later chunks may come after that delete ran.
+    def upsert(self, document: dict, sha: str):
+        document["sha"] = sha
+        document["commit"] = self.commit
+        if document["path"] in self.ingested:
+            del self.ingested[document["path"]]
+            self.replaced.add(document["path"])
+        self.buffer.add(document)
+
+    # Old versions of changed files go in one delete right before their replacements are written
+    def _deleteReplaced(self):
+        if self.replaced:
+            self.collection.delete_many({"name": self.name, "path": {"$in": sorted(self.replaced)}})
+            self.replaced = set()
+
+    # Write what's still buffered and delete the documents of files that are no longer in the repository,
+    # call after all files were seen
+    def removeDeleted(self) -> list:
+        self.buffer.flush()
+        self.removed = [path for path in dict.fromkeys([*self.ingested, *self.indexed]) if path not in self.seen]
+        if self.removed:
+            self.collection.delete_many({"name": self.name, "path": {"$in": self.removed}})
+        self.collection.persist()
+        return self.removed
+
+    def summary(self) -> str:
+        summary = f"Commit {self.commit or 'n/a'}: skipped {self.unchanged} unchanged file(s), removed {len(self.removed)} deleted file(s)."
+        if self.buffer.failed:
+            summary += f" {len(self.buffer.failed)} document(s) could not be written: {', '.join(d['path'] for d in self.buffer.failed)}."
+        return summary
+
+_DONE = object()
+
+# Run worker(file) for every file with at most `concurrency` calls in flight.
+# on_result(index, file, result, error) is called in the order the files came in, whatever order they finish in.
+# At most `window` files past the next one to report are taken on, so a slow file never lets results pile up
+# and memory stays bounded however large the repository is.
+async def process_files(files, worker, on_result, concurrency: int = 8, window: int = None):
+    window = window or concurrency * 4
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    finished = {}
+    next_index = 0
+    progress = asyncio.Condition()
+    # Set when reporting stopped, e.g. because on_result raised, no more files are taken on then
+    stopped = asyncio.Event()
+
+    # Files are read from a blocking iterator, so pull them in a thread and keep the event loop free
+    async def produce():
+        iterator = iter(files)
+        index = 0
+        try:
+            while not stopped.is_set():
+                file = await asyncio.to_thread(next, iterator, _DONE)
+                if file is _DONE:
+                    break
+                await queue.put((index, file))
+                index += 1
+        finally:
+            for _ in range(concurrency):
+                await queue.put(_DONE)
+
+    async def work():
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            index, file = item
+            async with progress:
+                await progress.wait_for(lambda: index < next_index + window or stopped.is_set())
+            if stopped.is_set():
+                continue
+            try:
+                finished[index] = (file, await worker(file), None)
+            except Exception as e:
+                finished[index] = (file, None, e)
+            async with progress:
+                progress.notify_all()
+
+    # Report results in order as soon as the next one in line is available
+    async def report():
+        nonlocal next_index
+        try:
+            while True:
+                async with progress:
+                    await progress.wait_for(lambda: next_index in finished or all_done.is_set())
+                while next_index in finished:
+                    file, result, error = finished.pop(next_index)
+                    outcome = on_result(next_index, file, result, error)
+                    if inspect.isawaitable(outcome):
+                        await outcome
+                    next_index += 1
+                # Let workers waiting for the window go on
+                async with progress:
+                    progress.notify_all()
+                # Once everything stopped, results after a gap were left by a worker that was cancelled
+                if all_done.is_set() and next_index not in finished:
+                    return
+        finally:
+            stopped.set()
+            async with progress:
+                progress.notify_all()
+
+    all_done = asyncio.Event()
+    reporter = asyncio.create_task(report())
+    tasks = [asyncio.create_task(produce()), *(asyncio.create_task(work()) for _ in range(concurrency))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # When the files iterator raised or we were cancelled, the workers must not keep running on their own
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        all_done.set()
+        async with progress:
+            progress.notify_all()
+        await reporter
+    return next_index
+
+# Read, analyze, chunk and store every changed file of the repository, and drop the files that were removed.
+# on_progress(output) is called with the Markdown report so far after every file, the complete report is returned.
+# Every checkpoint_every files what was processed is written and the indexes are saved, so an interrupted load
+# resumes from there: files that are both in the collection and the indexes at the same SHA are skipped.
+async def ingest_repository(resources, repo, full: bool = False, on_progress = None, checkpoint_every: int = 50) -> str:
+    with tracing.span("ingest", repo=repo.getName(), mode=repo.mode, full=full) as root:
+        return await _ingestRepository(resources, repo, full, on_progress, checkpoint_every, root)
+
+async def _ingestRepository(resources, repo, full: bool, on_progress, checkpoint_every: int, root) -> str:
+    secrets = resources.secrets
+    contents_output = "The provided repository contains the following files and information:\n"
+    # The lexical and symbol indexes hold every file, files they don't have are read again
+    lexical_index = resources.lexical_indexes.get(repo.getName())
+    symbol_index = resources.symbol_indexes.get(repo.getName())
+    if full:
+        lexical_index.clear()
+        symbol_index.clear()
+    with symbol_index.lock:
+        indexed = {path: entry["sha"] for path, entry in symbol_index.files.items()} if lexical_index.documents else {}
+    tracing.count("ingest.runs")
+    sync = RepositorySync(resources.collection, repo.getName(), repo.getCommitSha(), full=full, batch_size=int(secrets.get('ASTRA_BATCH_SIZE', 50)), indexed=indexed)
+    # Files are streamed from the reader and skipped before they're fetched when too large, vendored or binary
+    repo.setMaxFileSize(int(secrets.get('MAX_FILE_KB', 512)) * 1024)
+    contents = sync.changedFiles(repo.getRepositoryContents())
+    # The same for every document, so fetched once instead of for every chunk
+    metadata = await asyncio.to_thread(repo.getMetadata)
+    binary = []
+    stored = 0
+
+    def report():
+        if on_progress is not None:
+            on_progress(contents_output)
+
+    # Write what's buffered before saving the indexes, so they never hold a file the collection doesn't.
+    # The indexes only append the files that changed since the last checkpoint, see indexlog.py.
+    def checkpoint():
+        with tracing.span("ingest.checkpoint"):
+            sync.buffer.flush()
+            resources.collection.persist()
+            resources.lexical_indexes.save(repo.getName())
+            resources.symbol_indexes.save(repo.getName())
+
+    # Fetch and decode the file once, then extract its attributes, many files at a time
+    # The raw content also goes in the content store, so answering questions doesn't need GitHub
+    async def process(c):
+        with tracing.span("ingest.file", path=c.path):
+            with tracing.span("ingest.fetch"):
+                raw = await asyncio.to_thread(lambda: c.decoded_content)
+            # Binary content with a text extension
+            if b"\0" in raw[:8192]:
+                return None
+            if c.sha:
+                with tracing.span("ingest.content_store"):
+                    await asyncio.to_thread(resources.content_store.put, c.sha, raw)
+            content = raw.decode(errors="replace")
+            with tracing.span("ingest.analyze"):
+                analysis = extractors.analyze(c.name, content)
+            with tracing.span("ingest.attributes"):
+                file_attributes = await extract_attributes(resources, c.name, content, analysis)
+            return content, file_attributes, analysis
+
+    # Called in file order, so the progress output reads the same as when processing one by one
+    async def store(index, c, result, error):
+        nonlocal contents_output, stored
+        if error is None and result is None:
+            binary.append(c.path)
+            return
+        contents_output += f"- {c.name}\n"
+        if error is not None:
+            contents_output += f"\t- error: {error}\n"
+            report()
+            return
+        content, file_attributes, analysis = result
+        tracing.count("ingest.files")
+        with tracing.span("ingest.index", path=c.path):
+            symbol_index.addFile(c.path, c.sha, analysis, content)
+
+        # Show the attributes for the file, they're stored with its first chunk
+        for attribute in file_attributes:
+                if attribute[1] != "":
+                    contents_output += f"\t- {attribute[0]}: {attribute[1]}\n"
+
+        # Create a JSON documnent for every chunk of the file, with the file it belongs to and the lines it covers
+        with tracing.span("ingest.chunk", path=c.path):
+            chunks = chunker.chunk_file(c.name, content, max_tokens=int(secrets.get('CHUNK_TOKENS', 512)), overlap=int(secrets.get('CHUNK_OVERLAP', 64)))
+        contents_output += f"\t- chunks: {len(chunks)}\n"
+        report()
+        # One span per file for the lexical index and one for the writes, not one per chunk
+        with tracing.span("ingest.index", path=c.path, chunks=len(chunks)):
+            lexical_index.removePath(c.path)
+            for chunk in chunks:
+                lexical_index.add(f"{c.path}#{chunk.index}", f"{c.path}\n{chunk.text}", {"path": c.path, "sha": c.sha, "start_line": chunk.start_line, "end_line": chunk.end_line, "symbol": chunk.symbol}, symbols=[chunk.symbol])
+
+        documents = []
+        for chunk in chunks:
+            context = {
+                "type": "vectordata",
+                "name": repo.getName(),
+                "topics": metadata["topics"],
+                "stars": metadata["stars"],
+                "filename": c.name,
+                "path": c.path,
+                "size": c.size,
+                "chunk": chunk.index,
+                "chunks": len(chunks),
+                "start_line": chunk.start_line,
+                "end_line": chunk.end_line,
+                "symbol": chunk.symbol,
+                "$vectorize": f"Repository name: {repo.getName()}\nFile name: {c.name}\nLines: {chunk.start_line}-{chunk.end_line}\nContent {chunk.text}"
+            }
+            if chunk.index == 0:
+                context["attributes"] = file_attributes.model_dump_json()
+            documents.append(context)
+
+        # Queue the JSON documents for batched writes to Astra DB, replacing the previous version of the file
+        def upsert():
+            for document in documents:
+                sync.upsert(document, c.sha)
+
+        with tracing.span("ingest.upsert", path=c.path, chunks=len(chunks)):
+            await asyncio.to_thread(upsert)
+
+        stored += 1
+        if checkpoint_every and stored % checkpoint_every == 0:
+            await asyncio.to_thread(checkpoint)
+
+    await process_files(contents, process, store, concurrency=int(secrets.get('OPENAI_CONCURRENCY', 8)))
+
+    with tracing.span("ingest.finish"):
+        await asyncio.to_thread(sync.removeDeleted)
+        for path in sync.removed:
+            lexical_index.removePath(path)
+            symbol_index.removePath(path)
+        await asyncio.to_thread(resources.lexical_indexes.save, repo.getName())
+        await asyncio.to_thread(resources.symbol_indexes.save, repo.getName())
+        if resources.catalog is not None:
+            await asyncio.to_thread(resources.catalog.ingested, repo.getName(), sync.commit, len(symbol_index.files))
+    skipped = {**repo.skipped, "binary": repo.skipped.get("binary", 0) + len(binary)} if binary else repo.skipped
+    root.set(unchanged=sync.unchanged, removed=len(sync.removed), skipped=sum(skipped.values()))
+    contents_output += f"\n{sync.summary()}\n"
+    if skipped:
+        contents_output += "Skipped " + ", ".join(f"{count} {reason}" for reason, count in sorted(skipped.items())) + " file(s).\n"
+    report()
+    return contents_output
+
+# Remove a repository from the collection, the indexes and the catalog
+def remove_repository(resources, name: str):
+    with tracing.span("remove repository", repo=name):
+        resources.collection.dropRepository(name)
+        resources.collection.persist()
+        resources.lexical_indexes.remove(name)
+        resources.symbol_indexes.remove(name)
+        if resources.catalog is not None:
+            resources.catalog.remove(name)
+
+# Remove the repositories that weren't loaded or asked about for max_age_days, returns their names
+def prune_repositories(resources, max_age_days: float) -> list:
+    if resources.catalog is None:
+        return []
+    stale = resources.catalog.stale(max_age_days * 24 * 3600)
+    for name in stale:
+        remove_repository(resources, name)
+    return stale
+
+# Compute the attributes with static analysis and only ask the LLM for what couldn't be computed
+async def extract_attributes(resources, filename: str, content: str, analysis: extractors.Analysis = None) -> attributes.Attributes:
+    if analysis is None:
+        analysis = extractors.analyze(filename, content)
+    if analysis is not None and not analysis.missing():
+        return analysis.toAttributes()
+
+    response = await generate_attributes(resources, {"filename": filename, "content": content})
+    if analysis is not None:
+        return analysis.toAttributes(response)
+    return response
+
+async def generate_attributes(resources, context: str):
+    client = resources.attributes_client
+    limiter = resources.rate_limiter
+    messages = [
+        {"role": "system", "content": f"""You're a programmer and you specialize in understanding all kinds of code.
+Your task is to extract relevant attributes like langauge, number of functions defined, classes, and more. Only do this for actual code.
+Use only the following context: {context}"""},
+        {"role": "user", "content": "Extract the requested attributes from the provided code. Do not process README.md files"}
+    ]
+
+    async def call():
+        await limiter.acquire(ratelimit.estimate_tokens(messages[0]["content"]) + 500, priority=ratelimit.BACKGROUND)
+        with tracing.span("openai.attributes"):
+            tracing.count("openai.calls", operation="attributes")
+            tracing.count("openai.tokens_in", sum(tokens.count_tokens(m["content"], MODEL) for m in messages))
+            response = await client.chat.completions.create(
+                model=MODEL,
+                response_model=attributes.Attributes,
+                messages=messages
+            )
+            tracing.count("openai.tokens_out", tokens.count_tokens(response.model_dump_json(), MODEL))
+            return response
+
+    return await ratelimit.retry_with_backoff(call, limiter=limiter)
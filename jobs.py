@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import ingestion
+import reporeader
+import tracing
+
+#
+# Loading repositories as background jobs, so ingestion doesn't depend on the Streamlit script run that started it:
+# a browser refresh or a rerun by any widget no longer aborts it halfway. Jobs are kept in SQLite and worked off
+# by a few threads, each loading one repository at a time. Ingestion checkpoints every few files, and jobs that
+# were running when the process stopped are queued again on start, so they resume from their last checkpoint.
+#
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+FIELDS = ("id", "repo", "options", "status", "progress", "result", "error", "attempts", "trace_id", "created", "started", "finished")
+
+# A RepoReader for a job, options are those of JobQueue.submit
+def make_reader(repo: str, options: dict, token: str = "", registry = None) -> reporeader.RepoReader:
+    reader = reporeader.RepoReader()
+    reader.setMode(options.get("mode", reporeader.MODE_TARBALL))
+    if reader.mode == reporeader.MODE_LOCAL:
+        reader.setLocalPath(options["local_path"], repo)
+    else:
+        if registry is not None:
+            reader.connect(token, github=registry.github(token), session=registry.http())
+        else:
+            reader.connect(token)
+        reader.setRepository(repo)
+    reader.setExtensions(options.get("extensions", ".md, .py"))
+    return reader
+
+class JobQueue():
+    """Persistent queue of repositories to ingest, worked off by background threads"""
+
+    def __init__(self, path: str, resources, workers: int = 2, progress_interval: float = 1.0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.resources = resources
+        self.workers = workers
+        # Progress is written at most this often, every file would mean a write per file
+        self.progress_interval = progress_interval
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, repo TEXT, options TEXT, status TEXT, progress TEXT, result TEXT, "
+            "error TEXT, attempts INTEGER, trace_id TEXT, created REAL, started REAL, finished REAL)"
+        )
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        # GitHub tokens stay in memory, jobs resumed after a restart use GITHUB_TOKEN
+        self.tokens = {}
+        self.threads = []
+        self.stopping = False
+
+    # Start the workers, jobs that were running when the process stopped are queued again
+    def start(self):
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            self.connection.commit()
+            if self.threads:
+                return
+            self.stopping = False
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"ingestion-{number}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+            self.available.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # Queue a repository, or return the job that's already queued or running for it.
+    # options: mode, extensions, local_path and full, as in the sidebar.
+    def submit(self, repo: str, options: dict, token: str = None) -> str:
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM jobs WHERE repo = ? AND status IN (?, ?)", (repo, QUEUED, RUNNING)).fetchone()
+            job_id = row[0] if row is not None else uuid.uuid4().hex
+            if row is None:
+                self.connection.execute(
+                    "INSERT INTO jobs (id, repo, options, status, progress, attempts, created) VALUES (?, ?, ?, ?, ?, 0, ?)",
+                    (job_id, repo, json.dumps(options), QUEUED, "", time.time())
+                )
+                self.connection.commit()
+            if token is not None:
+                self.tokens[job_id] = token
+            self.available.notify()
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        with self.lock:
+            row = self.connection.execute(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    # The most recent jobs first
+    def list(self, limit: int = 20) -> list:
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {', '.join(FIELDS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def _job(self, row) -> dict:
+        job = dict(zip(FIELDS, row))
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            self.connection.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?", (*fields.values(), job_id))
+            self.connection.commit()
+
+    # Take the oldest queued job, waiting for one when there is none
+    def _claim(self) -> dict:
+        with self.lock:
+            while not self.stopping:
+                row = self.connection.execute(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)).fetchone()
+                if row is not None:
+                    job = self._job(row)
+                    job["attempts"] += 1
+                    self.connection.execute("UPDATE jobs SET status = ?, attempts = ?, started = ?, error = NULL WHERE id = ?", (RUNNING, job["attempts"], time.time(), job["id"]))
+                    self.connection.commit()
+                    return job
+                self.available.wait()
+        return None
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            try:
+                asyncio.run(self._run(job))
+            except Exception as e:
+                self._update(job["id"], status=FAILED, error=f"{type(e).__name__}: {e}", finished=time.time())
+                self.tokens.pop(job["id"], None)
+
+    async def _run(self, job: dict):
+        options = job["options"]
+        token = self.tokens.get(job["id"], self.resources.secrets.get('GITHUB_TOKEN', ''))
+        reader = await asyncio.to_thread(make_reader, job["repo"], options, token, self.resources.client_registry)
+        last_update = 0.0
+
+        def progress(output: str):
+            nonlocal last_update
+            if time.monotonic() - last_update >= self.progress_interval:
+                last_update = time.monotonic()
+                self._update(job["id"], progress=output)
+
+        # A resumed job continues from its last checkpoint instead of loading everything again
+        full = options.get("full", False) and job["attempts"] == 1
+        with tracing.span("job", repo=job["repo"], attempt=job["attempts"]) as run:
+            self._update(job["id"], trace_id=run.trace_id)
+            result = await ingestion.ingest_repository(self.resources, reader, full=full, on_progress=progress)
+        self._update(job["id"], status=DONE, progress=result, result=result, finished=time.time())
+        self.tokens.pop(job["id"], None)
@@ -0,0 +1,164 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import indexlog
+
+#
+# BM25 index over the chunks of a repository, built while ingesting. Identifier heavy questions like
+# "where is setExtensions called" match poorly on embeddings but exactly on terms, so the lexical results
+# are fused with the vector results using reciprocal rank fusion.
+#
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+')
+PART = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+# Lower case terms of a text, identifiers are kept whole and split on camelCase and snake_case as well
+def tokenize(text: str) -> list:
+    terms = []
+    for identifier in IDENTIFIER.findall(text):
+        lower = identifier.lower()
+        terms.append(lower)
+        parts = [p.lower() for p in PART.findall(identifier)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+class BM25Index(indexlog.LoggedIndex):
+    """Okapi BM25 over documents with metadata"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = {}         # id -> {"metadata": ..., "length": ..., "terms": {term: frequency}}
+        self.postings = {}          # term -> {id: frequency}
+        self.paths = {}             # path -> ids
+        self.total_length = 0
+        self.lock = threading.RLock()
+        self._initLog()
+
+    # Symbols (function, class or heading names) count double so their definitions rank first
+    def add(self, document_id: str, text: str, metadata: dict, symbols: list = ()):
+        terms = Counter(tokenize(text))
+        for symbol in symbols:
+            terms.update(tokenize(symbol))
+        with self.lock:
+            self.remove(document_id)
+            self._restoreDocument(document_id, {"metadata": metadata, "length": sum(terms.values()), "terms": dict(terms)})
+            self._changed(metadata.get("path"))
+
+    def _restoreDocument(self, document_id: str, document: dict):
+        self.documents[document_id] = document
+        self.total_length += document["length"]
+        self.paths.setdefault(document["metadata"].get("path"), set()).add(document_id)
+        for term, frequency in document["terms"].items():
+            self.postings.setdefault(term, {})[document_id] = frequency
+
+    def remove(self, document_id: str):
+        with self.lock:
+            document = self.documents.pop(document_id, None)
+            if document is None:
+                return
+            self.total_length -= document["length"]
+            self.paths.get(document["metadata"].get("path"), set()).discard(document_id)
+            self._changed(document["metadata"].get("path"))
+            for term in document["terms"]:
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(document_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    # Remove every document whose metadata has the given path
+    def removePath(self, path: str):
+        with self.lock:
+            for document_id in list(self.paths.pop(path, ())):
+                self.remove(document_id)
+
+    def clear(self):
+        with self.lock:
+            self.documents = {}
+            self.postings = {}
+            self.paths = {}
+            self.total_length = 0
+            self._resetLog()
+
+    # The best matching documents as (id, score, metadata), best first
+    def search(self, query: str, limit: int = 10) -> list:
+        with self.lock:
+            count = len(self.documents)
+            if not count:
+                return []
+            average_length = self.total_length / count
+            scores = Counter()
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for document_id, frequency in posting.items():
+                    length = self.documents[document_id]["length"]
+                    scores[document_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+            return [(document_id, score, self.documents[document_id]["metadata"]) for document_id, score in scores.most_common(limit)]
+
+    def _snapshotData(self) -> dict:
+        return {"k1": self.k1, "b": self.b, "documents": dict(self.documents)}
+
+    def _fileData(self, path: str):
+        return {document_id: self.documents[document_id] for document_id in self.paths.get(path, ())} or None
+
+    def _restoreFile(self, path: str, data):
+        data = data or {}
+        for document_id in [*self.paths.pop(path, ()), *data]:
+            self.remove(document_id)
+        for document_id, document in data.items():
+            self._restoreDocument(document_id, document)
+
+    def _fileCount(self) -> int:
+        return len(self.paths)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        data = indexlog.read_snapshot(path)
+        index = cls(data["k1"], data["b"])
+        for document_id, document in data["documents"].items():
+            index._restoreDocument(document_id, document)
+        index._replayLog(path, data.get("snapshot"))
+        return index
+
+class LexicalIndexes():
+    """One BM25 index per repository, kept in memory and saved to a directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def _path(self, repo: str) -> str:
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', repo) + ".json.gz")
+
+    def get(self, repo: str) -> BM25Index:
+        with self.lock:
+            if repo not in self.indexes:
+                path = self._path(repo)
+                self.indexes[repo] = BM25Index.load(path) if os.path.exists(path) else BM25Index()
+            return self.indexes[repo]
+
+    def save(self, repo: str):
+        self.get(repo).save(self._path(repo))
+
+    # Forget the index of a repository, in memory and on disk
+    def remove(self, repo: str):
+        with self.lock:
+            self.indexes.pop(repo, None)
+            indexlog.remove(self._path(repo))
+
+# Reciprocal rank fusion of several rankings of ids, best first
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1 / (k + rank + 1)
+    return [item for item, _ in scores.most_common()]
\ No newline at end of file
@@ -0,0 +1,204 @@
+import asyncio
+import posixpath
+
+import doccache
+import ingestion
+import ratelimit
+import streamrenderer
+import tokens
+import tracing
+from resources import MODEL
+
+#
+# Documentation grounded on the whole repository instead of the few files a search returns. Every file is
+# summarized (map), the summaries are rolled up directory by directory, and the sections are written from the
+# summary of the repository and its top level (reduce). File summaries are cached by blob SHA and directory
+# summaries by the summaries they were made from, so a later run only summarizes the files that changed and the
+# directories above them.
+#
+
+FILE_PROMPT = "Summarize what this file does for a developer who is new to the code base, in at most 120 words: its purpose, its main classes and functions, and what it depends on."
+DIRECTORY_PROMPT = "These are summaries of the files and subdirectories of the directory `{path}`. Summarize in at most 200 words what the directory is responsible for, its main components and how they relate."
+REPOSITORY_PROMPT = "These are summaries of the top level files and directories of the {name} repository. Summarize in at most 300 words what the application does, how it is structured and what its main components and concepts are."
+
+class MapReduceDocumenter():
+    """Summarizes every file and directory of an ingested repository and writes the sections from the summaries"""
+
+    def __init__(self, resources, repo, read, priority: int = ratelimit.BACKGROUND, concurrency: int = 8, max_file_tokens: int = 3000, budget: int = 6000):
+        self.resources = resources
+        self.repo = repo
+        # read(path, sha) returns the content of a file
+        self.read = read
+        # Priority of the section calls, someone may be waiting for them. Summaries always run in the background,
+        # so summarizing every file of a repository never takes the reserve meant for chat.
+        self.priority = priority
+        self.concurrency = concurrency
+        self.max_file_tokens = max_file_tokens
+        self.budget = budget
+        self.cache = resources.summary_cache or resources.result_cache
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"files": 0, "files_summarized": 0, "directories": 0, "directories_summarized": 0}
+
+    async def _complete(self, messages: list) -> str:
+        async def call():
+            await self.resources.rate_limiter.acquire(sum(tokens.count_tokens(m["content"], MODEL) for m in messages) + 500, priority=ratelimit.BACKGROUND)
+            tracing.count("openai.calls", operation="summary")
+            return await self.resources.chat_client.chat.completions.create(model=MODEL, messages=messages)
+
+        async with self.semaphore:
+            with tracing.span("mapreduce.complete"):
+                response = await ratelimit.retry_with_backoff(call, limiter=self.resources.rate_limiter)
+        return response.choices[0].message.content
+
+    # The summary of one file, from the cache when a file with the same content was summarized before
+    async def summarizeFile(self, path: str, entry: dict) -> str:
+        key = doccache.ResultCache.key("", entry["sha"], MODEL, FILE_PROMPT, "")
+        summary = self.cache.get(key)
+        if summary is not None:
+            return summary
+        content = await asyncio.to_thread(self.read, path, entry["sha"])
+        content = tokens.truncate_tokens(content, self.max_file_tokens, MODEL)
+        symbols = "\n".join(f"- {s['kind']} {s['signature']} (line {s['line']})" for s in entry["symbols"])
+        summary = await self._complete([
+            {"role": "system", "content": FILE_PROMPT},
+            {"role": "user", "content": f"File: {path}\n" + (f"Symbols:\n{symbols}\n" if symbols else "") + f"Content:\n```\n{content}\n```"}
+        ])
+        self.cache.put(key, summary)
+        self.stats["files_summarized"] += 1
+        return summary
+
+    # Summaries of every file, path -> summary. on_progress(done, total) is called after every file.
+    async def summarizeFiles(self, files: dict, on_progress = None) -> dict:
+        summaries = {}
+
+        async def summarize(item):
+            return await self.summarizeFile(*item)
+
+        def collect(index, item, summary, error):
+            summaries[item[0]] = summary if error is None else f"(no summary: {error})"
+            if on_progress is not None:
+                on_progress(len(summaries), len(files))
+
+        with tracing.span("mapreduce.files", files=len(files)):
+            await ingestion.process_files(sorted(files.items()), summarize, collect, concurrency=self.concurrency)
+        self.stats["files"] = len(files)
+        return summaries
+
+    # Condense a list of texts into one summary, in several rounds when they don't fit in the budget at once
+    async def reduce(self, items: list, instruction: str) -> str:
+        if len(items) == 1:
+            return items[0]
+        groups = [[]]
+        size = 0
+        for item in items:
+            item = tokens.truncate_tokens(item, self.budget // 2, MODEL)
+            item_tokens = tokens.count_tokens(item, MODEL)
+            if groups[-1] and size + item_tokens > self.budget:
+                groups.append([])
+                size = 0
+            groups[-1].append(item)
+            size += item_tokens
+        summaries = await asyncio.gather(*(self._complete([
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": "\n\n".join(group)}
+        ]) for group in groups))
+        if len(summaries) == 1:
+            return summaries[0]
+        return await self.reduce(summaries, instruction)
+
+    # Summaries of every directory from the deepest up, the root ("") is the summary of the repository.
+    # Returns path -> summary and directory -> its entries as (kind, path).
+    async def summarizeDirectories(self, file_summaries: dict) -> tuple:
+        children = {"": []}
+        for path in file_summaries:
+            directory = posixpath.dirname(path)
+            children.setdefault(directory, []).append(("File", path))
+            while directory:
+                parent = posixpath.dirname(directory)
+                entries = children.setdefault(parent, [])
+                if ("Directory", directory) in entries:
+                    break
+                entries.append(("Directory", directory))
+                directory = parent
+        summaries = dict(file_summaries)
+
+        async def summarize(directory):
+            items = [f"{kind} `{path}`: {summaries[path]}" for kind, path in sorted(children[directory])]
+            if not items:
+                return ""
+            # A directory with a single entry says what that entry says
+            if len(items) == 1 and directory:
+                return summaries[children[directory][0][1]]
+            instruction = DIRECTORY_PROMPT.format(path=directory) if directory else REPOSITORY_PROMPT.format(name=self.repo.getName())
+            key = doccache.ResultCache.key(self.repo.getName(), directory, MODEL, instruction, doccache.ResultCache.fingerprint(items))
+            summary = self.cache.get(key)
+            if summary is None:
+                summary = await self.reduce(items, instruction)
+                self.cache.put(key, summary)
+                self.stats["directories_summarized"] += 1
+            return summary
+
+        def depth(directory):
+            return directory.count("/") + 1 if directory else 0
+
+        # Directories of the same depth don't depend on each other
+        with tracing.span("mapreduce.directories", directories=len(children)):
+            for level in sorted({depth(d) for d in children}, reverse=True):
+                directories = [d for d in children if depth(d) == level]
+                for directory, summary in zip(directories, await asyncio.gather(*(summarize(d) for d in directories))):
+                    summaries[directory] = summary
+        self.stats["directories"] = len(children)
+        return {directory: summaries[directory] for directory in children}, children
+
+    # Write every section from the summary of the repository and of its top level entries
+    async def generate(self, sections: list, system_prompt: str, placeholders: dict = None, force: bool = False) -> dict:
+        placeholders = placeholders or {}
+        index = self.resources.symbol_indexes.get(self.repo.getName())
+        with index.lock:
+            files = {path: {"sha": entry["sha"], "symbols": entry["symbols"]} for path, entry in index.files.items()}
+
+        def progress(done, total):
+            if done == total or done % 10 == 0:
+                for placeholder in placeholders.values():
+                    placeholder.markdown(f"Summarized {done} of {total} files...")
+
+        with tracing.span("mapreduce", repo=self.repo.getName(), files=len(files)) as root:
+            file_summaries = await self.summarizeFiles(files, progress)
+            for placeholder in placeholders.values():
+                placeholder.markdown("Summarizing directories...")
+            directory_summaries, children = await self.summarizeDirectories(file_summaries)
+            summaries = {**file_summaries, **directory_summaries}
+            top_level = "\n\n".join(f"{kind} `{path}`: {summaries[path]}" for kind, path in sorted(children[""]))
+            context = tokens.truncate_tokens(f"Repository summary:\n{summaries['']}\n\nTop level:\n{top_level}", self.budget, MODEL)
+
+            result = await asyncio.gather(*(
+                self._section(system_prompt, question, context, placeholders.get(key), force)
+                for key, _, _, question in sections
+            ))
+            root.set(**self.stats)
+        return {key: answer for (key, _, _, _), answer in zip(sections, result)}
+
+    async def _section(self, system_prompt: str, question: str, context: str, placeholder, force: bool) -> str:
+        key = doccache.ResultCache.key(self.repo.getName(), self.repo.getCommitSha(), MODEL, ["map-reduce", system_prompt, question], doccache.ResultCache.fingerprint([context]))
+        cached = None if force else self.resources.result_cache.get(key)
+        if cached is not None:
+            if placeholder is not None:
+                placeholder.markdown(cached)
+            return cached
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": f"When constructing your answer to the question, take into account the following summary of the whole repository:\n{context}"},
+            {"role": "user", "content": f"Question: {question}"}
+        ]
+
+        async def call():
+            await self.resources.rate_limiter.acquire(sum(tokens.count_tokens(m["content"], MODEL) for m in messages) + 1000, priority=self.priority)
+            tracing.count("openai.calls", operation="chat")
+            return await self.resources.chat_client.chat.completions.create(model=MODEL, messages=messages, stream=True)
+
+        with tracing.span("mapreduce.section"):
+            response = await ratelimit.retry_with_backoff(call, limiter=self.resources.rate_limiter)
+            answer = await streamrenderer.render_stream(response, placeholder)
+        self.resources.result_cache.put(key, answer)
+        return answer
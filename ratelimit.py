@@ -0,0 +1,194 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+import tracing
+
+#
+# Rate limiting and retries for the LLM calls, so concurrent requests stay within the requests and tokens per minute of the API.
+# Interactive requests (chat) go before background ones (ingestion, batch documentation), and a 429 with a
+# Retry-After header pauses everyone sharing the limiter instead of only the request that got it.
+#
+
+# Request priorities, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+class RateLimiter():
+    """Token buckets for requests per minute and tokens per minute"""
+
+    def __init__(self, requests_per_minute: int = 500, tokens_per_minute: int = 30000, reserve: float = 0.1):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # Share of both buckets background requests leave for interactive ones
+        self.reserve = reserve
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = self._now()
+        self.paused_until = 0.0
+        # Callers waiting for their turn, by priority
+        self.waiting = [0] * len(PRIORITIES)
+        # A thread lock as Streamlit sessions run in their own threads and event loops
+        self.lock = threading.Lock()
+
+    def _now(self) -> float:
+        return time.monotonic()
+
+    # Run fn on the state of the limiter under its lock
+    def _synchronized(self, fn, *args):
+        with self.lock:
+            return fn(*args)
+
+    def _refill(self):
+        now = self._now()
+        elapsed = max(0, now - self.updated)
+        self.updated = now
+        self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+
+    # Take one request and the given amount of tokens, or return how long to wait before trying again.
+    # waiting is set when the caller already counts as a waiter of its priority.
+    def _tryAcquire(self, tokens: int, priority: int = BACKGROUND, waiting: bool = False) -> float:
+        return self._synchronized(self._take, tokens, priority, waiting)
+
+    def _take(self, tokens: int, priority: int = BACKGROUND, waiting: bool = False) -> float:
+        # A single request larger than the whole budget only has to wait for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        self._refill()
+        wait = self._wait(tokens, priority)
+        if wait == 0:
+            self.requests -= 1
+            self.tokens -= tokens
+            if waiting:
+                self.waiting[priority] -= 1
+        elif not waiting:
+            self.waiting[priority] += 1
+        return wait
+
+    def _wait(self, tokens: int, priority: int) -> float:
+        now = self._now()
+        if self.paused_until > now:
+            return self.paused_until - now
+        # Background requests wait for queued interactive ones, and don't take the reserve
+        if any(self.waiting[p] for p in range(priority)):
+            return 0.05
+        reserve = self.reserve if priority != INTERACTIVE else 0
+        needed_requests = min(self.requests_per_minute, 1 + reserve * self.requests_per_minute)
+        needed_tokens = min(self.tokens_per_minute, tokens + reserve * self.tokens_per_minute)
+        if self.requests >= needed_requests and self.tokens >= needed_tokens:
+            return 0
+        request_wait = max(0, needed_requests - self.requests) * 60 / self.requests_per_minute
+        token_wait = max(0, needed_tokens - self.tokens) * 60 / self.tokens_per_minute
+        return max(request_wait, token_wait)
+
+    def _leave(self, priority: int):
+        self.waiting[priority] -= 1
+
+    def _pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self._now() + seconds)
+
+    async def acquire(self, tokens: int = 0, priority: int = BACKGROUND):
+        waiting = False
+        try:
+            while True:
+                wait = self._tryAcquire(tokens, priority, waiting)
+                if wait == 0:
+                    waiting = False
+                    return
+                waiting = True
+                await asyncio.sleep(wait)
+        finally:
+            # Cancelled while waiting
+            if waiting:
+                self._synchronized(self._leave, priority)
+
+    # Hold all requests for the given time, e.g. what a 429 said in Retry-After
+    def pause(self, seconds: float):
+        self._synchronized(self._pause, seconds)
+
+class SharedRateLimiter(RateLimiter):
+    """A RateLimiter whose buckets live in a multiprocessing manager, so worker processes share one budget"""
+
+    STATE = ("requests", "tokens", "updated", "paused_until", "waiting")
+
+    def __init__(self, manager, requests_per_minute: int = 500, tokens_per_minute: int = 30000, reserve: float = 0.1):
+        super().__init__(requests_per_minute, tokens_per_minute, reserve)
+        self.lock = manager.Lock()
+        self.state = manager.dict({name: getattr(self, name) for name in self.STATE})
+
+    # The proxies pickle, so the limiter can be handed to pool workers as is
+    def __getstate__(self):
+        return {"requests_per_minute": self.requests_per_minute, "tokens_per_minute": self.tokens_per_minute, "reserve": self.reserve, "lock": self.lock, "state": self.state}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    # Wall clock time, monotonic clocks aren't comparable between processes on every platform
+    def _now(self) -> float:
+        return time.time()
+
+    def _synchronized(self, fn, *args):
+        with self.lock:
+            for name, value in self.state.copy().items():
+                setattr(self, name, value)
+            result = fn(*args)
+            self.state.update({name: getattr(self, name) for name in self.STATE})
+            return result
+
+# Rough token count, good enough for budgeting the limiter
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+# True when the error, or the error it was raised from, is an HTTP 429
+def is_rate_limited(error: BaseException) -> bool:
+    while error is not None:
+        status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        if status == 429:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+# Seconds to wait according to the Retry-After (or retry-after-ms) header of the error's response, if any
+def retry_after(error: BaseException) -> float:
+    while error is not None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            if headers.get("retry-after-ms"):
+                try:
+                    return float(headers["retry-after-ms"]) / 1000
+                except ValueError:
+                    pass
+            value = headers.get("retry-after")
+            if value:
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    # An HTTP date
+                    try:
+                        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+                    except (TypeError, ValueError):
+                        pass
+        error = error.__cause__ or error.__context__
+    return None
+
+# Await call() and retry it for as long as it's rate limited, waiting as long as Retry-After says or else with
+# exponential backoff and jitter. With a limiter, a Retry-After pauses every request that shares it.
+async def retry_with_backoff(call, retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0, limiter: RateLimiter = None):
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not is_rate_limited(e):
+                raise
+            tracing.count("ratelimit.retries")
+            delay = retry_after(e)
+            if delay is not None:
+                delay = min(max_delay, delay)
+                if limiter is not None:
+                    limiter.pause(delay)
+            else:
+                delay = min(max_delay, base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+            await asyncio.sleep(delay)
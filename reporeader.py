@@ -1,18 +1,80 @@
+import base64
+import hashlib
+import os
+import tarfile
+from typing import Iterator
+
+import requests
+
+import tracing
+
 from github import Github
 from github import Auth
 from github import Repository
 from github import ContentFile
 
+# Ways of reading the repository contents
+MODE_API = "api"            # Walk the tree with get_contents, one call per directory and file
+MODE_TREE = "tree"          # Read the full tree recursively in one call, fetch blobs lazily
+MODE_TARBALL = "tarball"    # Download one tarball and stream it
+MODE_LOCAL = "local"        # Read a local clone or working directory, no network needed
+MODES = (MODE_TARBALL, MODE_TREE, MODE_API, MODE_LOCAL)
+
+# Files that are skipped before they're fetched, whatever the extensions: dependencies and build output checked in
+# with the code, lock files, and anything binary
+VENDORED_DIRECTORIES = {"node_modules", "vendor", "third_party", "bower_components", "site-packages", "dist", "build", "target", ".venv", "venv", "__pycache__", ".git", ".tox", ".mypy_cache"}
+LOCK_FILES = {"package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock", "uv.lock", "Cargo.lock", "composer.lock", "Gemfile.lock", "go.sum", "packages.lock.json"}
+BINARY_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".tar", ".jar", ".war",
+    ".class", ".pyc", ".pyo", ".so", ".dll", ".dylib", ".exe", ".bin", ".o", ".a", ".woff", ".woff2", ".ttf", ".otf", ".eot",
+    ".mp3", ".mp4", ".mov", ".avi", ".wav", ".sqlite", ".db", ".pkl", ".npy", ".npz", ".parquet", ".min.js", ".min.css", ".map"
+)
+
+class RepoFile():
+    """A lightweight file record as yielded by RepoReader.getRepositoryContents"""
+    __slots__ = ("name", "path", "size", "sha", "_content", "_loader")
+
+    def __init__(self, path: str, size: int = 0, sha: str = None, content: bytes = None, loader = None):
+        self.name = path.rsplit("/", 1)[-1]
+        self.path = path
+        self.size = size
+        self.sha = sha
+        self._content = content
+        self._loader = loader
+
+    # Same attribute as on a PyGithub ContentFile, the content is only fetched when first needed
+    @property
+    def decoded_content(self) -> bytes:
+        if self._content is None:
+            self._content = self._loader() if self._loader else b""
+            self._loader = None
+        return self._content
+
 class RepoReader():
 
     def __init__(self, token='', repo=''):
         self.github_token = token
-        self.github_repo_name = repo        
-        self.github_handle = None     
-        self.github_repo = None   
+        self.github_repo_name = repo
+        self.github_handle = None
+        self.github_repo = None
+        self.mode = MODE_TARBALL
+        self.local_path = None
+        self.commit_sha = None
+        self.extensions = (".md", ".py")
+        self.max_file_size = 512 * 1024
+        # Why files were skipped in the last read, reason -> number of files
+        self.skipped = {}
+        self.metadata = None
+        self.session = requests
 
-    def connect(self, token: str):
+    # A Github handle and requests session can be passed in to reuse their connection pools, see clients.py
+    def connect(self, token: str, github: Github = None, session: requests.Session = None):
         self.github_token = token
+        self.session = session or requests
+
+        if github is not None:
+            self.github_handle = github
+            return
 
         # using an access token to connect
         auth = Auth.Token(self.github_token)
@@ -23,33 +85,208 @@ class RepoReader():
     def setRepository(self, repo: str) -> Repository:
         self.github_repo_name = repo
         self.github_repo = self.github_handle.get_user().get_repo(repo)
+        self.commit_sha = None
+        self.metadata = None
 
         return self.github_repo
-    
-    def getRepositoryContents(self) -> list:
-        result = []
-        contents = self.github_repo.get_contents("")
+
+    def setLocalPath(self, path: str, name: str = ''):
+        self.local_path = os.path.abspath(os.path.expanduser(path))
+        self.github_repo_name = name or os.path.basename(self.local_path.rstrip(os.sep))
+        self.github_repo = None
+        self.commit_sha = None
+        self.metadata = None
+        self.mode = MODE_LOCAL
+
+    def setMode(self, mode: str = MODE_TARBALL):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}', use one of {', '.join(MODES)}")
+        self.mode = mode
+
+    # Files are yielded one at a time and only fetched when their content is first read.
+    # Files that don't match the extensions or are skipped by include() are never fetched.
+    def getRepositoryContents(self) -> Iterator[RepoFile]:
+        self.skipped = {}
+        if self.mode == MODE_LOCAL:
+            return self._readLocal()
+        if self.mode == MODE_TREE:
+            return self._readTree()
+        if self.mode == MODE_TARBALL:
+            return self._readTarball()
+        return self._readApi()
+
+    # Spans never stay open across a yield, the generator is advanced from different threads
+    def _readApi(self) -> Iterator[RepoFile]:
+        contents = self._listDirectory("")
         while contents:
             file_content = contents.pop(0)
             if file_content.type == "dir":
-                contents.extend(self.github_repo.get_contents(file_content.path))
+                if file_content.name not in VENDORED_DIRECTORIES:
+                    contents.extend(self._listDirectory(file_content.path))
             else:
-                if file_content.name.endswith(self.extensions):
-                    result.append(file_content)
+                if self.include(file_content.path, file_content.size):
+                    yield RepoFile(file_content.path, file_content.size, file_content.sha, loader=lambda f=file_content: self._readContent(f))
+
+    def _listDirectory(self, path: str) -> list:
+        with tracing.span("github.list", path=path):
+            tracing.count("github.calls", operation="get_contents")
+            return list(self.github_repo.get_contents(path))
+
+    def _readContent(self, file_content) -> bytes:
+        with tracing.span("github.fetch", path=file_content.path):
+            tracing.count("github.calls", operation="get_contents")
+            content = file_content.decoded_content
+            tracing.count("github.bytes", len(content))
+            return content
+
+    def _readTree(self) -> Iterator[RepoFile]:
+        with tracing.span("github.tree"):
+            tracing.count("github.calls", operation="get_git_tree")
+            tree = self.github_repo.get_git_tree(self.getCommitSha(), recursive=True)
+        # GitHub truncates very large trees, the tarball always holds everything
+        if tree.raw_data.get("truncated"):
+            yield from self._readTarball()
+            return
+
+        for element in tree.tree:
+            if element.type == "blob" and self.include(element.path, element.size):
+                yield RepoFile(element.path, element.size, element.sha, loader=lambda sha=element.sha: self._readBlob(sha))
+
+    def _readBlob(self, sha: str) -> bytes:
+        with tracing.span("github.fetch", sha=sha):
+            tracing.count("github.calls", operation="get_git_blob")
+            content = base64.b64decode(self.github_repo.get_git_blob(sha).content)
+            tracing.count("github.bytes", len(content))
+            return content
+
+    def _readTarball(self) -> Iterator[RepoFile]:
+        with tracing.span("github.tarball"):
+            tracing.count("github.calls", operation="get_archive_link")
+            url = self.github_repo.get_archive_link("tarball", self.getCommitSha())
+        headers = {"Authorization": f"token {self.github_token}"} if self.github_token else {}
+        tracing.count("github.calls", operation="tarball")
+        with self.session.get(url, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            # Stream mode, so members are read while downloading and never all held at once
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    # Strip the "<owner>-<repo>-<sha>/" folder GitHub puts in front of every path
+                    path = member.name.split("/", 1)[-1]
+                    if not self.include(path, member.size):
+                        continue
+                    content = archive.extractfile(member).read()
+                    tracing.count("github.bytes", len(content))
+                    yield RepoFile(path, member.size, git_blob_sha(content), content=content)
+
+    def _readLocal(self) -> Iterator[RepoFile]:
+        for root, dirs, files in os.walk(self.local_path):
+            dirs[:] = sorted(d for d in dirs if d not in VENDORED_DIRECTORIES)
+            for file_name in sorted(files):
+                full_path = os.path.join(root, file_name)
+                path = os.path.relpath(full_path, self.local_path).replace(os.sep, "/")
+                # Broken symlinks, files without read permission and files removed while walking
+                try:
+                    if not self.include(path, os.path.getsize(full_path)):
+                        continue
+                    repo_file = self._localFile(path, full_path)
+                except OSError:
+                    if file_name.endswith(self.extensions):
+                        self._skip("unreadable")
+                    continue
+                yield repo_file
+
+    def _localFile(self, path: str, full_path: str) -> RepoFile:
+        with open(full_path, "rb") as f:
+            content = f.read()
+        return RepoFile(path, len(content), git_blob_sha(content), content=content)
+
+    # Whether a file is read, decided on its path and size alone so nothing has to be fetched
+    def include(self, path: str, size: int) -> bool:
+        name = path.rsplit("/", 1)[-1]
+        if not name.endswith(self.extensions):
+            return False
+        if any(part in VENDORED_DIRECTORIES for part in path.split("/")[:-1]):
+            return self._skip("vendored")
+        if name in LOCK_FILES:
+            return self._skip("lock file")
+        if name.lower().endswith(BINARY_EXTENSIONS):
+            return self._skip("binary")
+        if self.max_file_size and (size or 0) > self.max_file_size:
+            return self._skip("too large")
+        return True
+
+    def _skip(self, reason: str) -> bool:
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+        tracing.count("reader.skipped", reason=reason)
+        return False
 
-        return result
-    
     def getRepositoryContent(self, file_path: str) -> ContentFile:
-        return self.github_repo.get_contents(file_path)
-    
+        if self.mode == MODE_LOCAL:
+            return self._localFile(file_path, os.path.join(self.local_path, file_path))
+        with tracing.span("github.fetch", path=file_path):
+            tracing.count("github.calls", operation="get_contents")
+            return self.github_repo.get_contents(file_path)
+
     def getName(self) -> str:
         return self.github_repo_name
-    
-    def getTopics(self) -> str:
-        return self.github_repo.get_topics()
-    
-    def getStars(self) -> str:
-        return self.github_repo.stargazers_count
-    
+
+    # The commit the contents are read at, resolved once so all files come from the same snapshot
+    def getCommitSha(self) -> str:
+        if self.commit_sha is None:
+            if self.mode == MODE_LOCAL:
+                self.commit_sha = read_local_head(self.local_path)
+            else:
+                with tracing.span("github.commit"):
+                    tracing.count("github.calls", operation="get_branch")
+                    self.commit_sha = self.github_repo.get_branch(self.github_repo.default_branch).commit.sha
+        return self.commit_sha
+
+    def getTopics(self) -> list:
+        return self.getMetadata()["topics"]
+
+    def getStars(self) -> int:
+        return self.getMetadata()["stars"]
+
+    # Topics and stars, fetched once per repository
+    def getMetadata(self) -> dict:
+        if self.metadata is None:
+            if self.github_repo is None:
+                self.metadata = {"topics": [], "stars": 0}
+            else:
+                tracing.count("github.calls", operation="get_topics")
+                self.metadata = {"topics": self.github_repo.get_topics(), "stars": self.github_repo.stargazers_count}
+        return self.metadata
+
     def setExtensions(self, extensions = ".md, .py"):
-        self.extensions = tuple(extensions.replace(" ", "").split(","))
\ No newline at end of file
+        self.extensions = tuple(extensions.replace(" ", "").split(","))
+
+    # Files larger than this many bytes are skipped, 0 reads everything
+    def setMaxFileSize(self, size: int):
+        self.max_file_size = size
+
+# The SHA git gives a blob, so records read from a tarball or disk match the ones from the API
+def git_blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+# Resolve HEAD of a local clone without needing git installed, empty for a plain directory
+def read_local_head(path: str) -> str:
+    git_dir = os.path.join(path, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[5:]
+        ref_path = os.path.join(git_dir, *ref.split("/"))
+        if os.path.exists(ref_path):
+            with open(ref_path) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, "packed-refs")) as f:
+            for line in f:
+                if line.rstrip().endswith(" " + ref):
+                    return line.split(" ", 1)[0]
+    except OSError:
+        pass
+    return ""
\ No newline at end of file
@@ -0,0 +1,168 @@
+import os
+import shutil
+
+from astrapy.constants import VectorMetric
+from astrapy.info import CollectionVectorServiceOptions
+
+import catalog
+import clients
+import contentstore
+import contextbuilder
+import doccache
+import embeddings
+import lexical
+import ratelimit
+import symbolindex
+import vectorstore
+
+#
+# Creates the stores, indexes and clients from the settings in secrets.toml, without Streamlit.
+# The app caches each of them with st.cache_resource, the batch CLI creates them once per worker process.
+# API clients come from a clients.ClientRegistry, so they share its connection pools.
+#
+
+# The model used for attributes and answers
+MODEL = "gpt-4o"
+
+# The Astra DB Vector Store and collection, or the local vector store when VECTOR_STORE is "local".
+# With VECTOR_COLLECTION_PER_REPOSITORY every repository gets a collection of its own.
+def load_vector_store_collection(secrets, registry: clients.ClientRegistry) -> vectorstore.VectorStore:
+    # Client-side embeddings go through the persistent cache, so unchanged text is never embedded twice
+    def cached_openai_embedding():
+        cache = embeddings.EmbeddingCache(secrets.get('EMBEDDING_CACHE_PATH', '.cache/embeddings.sqlite'))
+        return embeddings.CachedEmbedding(vectorstore.OpenAIEmbedding(registry.openai()), cache)
+
+    per_repository = str(secrets.get('VECTOR_COLLECTION_PER_REPOSITORY', False)).lower() == 'true'
+
+    if secrets.get('VECTOR_STORE', 'astra') == 'local':
+        if secrets.get('LOCAL_EMBEDDING', 'hashing') == 'openai':
+            embedding = cached_openai_embedding()
+        else:
+            embedding = vectorstore.HashingEmbedding()
+        path = secrets.get('LOCAL_VECTOR_STORE_PATH', '.cache/vectors')
+        partitions = int(secrets.get('LOCAL_VECTOR_STORE_PARTITIONS', 0))
+        if not per_repository:
+            return vectorstore.LocalVectorStore(path, embedding=embedding, partitions=partitions)
+        return vectorstore.PartitionedVectorStore(
+            lambda key: vectorstore.LocalVectorStore(os.path.join(path, key), embedding=embedding, partitions=partitions),
+            lambda: [key for key in os.listdir(path) if key.startswith("repo_")] if os.path.isdir(path) else [],
+            lambda key: shutil.rmtree(os.path.join(path, key), ignore_errors=True)
+        )
+
+    # Connect to the Vector Store
+    db = registry.astraDatabase()
+    embedding = cached_openai_embedding() if secrets.get('EMBEDDING_MODE', 'server') == 'client' else None
+    if not per_repository:
+        return vectorstore.AstraVectorStore(create_astra_collection(db, secrets, secrets.get('ASTRA_COLLECTION', 'uservice')), embedding=embedding)
+    # Only the fields searches and deletes filter on are indexed, which keeps writes cheap
+    return vectorstore.PartitionedVectorStore(
+        lambda key: vectorstore.AstraVectorStore(create_astra_collection(db, secrets, key, indexing={"allow": ["name", "path", "sha", "commit"]}), embedding=embedding),
+        lambda: [key for key in db.list_collection_names() if key.startswith("repo_")],
+        db.drop_collection
+    )
+
+# Create or get a collection
+def create_astra_collection(db, secrets, name: str, indexing: dict = None):
+    options = {"indexing": indexing} if indexing else {}
+    return db.create_collection(
+        name,
+        metric=VectorMetric.COSINE,
+        service=CollectionVectorServiceOptions(
+            provider="openai",
+            model_name="text-embedding-ada-002",
+            authentication={
+                "providerKey": f"{secrets['ASTRA_OPENAI_KEY']}.providerKey",
+            },
+        ),
+        check_exists=False,
+        **options
+    )
+
+# File contents by blob SHA
+def load_content_store(secrets) -> contentstore.ContentStore:
+    return contentstore.ContentStore(secrets.get('CONTENT_STORE_PATH', '.cache/contents'), max_memory_bytes=int(secrets.get('CONTENT_STORE_MEMORY_MB', 64)) * 1024 * 1024)
+
+# Generated documentation
+def load_result_cache(secrets) -> doccache.ResultCache:
+    return doccache.ResultCache(
+        secrets.get('RESULT_CACHE_PATH', '.cache/results.sqlite'),
+        ttl=float(secrets.get('RESULT_CACHE_TTL_HOURS', 168)) * 3600,
+        max_entries=int(secrets.get('RESULT_CACHE_MAX_ENTRIES', 1000))
+    )
+
+# Per file and per directory summaries of map-reduce documentation, one for every file of every repository
+def load_summary_cache(secrets) -> doccache.ResultCache:
+    return doccache.ResultCache(
+        secrets.get('SUMMARY_CACHE_PATH', '.cache/summaries.sqlite'),
+        ttl=float(secrets.get('SUMMARY_CACHE_TTL_HOURS', 720)) * 3600,
+        max_entries=int(secrets.get('SUMMARY_CACHE_MAX_ENTRIES', 100000))
+    )
+
+# The ingested repositories and when they were last used
+def load_catalog(secrets) -> catalog.RepositoryCatalog:
+    return catalog.RepositoryCatalog(secrets.get('CATALOG_PATH', '.cache/catalog.sqlite'))
+
+# BM25 indexes of the ingested repositories
+def load_lexical_indexes(secrets) -> lexical.LexicalIndexes:
+    return lexical.LexicalIndexes(secrets.get('LEXICAL_INDEX_PATH', '.cache/lexical'))
+
+# Symbol and dependency indexes of the ingested repositories
+def load_symbol_indexes(secrets) -> symbolindex.SymbolIndexes:
+    return symbolindex.SymbolIndexes(secrets.get('SYMBOL_INDEX_PATH', '.cache/symbols'))
+
+def load_rate_limiter(secrets) -> ratelimit.RateLimiter:
+    return ratelimit.RateLimiter(
+        requests_per_minute=int(secrets.get('OPENAI_RPM', 500)),
+        tokens_per_minute=int(secrets.get('OPENAI_TPM', 30000)),
+        reserve=float(secrets.get('OPENAI_INTERACTIVE_RESERVE', 0.1))
+    )
+
+# Retries are handled by retry_with_backoff so they're aware of the rate limiter
+def load_attributes_client(registry: clients.ClientRegistry):
+    return registry.instructor()
+
+# Streams the advisor answers
+def load_chat_client(registry: clients.ClientRegistry):
+    return registry.asyncOpenai()
+
+# Keeps the context of every advisor prompt within CONTEXT_TOKENS
+def load_context_builder(secrets) -> contextbuilder.ContextBuilder:
+    return contextbuilder.ContextBuilder(model=MODEL, budget=int(secrets.get('CONTEXT_TOKENS', 6000)))
+
+class Resources():
+    """What ingesting and documenting a repository need, so the app and the batch CLI run the same code"""
+
+    def __init__(self, secrets, collection, content_store, result_cache, lexical_indexes, symbol_indexes, rate_limiter, attributes_client, chat_client, context_builder, client_registry: clients.ClientRegistry = None, summary_cache: doccache.ResultCache = None, catalog: catalog.RepositoryCatalog = None):
+        self.secrets = secrets
+        self.client_registry = client_registry
+        self.collection = collection
+        self.content_store = content_store
+        self.result_cache = result_cache
+        self.lexical_indexes = lexical_indexes
+        self.symbol_indexes = symbol_indexes
+        self.rate_limiter = rate_limiter
+        self.attributes_client = attributes_client
+        self.chat_client = chat_client
+        self.context_builder = context_builder
+        self.summary_cache = summary_cache
+        self.catalog = catalog
+
+    # Create everything from the settings, a rate limiter can be passed in to share it with other processes
+    @classmethod
+    def load(cls, secrets, rate_limiter: ratelimit.RateLimiter = None) -> "Resources":
+        registry = clients.ClientRegistry(secrets)
+        return cls(
+            secrets,
+            load_vector_store_collection(secrets, registry),
+            load_content_store(secrets),
+            load_result_cache(secrets),
+            load_lexical_indexes(secrets),
+            load_symbol_indexes(secrets),
+            rate_limiter or load_rate_limiter(secrets),
+            load_attributes_client(registry),
+            load_chat_client(registry),
+            load_context_builder(secrets),
+            registry,
+            load_summary_cache(secrets),
+            load_catalog(secrets)
+        )
@@ -0,0 +1,51 @@
+import time
+
+#
+# Renders a streamed LLM answer into a Streamlit placeholder. Chunks are collected in a list and the placeholder
+# is only updated every interval seconds (or once enough new text came in), instead of rebuilding the string
+# and re-rendering the Markdown for every token. The final text is rendered exactly once when the stream ends.
+#
+
+class StreamRenderer():
+    """Throttled rendering of streamed text into a placeholder"""
+
+    def __init__(self, placeholder, interval: float = 0.15, max_pending: int = 2048, cursor: str = "▌"):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_pending = max_pending
+        self.cursor = cursor
+        self.parts = []
+        self.pending = 0
+        self.last_render = 0.0
+        self.renders = 0
+
+    def write(self, text: str):
+        if not text:
+            return
+        self.parts.append(text)
+        self.pending += len(text)
+        now = time.monotonic()
+        if now - self.last_render >= self.interval or self.pending >= self.max_pending:
+            self._render("".join(self.parts) + self.cursor)
+            self.last_render = now
+
+    # Without a placeholder (e.g. the batch CLI) the text is only collected
+    def _render(self, text: str):
+        if self.placeholder is not None:
+            self.placeholder.markdown(text)
+        self.pending = 0
+        self.renders += 1
+
+    # Render the complete text without the cursor and return it
+    def close(self) -> str:
+        text = "".join(self.parts)
+        self._render(text)
+        return text
+
+# Render an OpenAI chat completion stream and return the complete answer
+async def render_stream(response, placeholder, interval: float = 0.15) -> str:
+    renderer = StreamRenderer(placeholder, interval=interval)
+    async for chunk in response:
+        if chunk.choices:
+            renderer.write(chunk.choices[0].delta.content)
+    return renderer.close()
\ No newline at end of file
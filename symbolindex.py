@@ -0,0 +1,343 @@
+import os
+import posixpath
+import re
+import threading
+
+import indexlog
+
+#
+# Index of the symbols and dependencies of a repository, built from the static analysis while ingesting.
+# Navigation questions like "where is X defined", "who uses Y" or "list classes in Z" are answered straight
+# from it, and for other questions it points the advisor at the definitions of the symbols that are mentioned.
+#
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+class SymbolIndex(indexlog.LoggedIndex):
+    """Symbol -> definitions, file -> imports and identifiers, and the reverse dependencies derived from them"""
+
+    def __init__(self):
+        self.files = {}             # path -> {"sha", "language", "symbols", "imports", "identifiers"}
+        self.definitions = {}       # name -> [(path, symbol)]
+        self.stems = {}             # every path suffix of a file without its extension -> paths, so imports resolve without a scan
+        self.bases = {}             # what an import refers to (see _importBase) -> {(importer, dependency)}
+        self.imported = {}          # import as written -> importers
+        self.resolved = {}          # importer -> {import: the file it resolved to or None}
+        self.importers = {}         # path -> {importer: number of its imports resolving to the path}
+        self.lock = threading.RLock()
+        self._initLog()
+
+    # Add a file from its extractors.Analysis, replacing what was known about it
+    def addFile(self, path: str, sha: str, analysis, content: str):
+        symbols = [s.model_dump() for s in (analysis.symbols or [])] if analysis is not None else []
+        entry = {
+            "sha": sha,
+            "language": analysis.language if analysis is not None else "",
+            "symbols": symbols,
+            "imports": list(analysis.dependencies or []) if analysis is not None else [],
+            "identifiers": sorted(set(IDENTIFIER.findall(content))),
+        }
+        with self.lock:
+            self.removePath(path)
+            self._addEntry(path, entry)
+            self._changed(path)
+
+    # Every import is resolved once, when either side of it is added, so dependents() is a lookup
+    def _addEntry(self, path: str, entry: dict):
+        entry["identifier_set"] = set(entry["identifiers"])
+        self.files[path] = entry
+        for symbol in entry["symbols"]:
+            self.definitions.setdefault(symbol["name"], []).append((path, symbol))
+        suffixes = _suffixes(path)
+        for suffix in suffixes:
+            self.stems.setdefault(suffix, {})[path] = None
+        # Imports of files added before this one may refer to it
+        for importer, dependency in [item for suffix in suffixes for item in self.bases.get(_packageBase(suffix), ())]:
+            self._resolve(importer, dependency)
+        self.resolved[path] = {}
+        for dependency in entry["imports"]:
+            self.bases.setdefault(self._importBase(path, dependency), set()).add((path, dependency))
+            self.imported.setdefault(dependency, set()).add(path)
+            self._resolve(path, dependency)
+
+    def removePath(self, path: str):
+        with self.lock:
+            entry = self.files.pop(path, None)
+            if entry is None:
+                return
+            self._changed(path)
+            for symbol in entry["symbols"]:
+                remaining = [d for d in self.definitions.get(symbol["name"], []) if d[0] != path]
+                if remaining:
+                    self.definitions[symbol["name"]] = remaining
+                else:
+                    self.definitions.pop(symbol["name"], None)
+            for suffix in _suffixes(path):
+                paths = self.stems.get(suffix, {})
+                paths.pop(path, None)
+                if not paths:
+                    self.stems.pop(suffix, None)
+            for dependency, resolved in self.resolved.pop(path, {}).items():
+                _discard(self.bases, self._importBase(path, dependency), (path, dependency))
+                _discard(self.imported, dependency, path)
+                if resolved is not None:
+                    self._unlink(resolved, path)
+            # Files importing this one resolve to another file or to nothing now
+            for importer in list(self.importers.get(path, ())):
+                for dependency, resolved in list(self.resolved[importer].items()):
+                    if resolved == path:
+                        self._resolve(importer, dependency)
+
+    def clear(self):
+        with self.lock:
+            self.files = {}
+            self.definitions = {}
+            self.stems = {}
+            self.bases = {}
+            self.imported = {}
+            self.resolved = {}
+            self.importers = {}
+            self._resetLog()
+
+    # Where a symbol is defined, a "Class.method" name only matches methods of that class
+    def define(self, name: str) -> list:
+        parent, _, name = name.rpartition(".")
+        with self.lock:
+            return [(path, symbol) for path, symbol in self.definitions.get(name, []) if not parent or symbol.get("parent") == parent]
+
+    # Files that mention the identifier, other than only at its definition
+    def usages(self, name: str) -> list:
+        name = name.rpartition(".")[2]
+        with self.lock:
+            return sorted(path for path, entry in self.files.items() if name in entry["identifier_set"])
+
+    # Files importing the given file or module
+    def dependents(self, target: str) -> list:
+        with self.lock:
+            result = set()
+            for path in self.matchFiles(target):
+                result.update(self.importers.get(path, ()))
+            # Modules outside the repository, by the name they're imported with
+            for dependency, importers in self.imported.items():
+                if dependency == target or dependency.endswith("." + target) or dependency.endswith("/" + target):
+                    result.update(importers)
+            return sorted(result)
+
+    # The imports of a file with the file each one resolved to, None for those outside the repository
+    def importsOf(self, path: str) -> list:
+        with self.lock:
+            resolved = self.resolved.get(path, {})
+            return [(dependency, resolved.get(dependency)) for dependency in self.files[path]["imports"]]
+
+    # The file an import refers to when it's part of the repository
+    def resolveImport(self, importer: str, dependency: str) -> str:
+        with self.lock:
+            return self._lookup(self._importBase(importer, dependency))
+
+    # The path of a file an import refers to, without extension, relative to wherever it's imported from
+    def _importBase(self, importer: str, dependency: str) -> str:
+        if dependency.startswith("."):
+            # Relative import, "./x" and "../x" in JavaScript, ".x" in Python
+            if "/" in dependency:
+                return posixpath.normpath(posixpath.join(posixpath.dirname(importer), dependency))
+            level = len(dependency) - len(dependency.lstrip("."))
+            directory = posixpath.dirname(importer)
+            for _ in range(level - 1):
+                directory = posixpath.dirname(directory)
+            return posixpath.join(directory, dependency.lstrip(".").replace(".", "/"))
+        return dependency.replace("::", "/").replace("\\", "/").replace(".", "/") if "/" not in dependency else dependency
+
+    # The first file added that is the module or package at base
+    def _lookup(self, base: str) -> str:
+        for stem in (base, base + "/__init__", base + "/index"):
+            paths = self.stems.get(stem)
+            if paths:
+                return next(iter(paths))
+        return None
+
+    def _resolve(self, importer: str, dependency: str):
+        previous = self.resolved[importer].get(dependency)
+        resolved = self._lookup(self._importBase(importer, dependency))
+        self.resolved[importer][dependency] = resolved
+        if resolved == previous:
+            return
+        if previous is not None:
+            self._unlink(previous, importer)
+        if resolved is not None:
+            importers = self.importers.setdefault(resolved, {})
+            importers[importer] = importers.get(importer, 0) + 1
+
+    def _unlink(self, path: str, importer: str):
+        importers = self.importers.get(path, {})
+        importers[importer] = importers.get(importer, 0) - 1
+        if importers[importer] <= 0:
+            del importers[importer]
+        if not importers:
+            self.importers.pop(path, None)
+
+    # Files whose path matches a file name, a path suffix or a directory
+    def matchFiles(self, target: str) -> set:
+        target = target.strip("/").strip("`'\"")
+        with self.lock:
+            return {path for path in self.files if path == target or path.endswith("/" + target) or path.rsplit(".", 1)[0] == target or path.rsplit(".", 1)[0].endswith("/" + target) or path.startswith(target.rstrip("/") + "/")}
+
+    def symbolsIn(self, target: str, kinds: tuple) -> list:
+        with self.lock:
+            return [(path, symbol) for path in sorted(self.matchFiles(target)) for symbol in self.files[path]["symbols"] if symbol["kind"] in kinds]
+
+    # The lines of a definition, up to the next symbol in the same file
+    def definitionRange(self, path: str, symbol: dict, max_lines: int = 80) -> tuple:
+        with self.lock:
+            following = [s["line"] for s in self.files[path]["symbols"] if s["line"] > symbol["line"] and (symbol["kind"] != "class" or s["kind"] == "class")]
+        end = min(following) - 1 if following else symbol["line"] + max_lines - 1
+        return symbol["line"], min(end, symbol["line"] + max_lines - 1)
+
+    # Known symbols mentioned in a text, e.g. a question
+    def mentioned(self, text: str) -> list:
+        with self.lock:
+            return [name for name in dict.fromkeys(IDENTIFIER.findall(text)) if name in self.definitions]
+
+    def _snapshotData(self) -> dict:
+        return {"files": {path: self._fileData(path) for path in self.files}}
+
+    def _fileData(self, path: str):
+        entry = self.files.get(path)
+        return {k: v for k, v in entry.items() if k != "identifier_set"} if entry is not None else None
+
+    def _restoreFile(self, path: str, data):
+        self.removePath(path)
+        if data is not None:
+            self._addEntry(path, data)
+
+    def _fileCount(self) -> int:
+        return len(self.files)
+
+    @classmethod
+    def load(cls, path: str) -> "SymbolIndex":
+        index = cls()
+        data = indexlog.read_snapshot(path)
+        # Indexes saved before the log existed are a plain path -> entry dict
+        if not isinstance(data.get("snapshot"), str):
+            data = {"snapshot": None, "files": data}
+        for file_path, entry in data["files"].items():
+            index._addEntry(file_path, entry)
+        index._replayLog(path, data["snapshot"])
+        return index
+
+class SymbolIndexes():
+    """One symbol index per repository, kept in memory and saved to a directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def _path(self, repo: str) -> str:
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', repo) + ".json.gz")
+
+    def get(self, repo: str) -> SymbolIndex:
+        with self.lock:
+            if repo not in self.indexes:
+                path = self._path(repo)
+                self.indexes[repo] = SymbolIndex.load(path) if os.path.exists(path) else SymbolIndex()
+            return self.indexes[repo]
+
+    def save(self, repo: str):
+        self.get(repo).save(self._path(repo))
+
+    # Forget the index of a repository, in memory and on disk
+    def remove(self, repo: str):
+        with self.lock:
+            self.indexes.pop(repo, None)
+            indexlog.remove(self._path(repo))
+
+# Navigation questions the index answers, the name or file is in the "target" group
+DEFINITION_QUESTIONS = [
+    re.compile(r'^\s*(?:where|in which file)\s+(?:is|are)\s+(?:the\s+)?(?:function|class|method)?\s*`?(?P<target>[\w.]+)`?\s+(?:defined|declared|implemented)\s*\??\s*$', re.IGNORECASE),
+    re.compile(r'^\s*(?:find|show|go to)\s+(?:the\s+)?(?:definition\s+of\s+)?`?(?P<target>[\w.]+)`?\s*\??\s*$', re.IGNORECASE),
+]
+USAGE_QUESTIONS = [
+    re.compile(r'^\s*(?:who|what|which files?)\s+(?:uses|calls|references|imports|depends on)\s+`?(?P<target>[\w./-]+)`?\s*\??\s*$', re.IGNORECASE),
+    re.compile(r'^\s*where\s+(?:is|are)\s+`?(?P<target>[\w./-]+)`?\s+(?:used|called|referenced|imported)\s*\??\s*$', re.IGNORECASE),
+]
+LIST_QUESTIONS = re.compile(r'^\s*(?:list|show|what are)(?:\s+the|\s+all)?\s+(?P<kind>classes|functions|methods|symbols)\s+(?:are\s+)?(?:in|of|defined in)\s+`?(?P<target>[\w./-]+)`?\s*\??\s*$', re.IGNORECASE)
+IMPORT_QUESTIONS = re.compile(r'^\s*(?:what does\s+`?(?P<target>[\w./-]+)`?\s+(?:import|depend on)|(?:list\s+)?(?:the\s+)?(?:imports|dependencies)\s+of\s+`?(?P<target2>[\w./-]+)`?)\s*\??\s*$', re.IGNORECASE)
+
+# Answer a navigation question from the index as Markdown, None when it isn't one or there's nothing to say.
+# read(path) returns the content of a file, it's used to show the lines where something is used.
+def answer_question(index: SymbolIndex, question: str, read = None) -> str:
+    for pattern in DEFINITION_QUESTIONS:
+        match = pattern.match(question)
+        if match:
+            definitions = index.define(match.group("target"))
+            if definitions:
+                return "\n".join([f"`{match.group('target')}` is defined in:"] + [f"- `{path}` line {s['line']}: {s['kind']} `{s['signature']}`" for path, s in definitions])
+
+    for pattern in USAGE_QUESTIONS:
+        match = pattern.match(question)
+        if match:
+            target = match.group("target")
+            lines = []
+            dependents = index.dependents(target)
+            if dependents:
+                lines += [f"Files importing `{target}`:"] + [f"- `{path}`" for path in dependents]
+            name = target.rpartition(".")[2]
+            defined_at = {(path, s["line"]) for path, s in index.define(target)}
+            usages = []
+            for path in index.usages(target):
+                locations = _locations(read, path, name, defined_at) if read is not None else []
+                if read is None or locations:
+                    usages.append(f"- `{path}`" + (f" lines {', '.join(str(l) for l in locations)}" if locations else ""))
+            if usages:
+                lines += [f"`{name}` is used in:"] + usages
+            if lines:
+                return "\n".join(lines)
+
+    match = LIST_QUESTIONS.match(question)
+    if match:
+        kind = match.group("kind").lower()
+        kinds = {"classes": ("class",), "functions": ("function", "method"), "methods": ("method",), "symbols": ("class", "function", "method")}[kind]
+        symbols = index.symbolsIn(match.group("target"), kinds)
+        if symbols:
+            return "\n".join([f"The {kind} in `{match.group('target')}`:"] + [f"- `{s['signature']}` (`{path}` line {s['line']})" for path, s in symbols])
+        if index.matchFiles(match.group("target")):
+            return f"There are no {kind} in `{match.group('target')}`."
+
+    match = IMPORT_QUESTIONS.match(question)
+    if match:
+        target = match.group("target") or match.group("target2")
+        paths = sorted(index.matchFiles(target))
+        if paths:
+            lines = []
+            for path in paths:
+                lines.append(f"`{path}` imports:")
+                lines += [f"- `{d}`" + (f" (`{resolved}`)" if resolved else "") for d, resolved in index.importsOf(path)] or ["- nothing"]
+            return "\n".join(lines)
+    return None
+
+# A file's path without its extension and every shorter suffix of it, "a/b/c.py" is "a/b/c", "b/c" and "c"
+def _suffixes(path: str) -> list:
+    parts = path.rsplit(".", 1)[0].split("/")
+    return ["/".join(parts[i:]) for i in range(len(parts))]
+
+# The import base a stem is found under, a package is imported by its directory
+def _packageBase(stem: str) -> str:
+    for name in ("/__init__", "/index"):
+        if stem.endswith(name):
+            return stem[:-len(name)]
+    return stem
+
+def _discard(mapping: dict, key, value):
+    values = mapping.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del mapping[key]
+
+# Lines of a file mentioning the name, leaving out where it's defined
+def _locations(read, path: str, name: str, defined_at: set) -> list:
+    content = read(path)
+    if content is None:
+        return []
+    pattern = re.compile(rf'\b{re.escape(name)}\b')
+    return [number for number, line in enumerate(content.splitlines(), start=1) if pattern.search(line) and (path, number) not in defined_at]
\ No newline at end of file
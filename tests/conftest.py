@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contentstore
+import doccache
+import fakes
+import lexical
+import ratelimit
+import reporeader
+import resources
+import symbolindex
+
+class RecordingRateLimiter(ratelimit.RateLimiter):
+    """A rate limiter without limits that remembers the priority of every request"""
+
+    def __init__(self):
+        super().__init__(requests_per_minute=1000000, tokens_per_minute=1000000000)
+        self.priorities = []
+
+    async def acquire(self, tokens: int = 0, priority: int = ratelimit.BACKGROUND):
+        self.priorities.append(priority)
+        await super().acquire(tokens, priority)
+
+# Resources like the app's, with the stand-ins of fakes.py for every service and the stores in tmp_path
+@pytest.fixture
+def fake_resources(tmp_path):
+    counter = fakes.CallCounter()
+    client = fakes.FakeOpenAI(counter, latency=0, token_latency=0, answer_tokens=20)
+    secrets = {"OPENAI_CONCURRENCY": 4, "ASTRA_BATCH_SIZE": 3, "CHUNK_TOKENS": 128, "CHUNK_OVERLAP": 16}
+    return resources.Resources(
+        secrets,
+        fakes.FakeCollection(counter, latency=0),
+        contentstore.ContentStore(str(tmp_path / "contents")),
+        doccache.ResultCache(str(tmp_path / "results.sqlite")),
+        lexical.LexicalIndexes(str(tmp_path / "lexical")),
+        symbolindex.SymbolIndexes(str(tmp_path / "symbols")),
+        RecordingRateLimiter(),
+        client,
+        client,
+        resources.load_context_builder(secrets),
+        summary_cache=doccache.ResultCache(str(tmp_path / "summaries.sqlite"))
+    )
+
+# A reader of a repository of the fake GitHub, files maps paths to contents
+@pytest.fixture
+def fake_repository():
+    def create(files: dict, name: str = "owner/repo", mode: str = reporeader.MODE_TREE) -> reporeader.RepoReader:
+        github = fakes.FakeGithub({name: fakes.FakeRepository(name, files)})
+        repo = reporeader.RepoReader()
+        repo.github_handle = github
+        repo.session = fakes.FakeSession(github)
+        repo.setMode(mode)
+        repo.setRepository(name)
+        repo.setExtensions(".md, .py")
+        return repo
+    return create
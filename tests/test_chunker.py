@@ -0,0 +1,47 @@
+import chunker
+import tokens
+
+def python_file(functions: int, lines: int) -> str:
+    return "import os\n\n" + "".join(
+        f"def function{number}(value):\n" + "".join(f"    value = value + {line}\n" for line in range(lines)) + "    return value\n\n"
+        for number in range(functions)
+    )
+
+def count(text: str) -> int:
+    return tokens.count_tokens(text, chunker.EMBEDDING_MODEL)
+
+def test_small_file_is_one_chunk():
+    chunks = chunker.chunk_file("app.py", "x = 1\ny = 2\n")
+    assert [(c.start_line, c.end_line, c.text) for c in chunks] == [(1, 2, "x = 1\ny = 2\n")]
+    assert chunker.chunk_file("empty.py", "") == []
+
+def test_code_is_split_on_functions():
+    content = python_file(6, 10)
+    chunks = chunker.chunk_file("app.py", content, max_tokens=120, overlap=0)
+    assert len(chunks) > 1
+    assert all(count(c.text) <= 120 for c in chunks)
+    # Without overlap the chunks cover every line once, in order
+    assert "".join(c.text for c in chunks) == content
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+    assert all(c.symbol.startswith("function") for c in chunks[1:])
+
+def test_markdown_is_split_on_headings():
+    content = "".join(f"## Section {number}\n\n" + "Some words about it. " * 30 + "\n\n" for number in range(4))
+    chunks = chunker.chunk_file("README.md", content, max_tokens=200, overlap=0)
+    assert [c.symbol for c in chunks] == [f"Section {number}" for number in range(4)]
+
+def test_large_sections_are_split_in_overlapping_windows():
+    content = python_file(1, 200)
+    chunks = chunker.chunk_file("app.py", content, max_tokens=200, overlap=40)
+    assert len(chunks) > 2
+    assert all(count(c.text) <= 200 for c in chunks)
+    # The imports are a section of their own, the function is cut in windows
+    assert (chunks[0].start_line, chunks[0].end_line) == (1, 2)
+    for previous, chunk in zip(chunks[1:], chunks[2:]):
+        assert previous.start_line < chunk.start_line <= previous.end_line
+    assert chunks[-1].end_line == len(content.splitlines())
+
+def test_long_lines_are_truncated():
+    content = "var a = 1;" * 500
+    chunks = chunker.chunk_file("app.min.js", content, max_tokens=100)
+    assert [c.text for c in chunks] == [tokens.truncate_tokens(content, 100, chunker.EMBEDDING_MODEL)]
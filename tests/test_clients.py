@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+import clients
+
+class LoopPinnedClient():
+    """Like an httpx pool: fails when used from another loop than the first one"""
+
+    def __init__(self):
+        self.loop = None
+        self.calls = 0
+
+    async def create(self, stream: bool = False):
+        loop = asyncio.get_running_loop()
+        self.loop = self.loop or loop
+        if loop is not self.loop:
+            raise RuntimeError("Event loop is closed")
+        self.calls += 1
+        if stream:
+            return self._stream()
+        return "answer"
+
+    async def _stream(self):
+        for word in ("a", "b", "c"):
+            await asyncio.sleep(0)
+            yield word
+
+def test_client_is_shared_across_event_loops():
+    target = LoopPinnedClient()
+    client = clients.LoopBound(target, clients.BackgroundLoop())
+
+    async def ask():
+        stream = await client.create(stream=True)
+        return await client.create(), [word async for word in stream]
+
+    # Every Streamlit rerun and every job runs in a new event loop
+    for _ in range(3):
+        assert asyncio.run(ask()) == ("answer", ["a", "b", "c"])
+    assert target.calls == 6
+
+def test_errors_reach_the_caller():
+    class Failing():
+        async def create(self):
+            raise ValueError("rate limited")
+
+    client = clients.LoopBound(Failing(), clients.BackgroundLoop())
+    with pytest.raises(ValueError):
+        asyncio.run(client.create())
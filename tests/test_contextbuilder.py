@@ -0,0 +1,56 @@
+import asyncio
+
+import contextbuilder
+import documentation
+import fakes
+import ingestion
+import tokens
+import tracing
+
+def excerpt(path: str, start_line: int, end_line: int, rank: int = 0, symbol: str = "") -> contextbuilder.Excerpt:
+    text = "".join(f"line {number} of {path}\n" for number in range(start_line, end_line + 1))
+    return contextbuilder.Excerpt(path=path, start_line=start_line, end_line=end_line, text=text, rank=rank, symbol=symbol)
+
+def test_overlapping_excerpts_are_merged():
+    builder = contextbuilder.ContextBuilder(budget=10000)
+    context = builder.build([excerpt("a.py", 1, 10, rank=2), excerpt("a.py", 5, 20, rank=0, symbol="main"), excerpt("a.py", 3, 8, rank=4), excerpt("b.py", 1, 5, rank=1)])
+    assert [(e.path, e.start_line, e.end_line, e.rank) for e in context.used] == [("a.py", 1, 20, 0), ("b.py", 1, 5, 1)]
+    # Every line once, in order
+    assert context.used[0].text == excerpt("a.py", 1, 20).text
+    assert context.used[0].symbol == "main"
+    assert context.dropped == ["a.py:3-8 duplicate"]
+
+def test_oversized_excerpts_are_narrowed_to_the_best_matching_symbol():
+    functions = ["parse_config", "render_page", "send_invoice"]
+    text = "".join(f"def {name}(value):\n" + "".join(f"    value = value + {line}  # {name.replace('_', ' ')}\n" for line in range(40)) + "    return value\n\n" for name in functions)
+    lines = len(text.splitlines())
+    builder = contextbuilder.ContextBuilder(budget=10000, max_excerpt_tokens=400)
+    context = builder.build([contextbuilder.Excerpt(path="app.py", start_line=101, end_line=100 + lines, text=text)], query="how is the invoice sent")
+    [used] = context.used
+    assert used.symbol == "send_invoice"
+    assert used.text.startswith("def send_invoice(value):")
+    assert used.start_line == 101 + text.splitlines().index("def send_invoice(value):")
+    assert tokens.count_tokens(used.text, builder.model) <= 400
+    assert context.dropped == [f"app.py:101-{100 + lines} narrowed to lines {used.start_line}-{used.end_line}"]
+
+def test_excerpts_are_trimmed_and_dropped_at_the_budget():
+    builder = contextbuilder.ContextBuilder(budget=300, min_excerpt_tokens=50)
+    first, second, third = excerpt("a.py", 1, 20, rank=0), excerpt("b.py", 1, 80, rank=1), excerpt("c.py", 1, 20, rank=2)
+    context = builder.build([third, second, first])
+    assert context.tokens <= 300
+    assert [e.path for e in context.used] == ["a.py", "b.py"]
+    trimmed = context.used[1]
+    assert trimmed.start_line == 1 and trimmed.end_line < 80
+    assert trimmed.text == excerpt("b.py", 1, trimmed.end_line).text
+    assert context.dropped == [f"b.py:{trimmed.end_line + 1}-80 trimmed", "c.py:1-20 over budget"]
+
+def test_the_advisor_traces_what_was_dropped(fake_resources, fake_repository):
+    repo = fake_repository(fakes.synthetic_repository(12))
+    asyncio.run(ingestion.ingest_repository(fake_resources, repo, full=True))
+    fake_resources.context_builder = contextbuilder.ContextBuilder(budget=150, min_excerpt_tokens=50)
+    asyncio.run(documentation.advisor(fake_resources, repo, "order service", "How are orders handled?"))
+
+    root = tracing.tracer.breakdown(next(reversed(tracing.tracer.traces)))
+    assert root["name"] == "advisor"
+    assert root["attributes"]["dropped"]
+    assert root["attributes"]["context_tokens"] <= 150
@@ -0,0 +1,31 @@
+import time
+
+import doccache
+
+def test_put_and_get(tmp_path):
+    cache = doccache.ResultCache(str(tmp_path / "results.sqlite"))
+    key = doccache.ResultCache.key("owner/repo", "c1", "gpt-4o", ["prompt"], doccache.ResultCache.fingerprint([["a.py", "sha", 1, 10]]))
+    assert cache.get(key) is None
+    cache.put(key, "answer")
+    assert cache.get(key) == "answer"
+    cache.delete(key)
+    assert cache.get(key) is None
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = doccache.ResultCache(str(tmp_path / "results.sqlite"), max_entries=200)
+    for number in range(200):
+        cache.put(f"key{number}", "value")
+    time.sleep(0.01)
+    cache.get("key0")
+    for number in range(200, 300):
+        cache.put(f"key{number}", "value")
+    assert cache.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0] <= 200 + cache.evict_every
+    assert cache.get("key0") == "value"
+    assert cache.get("key1") is None
+    assert cache.get("key299") == "value"
+
+def test_expired_results_are_not_served(tmp_path):
+    cache = doccache.ResultCache(str(tmp_path / "results.sqlite"), ttl=0.01)
+    cache.put("key", "value")
+    time.sleep(0.02)
+    assert cache.get("key") is None
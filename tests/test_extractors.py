@@ -0,0 +1,23 @@
+import time
+
+import extractors
+
+def names(analysis) -> list:
+    return [(s.kind, s.name) for s in analysis.symbols]
+
+def test_python_symbols():
+    analysis = extractors.analyze("service.py", "import os\n\nclass Order():\n    def total(self):\n        return 0\n\ndef load(path):\n    pass\n")
+    assert ("class", "Order") in names(analysis)
+    assert ("function", "load") in names(analysis)
+    assert analysis.dependencies == ["os"]
+
+def test_c_functions():
+    code = "#include <stdio.h>\n\nstatic const char *name(void) {\n    return \"x\";\n}\n\nstd::vector<int> Foo::bar() const {\n}\n\nint main(int argc, char** argv) {\n    int a = b(c);\n}\n"
+    analysis = extractors.analyze("main.cpp", code)
+    assert [n for k, n in names(analysis) if k == "function"] == ["name", "Foo::bar", "main"]
+    assert analysis.dependencies == ["stdio.h"]
+
+def test_c_declaration_with_many_pointers_is_fast():
+    started = time.perf_counter()
+    extractors.analyze("hostile.h", ("a" + "*" * 40 + " x;\n") * 50)
+    assert time.perf_counter() - started < 1
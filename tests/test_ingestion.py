@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+
+import pytest
+
+import fakes
+import ingestion
+import lexical
+import symbolindex
+
+def test_process_files_reports_in_order():
+    delays = random.Random(0)
+    reported = []
+
+    async def worker(file):
+        await asyncio.sleep(delays.random() / 100)
+        return file * 2
+
+    def on_result(index, file, result, error):
+        reported.append((index, file, result, error))
+
+    count = asyncio.run(ingestion.process_files(range(50), worker, on_result, concurrency=4))
+    assert count == 50
+    assert reported == [(i, i, i * 2, None) for i in range(50)]
+
+def test_process_files_reports_worker_errors():
+    async def worker(file):
+        if file == 2:
+            raise ValueError("bad file")
+        return file
+
+    errors = {}
+    asyncio.run(ingestion.process_files(range(5), worker, lambda index, file, result, error: errors.__setitem__(file, error), concurrency=2))
+    assert isinstance(errors.pop(2), ValueError)
+    assert set(errors.values()) == {None}
+
+def test_process_files_cancels_workers_when_files_raise():
+    def files():
+        yield from range(3)
+        raise RuntimeError("listing failed")
+
+    async def worker(file):
+        await asyncio.sleep(0.05)
+        return file
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await ingestion.process_files(files(), worker, lambda *args: None, concurrency=4)
+        # Nothing started by process_files is left running
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+
+def test_process_files_stops_taking_files_when_on_result_raises():
+    taken = []
+
+    def files():
+        for number in range(1000):
+            taken.append(number)
+            yield number
+
+    async def worker(file):
+        await asyncio.sleep(0)
+        return file
+
+    def on_result(index, file, result, error):
+        raise RuntimeError("cannot store")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(ingestion.process_files(files(), worker, on_result, concurrency=2))
+    assert len(taken) < 1000
+
+def store_file(sync, path: str, sha: str, chunks: int):
+    for chunk in range(chunks):
+        sync.upsert({"name": "owner/repo", "path": path, "chunk": chunk, "$vectorize": f"{path} {chunk}"}, sha)
+
+def test_resync_keeps_every_chunk_of_a_changed_file():
+    collection = fakes.FakeCollection(latency=0)
+    sync = ingestion.RepositorySync(collection, "owner/repo", "c1", full=True, batch_size=3)
+    store_file(sync, "big.py", "old", 5)
+    store_file(sync, "small.py", "same", 1)
+    sync.removeDeleted()
+
+    # The new version spans more than one flush
+    sync = ingestion.RepositorySync(collection, "owner/repo", "c2", batch_size=3)
+    store_file(sync, "big.py", "new", 5)
+    sync.seen.update({"big.py", "small.py"})
+    assert sync.removeDeleted() == []
+
+    documents = collection.find({"name": "owner/repo", "path": "big.py"})
+    assert sorted(d["chunk"] for d in documents) == [0, 1, 2, 3, 4]
+    assert {d["sha"] for d in documents} == {"new"}
+    assert len(collection.find({"name": "owner/repo", "path": "small.py"})) == 1
+
+class File():
+    def __init__(self, path: str, sha: str):
+        self.path = path
+        self.sha = sha
+
+def test_resync_skips_unchanged_and_removes_deleted_files():
+    collection = fakes.FakeCollection(latency=0)
+    sync = ingestion.RepositorySync(collection, "owner/repo", "c1", full=True)
+    for path in ("a.py", "b.py", "c.py"):
+        store_file(sync, path, "v1", 2)
+    sync.removeDeleted()
+    indexed = {"a.py": "v1", "b.py": "v1", "c.py": "v1"}
+
+    sync = ingestion.RepositorySync(collection, "owner/repo", "c2", indexed=indexed)
+    changed = list(sync.changedFiles([File("a.py", "v1"), File("b.py", "v2"), File("d.py", "v1")]))
+    assert [f.path for f in changed] == ["b.py", "d.py"]
+    for file in changed:
+        store_file(sync, file.path, file.sha, 1)
+    assert sync.removeDeleted() == ["c.py"]
+    assert sync.unchanged == 1
+
+    stored = {(d["path"], d["sha"], d["commit"]) for d in collection.find({"name": "owner/repo"})}
+    assert stored == {("a.py", "v1", "c1"), ("b.py", "v2", "c2"), ("d.py", "v1", "c2")}
+
+def test_resync_reads_files_missing_from_the_indexes():
+    collection = fakes.FakeCollection(latency=0)
+    sync = ingestion.RepositorySync(collection, "owner/repo", "c1", full=True)
+    store_file(sync, "a.py", "v1", 1)
+    sync.removeDeleted()
+
+    # Stored in the collection but not in the lexical and symbol indexes, e.g. when a load was interrupted
+    sync = ingestion.RepositorySync(collection, "owner/repo", "c1", indexed={})
+    assert [f.path for f in sync.changedFiles([File("a.py", "v1")])] == ["a.py"]
+
+def test_ingest_repository_only_processes_changes(fake_resources, fake_repository):
+    files = fakes.synthetic_repository(12)
+    repo = fake_repository(files)
+    asyncio.run(ingestion.ingest_repository(fake_resources, repo, full=True))
+    documents = fake_resources.collection.find({"name": repo.getName()})
+    assert {d["path"] for d in documents} == set(files)
+
+    changed = sorted(path for path in files if path.endswith(".py"))[:2]
+    files[changed[0]] += b"\n# changed\n"
+    del files[changed[1]]
+    repo = fake_repository(files)
+    report = asyncio.run(ingestion.ingest_repository(fake_resources, repo))
+    assert "skipped 10 unchanged file(s), removed 1 deleted file(s)" in report
+    documents = fake_resources.collection.find({"name": repo.getName()})
+    assert {d["path"] for d in documents} == set(files)
+
+def test_resume_after_a_crash_skips_checkpointed_files(tmp_path, fake_resources, fake_repository):
+    files = fakes.synthetic_repository(30)
+    repo = fake_repository(files)
+
+    # The process dies while the 13th file is stored, after the checkpoints at 5 and 10 files
+    def crash(output):
+        if output.count("\n- ") == 13:
+            raise RuntimeError("killed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(ingestion.ingest_repository(fake_resources, repo, full=True, on_progress=crash, checkpoint_every=5))
+    assert os.path.exists(fake_resources.lexical_indexes._path(repo.getName()) + ".log")
+
+    # A new process loads the indexes from disk, the collection kept what was written
+    fake_resources.lexical_indexes = lexical.LexicalIndexes(str(tmp_path / "lexical"))
+    fake_resources.symbol_indexes = symbolindex.SymbolIndexes(str(tmp_path / "symbols"))
+    assert len(fake_resources.symbol_indexes.get(repo.getName()).files) == 10
+    report = asyncio.run(ingestion.ingest_repository(fake_resources, repo, checkpoint_every=5))
+    assert "skipped 10 unchanged file(s), removed 0 deleted file(s)" in report
+    assert report.count("\n- ") == 20
+    assert {d["path"] for d in fake_resources.collection.find({"name": repo.getName()})} == set(files)
+    assert len(fake_resources.lexical_indexes.get(repo.getName()).paths) == 30
@@ -0,0 +1,67 @@
+import time
+
+import fakes
+import jobs
+
+def local_repository(directory, files: int = 6):
+    for path, content in fakes.synthetic_repository(files).items():
+        (directory / path).parent.mkdir(parents=True, exist_ok=True)
+        (directory / path).write_bytes(content)
+    return {"mode": "local", "local_path": str(directory), "extensions": ".md, .py", "full": True}
+
+def wait_for(queue, job_id: str, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in (jobs.DONE, jobs.FAILED):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+def test_jobs_load_repositories_in_the_background(tmp_path, fake_resources):
+    (tmp_path / "repo").mkdir()
+    options = local_repository(tmp_path / "repo")
+    queue = jobs.JobQueue(str(tmp_path / "jobs.sqlite"), fake_resources, workers=1)
+    job_id = queue.submit("owner/repo", options)
+    # A repository is only queued once
+    assert queue.submit("owner/repo", options) == job_id
+
+    queue.start()
+    try:
+        job = wait_for(queue, job_id)
+    finally:
+        queue.stop()
+    assert job["status"] == jobs.DONE, job["error"]
+    assert job["attempts"] == 1
+    assert job["result"] == job["progress"]
+    assert len({d["path"] for d in fake_resources.collection.find({"name": "owner/repo"})}) == 6
+    assert [j["id"] for j in queue.list()] == [job_id]
+
+def test_running_jobs_resume_after_a_restart(tmp_path, fake_resources, monkeypatch):
+    (tmp_path / "repo").mkdir()
+    options = local_repository(tmp_path / "repo")
+    path = str(tmp_path / "jobs.sqlite")
+    queue = jobs.JobQueue(path, fake_resources, workers=1)
+    job_id = queue.submit("owner/repo", options)
+    # The process stops while the job runs
+    assert queue._claim()["id"] == job_id
+    assert queue.get(job_id)["status"] == jobs.RUNNING
+
+    loads = []
+    ingest_repository = jobs.ingestion.ingest_repository
+
+    async def recording(resources, repo, full: bool = False, **kwargs):
+        loads.append(full)
+        return await ingest_repository(resources, repo, full=full, **kwargs)
+
+    monkeypatch.setattr(jobs.ingestion, "ingest_repository", recording)
+    queue = jobs.JobQueue(path, fake_resources, workers=1)
+    queue.start()
+    try:
+        job = wait_for(queue, job_id)
+    finally:
+        queue.stop()
+    assert job["status"] == jobs.DONE, job["error"]
+    assert job["attempts"] == 2
+    # The second attempt continues from the checkpoint instead of dropping what was stored
+    assert loads == [False]
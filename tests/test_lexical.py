@@ -0,0 +1,93 @@
+import os
+
+import lexical
+
+def test_tokenize_splits_identifiers():
+    assert lexical.tokenize("getRepositoryContents(max_file_size)") == ["getrepositorycontents", "get", "repository", "contents", "max_file_size", "max", "file", "size"]
+    assert lexical.tokenize("HTTPServer 42") == ["httpserver", "http", "server", "42"]
+
+def test_search_ranks_exact_identifiers_first():
+    index = lexical.BM25Index()
+    index.add("a", "def setExtensions(self, extensions): self.extensions = extensions", {"path": "reporeader.py"}, ["setExtensions"])
+    index.add("b", "Set the extensions of the files to read in the sidebar", {"path": "README.md"})
+    index.add("c", "def connect(self, token): self.token = token", {"path": "reporeader.py"}, ["connect"])
+    results = index.search("where is setExtensions called")
+    assert [document_id for document_id, _, _ in results] == ["a", "b"]
+    assert results[0][1] > results[1][1]
+    assert index.search("nothing matches") == []
+
+def test_remove_path_forgets_its_documents():
+    index = lexical.BM25Index()
+    index.add("a:0", "alpha beta", {"path": "a.py"})
+    index.add("a:1", "alpha gamma", {"path": "a.py"})
+    index.add("b:0", "alpha", {"path": "b.py"})
+    index.removePath("a.py")
+    assert [document_id for document_id, _, _ in index.search("alpha gamma")] == ["b:0"]
+    assert "gamma" not in index.postings
+    assert index.total_length == 1
+
+def test_indexes_are_saved_and_loaded(tmp_path):
+    indexes = lexical.LexicalIndexes(str(tmp_path))
+    indexes.get("owner/repo").add("a", "parseConfig reads the settings", {"path": "config.py", "start_line": 1})
+    indexes.save("owner/repo")
+
+    loaded = lexical.LexicalIndexes(str(tmp_path)).get("owner/repo")
+    assert loaded.search("config") == indexes.get("owner/repo").search("config")
+    assert loaded.search("config")[0][2] == {"path": "config.py", "start_line": 1}
+
+def test_reciprocal_rank_fusion_prefers_items_in_both_rankings():
+    fused = lexical.reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "b"]])
+    assert fused == ["c", "b", "a", "d"]
+    assert lexical.reciprocal_rank_fusion([["x", "y"]]) == ["x", "y"]
+
+def test_saves_only_append_what_changed(tmp_path):
+    path = str(tmp_path / "index.json.gz")
+    index = lexical.BM25Index()
+    for number in range(100):
+        index.add(f"file{number}.py#0", f"function{number} reads orders", {"path": f"file{number}.py"})
+    index.save(path)
+    snapshot = os.path.getmtime(path), os.path.getsize(path)
+
+    index.add("file0.py#0", "function0 writes invoices", {"path": "file0.py"})
+    index.add("new.py#0", "parseConfig", {"path": "new.py"})
+    index.removePath("file1.py")
+    index.save(path)
+    index.save(path)
+    assert (os.path.getmtime(path), os.path.getsize(path)) == snapshot
+    with open(path + ".log") as f:
+        assert len(f.readlines()) == 1
+
+    loaded = lexical.BM25Index.load(path)
+    assert loaded.documents == index.documents
+    assert loaded.total_length == index.total_length
+    assert loaded.search("invoices orders parseConfig") == index.search("invoices orders parseConfig")
+
+def test_a_torn_log_entry_is_ignored(tmp_path):
+    path = str(tmp_path / "index.json.gz")
+    index = lexical.BM25Index()
+    index.add("a#0", "alpha", {"path": "a.py"})
+    index.save(path)
+    index.add("b#0", "beta", {"path": "b.py"})
+    index.save(path)
+    with open(path + ".log", "a") as f:
+        f.write('{"snapshot": "')
+
+    loaded = lexical.BM25Index.load(path)
+    assert sorted(loaded.documents) == ["a#0", "b#0"]
+    # The next save starts over with a snapshot, so nothing is appended after the torn entry
+    loaded.add("c#0", "gamma", {"path": "c.py"})
+    loaded.save(path)
+    assert not os.path.exists(path + ".log")
+    assert sorted(lexical.BM25Index.load(path).documents) == ["a#0", "b#0", "c#0"]
+
+def test_the_log_is_folded_into_a_new_snapshot(tmp_path):
+    path = str(tmp_path / "index.json.gz")
+    index = lexical.BM25Index()
+    index.save(path)
+    for number in range(1100):
+        index.add(f"file{number}.py#0", f"function{number}", {"path": f"file{number}.py"})
+        if number % 50 == 49:
+            index.save(path)
+    # 1000 files were logged, the next 100 went in a snapshot
+    assert index.snapshot == 1050 and index.logged == 50
+    assert len(lexical.BM25Index.load(path).documents) == 1100
@@ -0,0 +1,23 @@
+import asyncio
+
+import documentation
+import fakes
+import ingestion
+import ratelimit
+
+def test_map_reduce_summarizes_in_the_background(fake_resources, fake_repository):
+    repo = fake_repository(fakes.synthetic_repository(12))
+    asyncio.run(ingestion.ingest_repository(fake_resources, repo, full=True))
+    fake_resources.rate_limiter.priorities.clear()
+
+    result = asyncio.run(documentation.generate_documentation(fake_resources, repo, mode="map-reduce"))
+    assert set(result) == {key for key, _, _, _ in documentation.SECTIONS}
+    priorities = fake_resources.rate_limiter.priorities
+    # Only the sections someone waits for are interactive
+    assert priorities.count(ratelimit.INTERACTIVE) == len(documentation.SECTIONS)
+    assert priorities.count(ratelimit.BACKGROUND) >= 12
+
+    # Unchanged files aren't summarized again
+    priorities.clear()
+    asyncio.run(documentation.generate_documentation(fake_resources, repo, mode="map-reduce", force=True))
+    assert priorities == [ratelimit.INTERACTIVE] * len(documentation.SECTIONS)
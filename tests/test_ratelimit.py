@@ -0,0 +1,125 @@
+import asyncio
+import types
+
+import pytest
+
+import ratelimit
+
+class ClockedRateLimiter(ratelimit.RateLimiter):
+    """A rate limiter on a clock that only moves when the test moves it"""
+
+    def __init__(self, *args, **kwargs):
+        self.now = 1000.0
+        super().__init__(*args, **kwargs)
+
+    def _now(self) -> float:
+        return self.now
+
+class RateLimited(Exception):
+    def __init__(self, headers: dict = None):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = types.SimpleNamespace(status_code=429, headers=headers or {})
+
+def test_background_requests_leave_the_reserve():
+    limiter = ClockedRateLimiter(requests_per_minute=10, tokens_per_minute=100000, reserve=0.2)
+    for _ in range(8):
+        assert limiter._tryAcquire(10, ratelimit.BACKGROUND) == 0
+    assert limiter._tryAcquire(10, ratelimit.BACKGROUND) > 0
+    assert limiter._tryAcquire(10, ratelimit.INTERACTIVE) == 0
+    assert limiter._tryAcquire(10, ratelimit.INTERACTIVE) == 0
+    # The buckets refill with time
+    limiter.now += 60
+    assert limiter._tryAcquire(10, ratelimit.BACKGROUND, waiting=True) == 0
+
+def test_background_requests_wait_for_interactive_ones():
+    limiter = ClockedRateLimiter(requests_per_minute=10, tokens_per_minute=1000, reserve=0)
+    assert limiter._tryAcquire(1000, ratelimit.INTERACTIVE) == 0
+    assert limiter._tryAcquire(500, ratelimit.INTERACTIVE) > 0
+    limiter.now += 60
+    # The interactive request is still queued, so it goes first once there's room
+    assert limiter._tryAcquire(10, ratelimit.BACKGROUND) > 0
+    assert limiter._tryAcquire(500, ratelimit.INTERACTIVE, waiting=True) == 0
+    assert limiter.waiting == [0, 1]
+    assert limiter._tryAcquire(10, ratelimit.BACKGROUND, waiting=True) == 0
+    assert limiter.waiting == [0, 0]
+
+def test_pause_holds_every_request():
+    limiter = ClockedRateLimiter()
+    limiter.pause(5)
+    assert limiter._tryAcquire(1, ratelimit.INTERACTIVE) == pytest.approx(5)
+    limiter.now += 5
+    assert limiter._tryAcquire(1, ratelimit.INTERACTIVE, waiting=True) == 0
+
+def test_cancelled_waiters_leave_the_queue():
+    limiter = ratelimit.RateLimiter(requests_per_minute=1, tokens_per_minute=1000, reserve=0)
+
+    async def run():
+        await limiter.acquire(1, ratelimit.INTERACTIVE)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire(1, ratelimit.INTERACTIVE), 0.05)
+
+    asyncio.run(run())
+    assert limiter.waiting == [0, 0]
+
+def test_retry_after_headers():
+    assert ratelimit.retry_after(RateLimited({"retry-after": "3"})) == 3
+    assert ratelimit.retry_after(RateLimited({"retry-after-ms": "1500"})) == 1.5
+    assert ratelimit.retry_after(RateLimited()) is None
+
+def test_rate_limits_are_found_on_wrapped_errors():
+    try:
+        try:
+            raise RateLimited()
+        except RateLimited as e:
+            raise RuntimeError("retries exhausted") from e
+    except RuntimeError as e:
+        assert ratelimit.is_rate_limited(e)
+    assert not ratelimit.is_rate_limited(ValueError("bad request"))
+
+def no_sleep(monkeypatch) -> list:
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", sleep)
+    return delays
+
+def test_retry_with_backoff_honors_retry_after(monkeypatch):
+    delays = no_sleep(monkeypatch)
+    limiter = ClockedRateLimiter()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RateLimited({"retry-after": "2"})
+        return "done"
+
+    assert asyncio.run(ratelimit.retry_with_backoff(call, limiter=limiter)) == "done"
+    assert delays == [2, 2]
+    # Everyone sharing the limiter was paused as well
+    assert limiter.paused_until == limiter.now + 2
+
+def test_retry_with_backoff_only_retries_rate_limits(monkeypatch):
+    delays = no_sleep(monkeypatch)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(ratelimit.retry_with_backoff(failing))
+    assert len(calls) == 1
+
+    async def limited():
+        calls.append(1)
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        asyncio.run(ratelimit.retry_with_backoff(limited, retries=2, base_delay=1))
+    assert len(calls) == 4
+    # Exponential backoff with jitter
+    assert 0.5 <= delays[0] <= 1 and 1 <= delays[1] <= 2
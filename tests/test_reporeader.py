@@ -0,0 +1,24 @@
+import os
+
+import reporeader
+
+def test_local_skips_broken_symlinks(tmp_path):
+    (tmp_path / "app.py").write_text("print('hello')\n")
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "node_modules" / "lib.py").write_text("")
+    os.symlink(tmp_path / "missing.py", tmp_path / "broken.py")
+    os.symlink(tmp_path / "missing.txt", tmp_path / "ignored.txt")
+
+    repo = reporeader.RepoReader()
+    repo.setLocalPath(str(tmp_path))
+    files = list(repo.getRepositoryContents())
+    assert [f.path for f in files] == ["app.py"]
+    assert files[0].decoded_content == b"print('hello')\n"
+    # Vendored directories aren't walked at all, broken files of other types aren't counted
+    assert repo.skipped == {"unreadable": 1}
+
+def test_tree_reads_matching_files(fake_repository):
+    repo = fake_repository({"README.md": b"# Readme\n", "src/app.py": b"x = 1\n", "package-lock.json": b"{}", "logo.png": b"png"})
+    files = {f.path: f for f in repo.getRepositoryContents()}
+    assert sorted(files) == ["README.md", "src/app.py"]
+    assert files["src/app.py"].decoded_content == b"x = 1\n"
@@ -0,0 +1,91 @@
+import os
+import time
+
+import extractors
+import symbolindex
+
+FILES = {
+    "pkg/__init__.py": "",
+    "pkg/orders.py": "import os\n\nclass OrderService():\n    def create(self, order):\n        return order\n\ndef total(orders):\n    return sum(orders)\n",
+    "pkg/payments.py": "from .orders import OrderService\n\nclass PaymentService():\n    def pay(self):\n        return OrderService().create(1)\n",
+    "app.py": "import pkg.payments\nfrom pkg import orders\n\ndef main():\n    pkg.payments.PaymentService().pay()\n",
+}
+
+def build(files: dict) -> symbolindex.SymbolIndex:
+    index = symbolindex.SymbolIndex()
+    for path, content in files.items():
+        index.addFile(path, f"sha-{path}", extractors.analyze(path.rsplit("/", 1)[-1], content), content)
+    return index
+
+def test_definitions_and_usages():
+    index = build(FILES)
+    assert [(path, s["line"]) for path, s in index.define("OrderService")] == [("pkg/orders.py", 3)]
+    assert [path for path, _ in index.define("OrderService.create")] == ["pkg/orders.py"]
+    assert index.define("PaymentService.create") == []
+    assert index.usages("OrderService") == ["pkg/orders.py", "pkg/payments.py"]
+
+    answer = symbolindex.answer_question(index, "Where is OrderService defined?")
+    assert answer == "`OrderService` is defined in:\n- `pkg/orders.py` line 3: class `OrderService`"
+    answer = symbolindex.answer_question(index, "who uses OrderService", read=FILES.get)
+    assert "- `pkg/payments.py` lines 1, 5" in answer
+    assert "pkg/orders.py" not in answer
+
+def test_dependents():
+    index = build(FILES)
+    # "from pkg import orders" imports the package
+    assert index.dependents("pkg/orders.py") == ["pkg/payments.py"]
+    assert index.dependents("pkg/payments") == ["app.py"]
+    # Packages resolve to their __init__, modules outside the repository match by name
+    assert index.dependents("pkg/__init__.py") == ["app.py"]
+    assert index.dependents("os") == ["pkg/orders.py"]
+    assert index.importsOf("pkg/payments.py") == [(".orders", "pkg/orders.py")]
+    assert "Files importing `pkg/orders.py`:\n- `pkg/payments.py`" in symbolindex.answer_question(index, "who imports pkg/orders.py")
+    assert symbolindex.answer_question(index, "what does app.py import") == "`app.py` imports:\n- `pkg.payments` (`pkg/payments.py`)\n- `pkg` (`pkg/__init__.py`)"
+
+def test_dependents_follow_files_coming_and_going():
+    index = build({path: FILES[path] for path in ("app.py", "pkg/payments.py")})
+    # Imported before the file itself was added
+    assert index.dependents("pkg/payments.py") == ["app.py"]
+    assert index.importsOf("pkg/payments.py") == [(".orders", None)]
+    index = build(FILES)
+    index.removePath("pkg/orders.py")
+    assert index.dependents("pkg/orders.py") == []
+    assert index.importsOf("pkg/payments.py") == [(".orders", None)]
+    index.addFile("pkg/payments.py", "sha-2", extractors.analyze("payments.py", "import os\n"), "import os\n")
+    assert index.dependents("os") == ["pkg/payments.py"]
+    assert index.importers == {"pkg/payments.py": {"app.py": 1}, "pkg/__init__.py": {"app.py": 1}}
+
+def test_list_questions():
+    index = build(FILES)
+    assert symbolindex.answer_question(index, "list classes in pkg") == "The classes in `pkg`:\n- `OrderService` (`pkg/orders.py` line 3)\n- `PaymentService` (`pkg/payments.py` line 3)"
+    assert symbolindex.answer_question(index, "list functions in pkg/orders.py") == "The functions in `pkg/orders.py`:\n- `create(self, order)` (`pkg/orders.py` line 4)\n- `total(orders)` (`pkg/orders.py` line 7)"
+    assert symbolindex.answer_question(index, "list classes in app.py") == "There are no classes in `app.py`."
+    assert symbolindex.answer_question(index, "How does the payment flow work?") is None
+
+def test_saved_indexes_resolve_the_same(tmp_path):
+    path = str(tmp_path / "index.json.gz")
+    index = build(FILES)
+    index.save(path)
+    # Changes after the snapshot go in the log
+    index.removePath("pkg/orders.py")
+    index.addFile("pkg/orders.py", "sha-2", extractors.analyze("orders.py", "class OrderService():\n    pass\n"), "class OrderService():\n    pass\n")
+    index.removePath("app.py")
+    index.save(path)
+    assert os.path.exists(path + ".log")
+
+    loaded = symbolindex.SymbolIndex.load(path)
+    assert sorted(loaded.files) == sorted(index.files)
+    assert loaded.files["pkg/orders.py"]["sha"] == "sha-2"
+    assert loaded.importers == index.importers
+    assert loaded.resolved == index.resolved
+    assert loaded.definitions == index.definitions
+
+def test_dependents_are_a_lookup():
+    files = {}
+    for number in range(3000):
+        imports = "".join(f"import pkg.mod{(number + offset) % 3000}\n" for offset in range(1, 9))
+        files[f"pkg/mod{number}.py"] = imports + f"\ndef function{number}():\n    return {number}\n"
+    index = build(files)
+    started = time.perf_counter()
+    assert index.dependents("pkg/mod5") == sorted(f"pkg/mod{(5 - offset) % 3000}.py" for offset in range(1, 9))
+    assert time.perf_counter() - started < 0.1
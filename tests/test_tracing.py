@@ -0,0 +1,37 @@
+import json
+
+import tracing
+
+def test_breakdown_covers_every_span():
+    tracer = tracing.Tracer(max_traces=2)
+    with tracer.span("load") as root:
+        for _ in range(30000):
+            with tracer.span("load.file"):
+                tracer.count("github.calls", operation="get_git_blob")
+    breakdown = tracer.breakdown(root.trace_id)
+    assert breakdown["name"] == "load"
+    stages = {s["stage"]: s for s in breakdown["stages"]}
+    assert stages["load.file"]["calls"] == 30000
+    assert breakdown["counts"] == {"github.calls[get_git_blob]": 30000}
+
+def test_oldest_traces_are_dropped():
+    tracer = tracing.Tracer(max_traces=2)
+    ids = []
+    for name in ("a", "b", "c"):
+        with tracer.span(name) as span:
+            ids.append(span.trace_id)
+    assert tracer.breakdown(ids[0])["name"] is None
+    assert [tracer.breakdown(i)["name"] for i in ids[1:]] == ["b", "c"]
+
+def test_json_lines_exporter(tmp_path):
+    tracer = tracing.Tracer()
+    exporter = tracing.JsonLinesExporter(str(tmp_path / "spans.jsonl"))
+    tracer.exporters.append(exporter)
+    with tracer.span("outer"):
+        with tracer.span("inner", path="x.py"):
+            pass
+    with open(tmp_path / "spans.jsonl") as f:
+        spans = [json.loads(line) for line in f]
+    exporter.close()
+    assert [s["name"] for s in spans] == ["inner", "outer"]
+    assert spans[0]["parent_id"] == spans[1]["span_id"]
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+import vectorstore
+
+def documents(name: str, paths: list) -> list:
+    return [{"name": name, "path": path, "$vectorize": f"{name} {path} handles payments"} for path in paths]
+
+def test_search_is_scoped_by_filter():
+    store = vectorstore.LocalVectorStore()
+    store.insert_many(documents("a", ["x.py", "y.py"]) + documents("b", ["z.py"]))
+    assert {d["path"] for d in store.find({"name": "a"}, vectorize="payments", limit=5)} == {"x.py", "y.py"}
+    assert store.delete_many({"name": "a", "path": {"$in": ["x.py"]}}) == 1
+    assert [d["path"] for d in store.find({"name": "a"})] == ["y.py"]
+
+def test_persist_appends_and_reloads(tmp_path):
+    path = str(tmp_path / "vectors")
+    store = vectorstore.LocalVectorStore(path)
+    store.insert_many(documents("a", [f"{i}.py" for i in range(10)]))
+    store.persist()
+    snapshot = os.path.getmtime(os.path.join(path, "documents.json"))
+
+    # Later checkpoints only append what changed
+    store.insert_many(documents("a", ["10.py", "11.py"]))
+    store.delete_many({"path": {"$in": ["0.py", "11.py"]}})
+    store.persist()
+    store.insert_many(documents("b", ["x.py"]))
+    store.persist()
+    assert os.path.getmtime(os.path.join(path, "documents.json")) == snapshot
+    assert os.path.exists(os.path.join(path, "documents.log"))
+
+    loaded = vectorstore.LocalVectorStore(path)
+    assert sorted(d["path"] for d in loaded.find({"name": "a"})) == sorted(f"{i}.py" for i in range(1, 11))
+    assert [d["path"] for d in loaded.find({"name": "b"}, vectorize="b x.py handles payments", limit=1)] == ["x.py"]
+    np.testing.assert_allclose(loaded.vectors[:loaded.count], store.vectors[:store.count])
+
+def test_persist_compacts_a_large_log(tmp_path):
+    path = str(tmp_path / "vectors")
+    store = vectorstore.LocalVectorStore(path)
+    store.persist()
+    for batch in range(30):
+        store.insert_many(documents("a", [f"{batch}_{i}.py" for i in range(50)]))
+        store.persist()
+    assert not os.path.exists(os.path.join(path, "documents.log")) or os.path.getsize(os.path.join(path, "documents.log")) < os.path.getsize(os.path.join(path, "documents.json"))
+    assert vectorstore.LocalVectorStore(path).count == 1500
+
+def test_torn_log_entry_is_dropped(tmp_path):
+    path = str(tmp_path / "vectors")
+    store = vectorstore.LocalVectorStore(path)
+    store.insert_many(documents("a", ["x.py"]))
+    store.persist()
+    store.insert_many(documents("a", ["y.py"]))
+    store.persist()
+    with open(os.path.join(path, "documents.log"), "a") as f:
+        f.write('{"snapshot": "torn", "del')
+
+    loaded = vectorstore.LocalVectorStore(path)
+    assert sorted(d["path"] for d in loaded.find({"name": "a"})) == ["x.py", "y.py"]
+    loaded.insert_many(documents("a", ["z.py"]))
+    loaded.persist()
+    assert sorted(d["path"] for d in vectorstore.LocalVectorStore(path).find({"name": "a"})) == ["x.py", "y.py", "z.py"]
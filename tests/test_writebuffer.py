@@ -0,0 +1,64 @@
+import types
+
+import fakes
+import writebuffer
+
+def test_documents_are_written_in_batches():
+    collection = fakes.FakeCollection(latency=0)
+    buffer = writebuffer.WriteBuffer(collection, batch_size=10, chunk_size=5)
+    for number in range(25):
+        buffer.add({"name": "owner/repo", "path": f"file{number}.py", "$vectorize": f"file {number}"})
+    # Two full batches of two chunks each, the rest waits for a flush
+    assert collection.counter.counts["astra.insert_many"] == 4
+    assert len(buffer.pending) == 5
+    buffer.flush()
+    assert len(collection.find({"name": "owner/repo"})) == 25
+    assert buffer.stats["batches"] == 3
+    assert buffer.stats["requests"] == 5
+    assert buffer.failed == []
+
+def test_before_flush_runs_before_the_writes():
+    collection = fakes.FakeCollection(latency=0)
+    stored = []
+    buffer = writebuffer.WriteBuffer(collection, batch_size=3, before_flush=lambda: stored.append(len(collection.find())))
+    for number in range(6):
+        buffer.add({"path": f"file{number}.py", "$vectorize": f"file {number}"})
+    assert stored == [0, 3]
+
+class FlakyCollection():
+    """Inserts all but the first document of every request, and reports the others like astrapy does"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.documents = {}
+
+    def insert_many(self, documents: list, ordered: bool = False):
+        for document in documents[1:] if self.failures else documents:
+            self.documents[document["_id"]] = document
+        if self.failures:
+            self.failures -= 1
+            error = RuntimeError("partial failure")
+            error.partial_result = types.SimpleNamespace(inserted_ids=[d["_id"] for d in documents[1:]])
+            raise error
+
+def test_partial_failures_only_retry_what_was_not_inserted(monkeypatch):
+    monkeypatch.setattr(writebuffer.time, "sleep", lambda seconds: None)
+    collection = FlakyCollection(failures=2)
+    buffer = writebuffer.WriteBuffer(collection, batch_size=100)
+    for number in range(5):
+        buffer.add({"path": f"file{number}.py"})
+    buffer.flush()
+    assert len(collection.documents) == 5
+    assert buffer.stats["retries"] == 2
+    assert buffer.failed == []
+
+def test_documents_that_never_made_it_are_failed(monkeypatch):
+    monkeypatch.setattr(writebuffer.time, "sleep", lambda seconds: None)
+    collection = FlakyCollection(failures=10)
+    buffer = writebuffer.WriteBuffer(collection, batch_size=100, retries=2)
+    for number in range(5):
+        buffer.add({"path": f"file{number}.py"})
+    buffer.flush()
+    assert [d["path"] for d in buffer.failed] == ["file0.py"]
+    assert buffer.stats["failed"] == 1
+    assert (buffer.stats["requests"], buffer.stats["retries"]) == (3, 2)
@@ -0,0 +1,35 @@
+from functools import lru_cache
+
+#
+# Token counting with the tokenizer of the model, falls back to an estimate when tiktoken isn't installed.
+#
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4o"):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+# Cut text down to at most max_tokens tokens
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    encoded = encoding.encode(text, disallowed_special=())
+    if len(encoded) <= max_tokens:
+        return text
+    return encoding.decode(encoded[:max_tokens])
\ No newline at end of file
@@ -0,0 +1,200 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+#
+# Spans and counters for every stage of ingestion and retrieval, so a slow load or answer can be broken down into
+# GitHub listing, fetching, attribute extraction, writes and generation. Spans nest through a context variable,
+# so they follow asyncio tasks and asyncio.to_thread. Counters (API calls, tokens, bytes) are kept process-wide
+# for the Prometheus text and per span for the breakdown of a run. Finished spans can be exported as JSON lines.
+#
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+
+class Span():
+    """A timed stage, with attributes and the counters recorded while it was current"""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "counts")
+
+    def __init__(self, name: str, parent: "Span" = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.counts = Counter()
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def toDict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": round(self.duration, 6),
+            "attributes": self.attributes,
+            "counts": dict(self.counts)
+        }
+
+class JsonLinesExporter():
+    """Appends every finished span to a file as one JSON object per line"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        # Kept open and line buffered, so every span is on disk without opening the file for each one
+        self.file = open(path, "a", buffering=1)
+
+    def export(self, span: Span):
+        line = json.dumps(span.toDict(), default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class Tracer():
+    """Keeps time and counters per stage of the last max_traces traces, and the process-wide counters and durations.
+    Stages are added up as their spans finish, so a trace of any size is broken down completely."""
+
+    def __init__(self, max_traces: int = 1000):
+        self.max_traces = max_traces
+        self.traces = OrderedDict()         # trace id -> {"root": span, "stages": {name: totals}, "counts": Counter}
+        self.counters = Counter()           # (name, labels) -> value
+        self.durations = {}                 # span name -> [count, seconds]
+        self.exporters = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, _current.get(), attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span)
+
+    # A span for something that already happened, e.g. the wait for the first token of a stream
+    def record(self, name: str, duration: float, **attributes) -> Span:
+        span = Span(name, _current.get(), attributes)
+        span.start -= duration
+        self._finish(span)
+        return span
+
+    def _finish(self, span: Span):
+        span.end = time.time()
+        duration = span.duration
+        with self.lock:
+            totals = self.durations.setdefault(span.name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+            trace = self.traces.get(span.trace_id)
+            if trace is None:
+                trace = self.traces[span.trace_id] = {"root": None, "stages": {}, "counts": Counter()}
+                while len(self.traces) > self.max_traces:
+                    self.traces.popitem(last=False)
+            stage = trace["stages"].setdefault(span.name, {"stage": span.name, "calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += duration
+            stage["max_seconds"] = max(stage["max_seconds"], duration)
+            trace["counts"].update(span.counts)
+            if span.parent_id is None:
+                trace["root"] = span
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    # Add to a counter, e.g. count("github.calls", operation="get_git_blob"), and to the current span
+    def count(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+        span = _current.get()
+        if span is not None:
+            label = name + "".join(f"[{v}]" for _, v in key[1])
+            span.counts[label] += amount
+
+    # Time and counters per stage of a trace, stages that ran concurrently add up to more than the wall time
+    def breakdown(self, trace_id: str) -> dict:
+        with self.lock:
+            trace = self.traces.get(trace_id) or {"root": None, "stages": {}, "counts": Counter()}
+            root = trace["root"]
+            stages = [dict(stage) for stage in trace["stages"].values()]
+            counts = dict(sorted(trace["counts"].items()))
+        return {
+            "name": root.name if root else None,
+            "seconds": root.duration if root else None,
+            "attributes": root.attributes if root else {},
+            "stages": sorted(stages, key=lambda s: s["seconds"], reverse=True),
+            "counts": counts
+        }
+
+    # The counters and span durations in the Prometheus text exposition format
+    def prometheus(self, prefix: str = "codewhisperer") -> str:
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            durations = sorted(self.durations.items())
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{prefix}_{_metricName(name)}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{_labels(labels)} {value:g}")
+        if durations:
+            lines.append(f"# TYPE {prefix}_span_seconds summary")
+            for name, (count, seconds) in durations:
+                lines.append(f"{prefix}_span_seconds_sum{_labels((('span', name),))} {seconds:.6f}")
+                lines.append(f"{prefix}_span_seconds_count{_labels((('span', name),))} {count}")
+        return "\n".join(lines) + "\n"
+
+def _metricName(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{_metricName(k)}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# The process-wide tracer everything reports to
+tracer = Tracer()
+
+def span(name: str, **attributes):
+    return tracer.span(name, **attributes)
+
+def count(name: str, amount: float = 1, **labels):
+    tracer.count(name, amount, **labels)
+
+def record(name: str, duration: float, **attributes) -> Span:
+    return tracer.record(name, duration, **attributes)
+
+def current() -> Span:
+    return _current.get()
+
+# Export finished spans to a JSON lines file, once per path
+def configure(path: str = None):
+    if path and not any(isinstance(e, JsonLinesExporter) and e.path == path for e in tracer.exporters):
+        tracer.exporters.append(JsonLinesExporter(path))
@@ -0,0 +1,509 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+
+import tracing
+
+#
+# The vector collection the app works with. Astra DB is one backend, the other one keeps everything in
+# process in a float32 NumPy matrix, so retrieval needs no network and the pipeline can run offline.
+# Both take the same documents: "$vectorize" holds the text to embed, "$vector" a precomputed embedding.
+# Every document carries the "name" of its repository, and every search and delete is scoped by it. Either all
+# repositories share one collection, or PartitionedVectorStore keeps a collection per repository.
+#
+
+class VectorStore():
+    """What the app needs from a vector collection"""
+
+    def insert_one(self, document: dict):
+        raise NotImplementedError
+
+    def insert_many(self, documents: list, ordered: bool = False):
+        raise NotImplementedError
+
+    def delete_many(self, filter: dict):
+        raise NotImplementedError
+
+    def find(self, filter: dict = None, vectorize: str = None, vector: list = None, limit: int = None, projection = None) -> list:
+        raise NotImplementedError
+
+    # The embedding for a text, as used for "$vectorize"
+    def vectorize(self, text: str) -> list:
+        raise NotImplementedError
+
+    # Make sure everything written so far is persisted
+    def persist(self):
+        pass
+
+    # Remove everything stored for a repository
+    def dropRepository(self, name: str):
+        self.delete_many({"name": name})
+
+class AstraVectorStore(VectorStore):
+    """An Astra DB collection, vectorize runs on the server unless an embedding is given.
+    With an embedding, "$vectorize" texts are embedded on the client and written as "$vector"."""
+
+    def __init__(self, collection, embedding = None):
+        self.collection = collection
+        self.embedding = embedding
+
+    # Replace "$vectorize" by a precomputed "$vector", embedding all texts of the call in one go
+    def _embedDocuments(self, documents: list) -> list:
+        if self.embedding is None:
+            return documents
+        documents = [dict(d) for d in documents]
+        pending = [d for d in documents if "$vectorize" in d and "$vector" not in d]
+        if pending:
+            with tracing.span("vectorize", texts=len(pending)):
+                vectors = self.embedding([d["$vectorize"] for d in pending])
+            for document, vector in zip(pending, vectors):
+                del document["$vectorize"]
+                document["$vector"] = [float(v) for v in vector]
+        return documents
+
+    def insert_one(self, document: dict):
+        document = self._embedDocuments([document])[0]
+        with tracing.span("astra.insert_one"):
+            tracing.count("astra.calls", operation="insert_one")
+            return self.collection.insert_one(document)
+
+    def insert_many(self, documents: list, ordered: bool = False):
+        documents = self._embedDocuments(documents)
+        with tracing.span("astra.insert_many", documents=len(documents)):
+            return self.collection.insert_many(documents, ordered=ordered)
+
+    def delete_many(self, filter: dict):
+        with tracing.span("astra.delete_many"):
+            tracing.count("astra.calls", operation="delete_many")
+            return self.collection.delete_many(filter)
+
+    def find(self, filter: dict = None, vectorize: str = None, vector: list = None, limit: int = None, projection = None) -> list:
+        options = {"projection": projection}
+        if limit is not None:
+            options["limit"] = limit
+        if vectorize is not None and self.embedding is not None:
+            vector, vectorize = self.vectorize(vectorize), None
+        if vectorize is not None:
+            options["vectorize"] = vectorize
+        elif vector is not None:
+            options["vector"] = vector
+        # The cursor is read here, so the span covers the round trips and not only creating it
+        with tracing.span("astra.find", limit=limit):
+            tracing.count("astra.calls", operation="find")
+            return list(self.collection.find(filter or {}, **options))
+
+    def vectorize(self, text: str) -> list:
+        if self.embedding is None:
+            raise NotImplementedError("Astra DB vectorizes on the server, pass the text to find() instead")
+        return [float(v) for v in self.embedding([text])[0]]
+
+class HashingEmbedding():
+    """A local embedding without a model: identifiers and words are hashed into a fixed number of dimensions"""
+
+    TOKENS = re.compile(r'[A-Za-z][a-z0-9]*|[A-Z]+(?![a-z])|\d+')
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.model = f"hashing-{dimension}"
+
+    def __call__(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self.TOKENS.findall(text):
+                digest = hashlib.blake2b(token.lower().encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dimension] += 1.0 if value >> 63 else -1.0
+        # Dampen frequent tokens
+        return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+class OpenAIEmbedding():
+    """Embeddings from the OpenAI API, the same model Astra DB vectorizes with"""
+
+    def __init__(self, client, model: str = "text-embedding-ada-002"):
+        self.client = client
+        self.model = model
+
+    def __call__(self, texts: list) -> np.ndarray:
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+class LocalVectorStore(VectorStore):
+    """Documents in memory with their vectors in one contiguous float32 matrix, searched with cosine similarity.
+    With partitions set, an IVF index limits the search to the partitions closest to the query."""
+
+    def __init__(self, path: str = None, embedding = None, partitions: int = 0, nprobe: int = 8):
+        # The embedding is any callable taking a list of texts and returning one vector per text
+        self.embedding = embedding or HashingEmbedding()
+        self.path = path
+        self.partitions = partitions
+        self.nprobe = nprobe
+        self.lock = threading.RLock()
+        self.documents = []
+        self.vectors = None
+        self.count = 0
+        self.centroids = None
+        self.assignments = None
+        self.index_changed = False
+        self.columns = {}
+        # What's on disk: the first `persisted` documents, the ids of persisted documents deleted since, the rows of
+        # the snapshot and the rows logged after it, None when a new snapshot has to be written
+        self.persisted = 0
+        self.deleted = []
+        self.snapshot = 0
+        self.snapshot_id = None
+        self.logged = None
+        if path is not None and os.path.exists(os.path.join(path, "documents.json")):
+            self._load()
+
+    def vectorize(self, text: str) -> list:
+        return self._embed([text])[0].tolist()
+
+    def _embed(self, texts: list) -> np.ndarray:
+        with tracing.span("vectorize", texts=len(texts)):
+            return _normalize(np.asarray(self.embedding(texts), dtype=np.float32))
+
+    def _ensureCapacity(self, needed: int, dimension: int):
+        if self.vectors is None:
+            self.vectors = np.zeros((max(needed, 1024), dimension), dtype=np.float32)
+        elif needed > self.vectors.shape[0] or not self.vectors.flags.writeable:
+            # Grow by doubling, this also copies a memory-mapped matrix into memory before it's changed
+            grown = np.zeros((max(needed, self.vectors.shape[0] * 2), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            self.vectors = grown
+
+    def insert_one(self, document: dict):
+        return self.insert_many([document])
+
+    def insert_many(self, documents: list, ordered: bool = False):
+        documents = [dict(d) for d in documents]
+        texts = [d["$vectorize"] for d in documents if "$vector" not in d]
+        embedded = iter(self._embed(texts)) if texts else iter(())
+        vectors = np.stack([_normalize(np.asarray(d.pop("$vector"), dtype=np.float32)) if "$vector" in d else next(embedded) for d in documents])
+        for document in documents:
+            document.setdefault("_id", uuid.uuid4().hex)
+
+        with self.lock:
+            self._append(documents, vectors)
+        return [d["_id"] for d in documents]
+
+    def _append(self, documents: list, vectors: np.ndarray):
+        self._ensureCapacity(self.count + len(documents), vectors.shape[1])
+        self.vectors[self.count:self.count + len(documents)] = vectors
+        if self.centroids is not None:
+            self.assignments = np.concatenate([self.assignments, self._nearestPartitions(vectors, 1)[:, 0]])
+        self.count += len(documents)
+        self.documents.extend(documents)
+        self.columns = {}
+
+    def delete_many(self, filter: dict):
+        with self.lock:
+            keep = ~self._mask(filter or {})
+            deleted = int(self.count - keep.sum())
+            if deleted:
+                # Deleted documents that are already on disk are logged by the next persist
+                self.deleted += [d["_id"] for d, k in zip(self.documents[:self.persisted], keep) if not k]
+                self.persisted = int(keep[:self.persisted].sum())
+                self._remove(keep)
+        return deleted
+
+    # Keep only the rows where keep is set
+    def _remove(self, keep: np.ndarray):
+        self.documents = [d for d, k in zip(self.documents, keep) if k]
+        remaining = self.vectors[:self.count][keep]
+        self.vectors = None
+        self.count = 0
+        if len(remaining):
+            self._ensureCapacity(len(remaining), remaining.shape[1])
+            self.vectors[:len(remaining)] = remaining
+            self.count = len(remaining)
+        if self.assignments is not None:
+            self.assignments = self.assignments[keep]
+        self.columns = {}
+
+    def find(self, filter: dict = None, vectorize: str = None, vector: list = None, limit: int = None, projection = None, include_similarity: bool = False) -> list:
+        if vectorize is not None:
+            query = self._embed([vectorize])[0]
+        elif vector is not None:
+            query = _normalize(np.asarray(vector, dtype=np.float32))
+        else:
+            query = None
+
+        with self.lock:
+            mask = self._mask(filter or {})
+            if query is None:
+                rows = np.flatnonzero(mask)[:limit]
+                return [_project(self.documents[i], projection) for i in rows]
+
+            if self.partitions and self.centroids is None and self.count >= self.partitions * 40:
+                self.buildIndex()
+            if self.centroids is not None:
+                probed = self._nearestPartitions(query[None, :], self.nprobe)[0]
+                mask &= np.isin(self.assignments, probed)
+
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            if self.centroids is not None or len(candidates) * 4 < self.count:
+                scores = self.vectors[candidates] @ query
+            else:
+                # Unless the filter is selective, one pass over the contiguous matrix is cheaper than gathering the candidate rows first
+                scores = (self.vectors[:self.count] @ query)[candidates]
+            k = min(limit or len(candidates), len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for i in top:
+                document = _project(self.documents[candidates[i]], projection)
+                if include_similarity:
+                    document["$similarity"] = float((scores[i] + 1) / 2)
+                results.append(document)
+            return results
+
+    # Rows matching a filter, supports equality, $in, $nin, $ne and $exists on top level fields
+    def _mask(self, filter: dict) -> np.ndarray:
+        mask = np.ones(self.count, dtype=bool)
+        for field, condition in filter.items():
+            codes, lookup = self._column(field)
+            code = lambda value: lookup.get(_key(value), -2)
+            if isinstance(condition, dict):
+                for operator, value in condition.items():
+                    if operator == "$in":
+                        mask &= np.isin(codes, [code(v) for v in value])
+                    elif operator == "$nin":
+                        mask &= ~np.isin(codes, [code(v) for v in value])
+                    elif operator == "$ne":
+                        mask &= codes != code(value)
+                    elif operator == "$exists":
+                        mask &= (codes != -1) == bool(value)
+                    else:
+                        raise ValueError(f"Unsupported filter operator {operator}")
+            else:
+                mask &= codes == code(condition)
+        return mask
+
+    # The values of one field encoded as integers, so filters are array comparisons. Cached until the documents change.
+    def _column(self, field: str):
+        if field not in self.columns:
+            lookup = {}
+            codes = np.fromiter((lookup.setdefault(_key(d[field]), len(lookup)) if field in d else -1 for d in self.documents), dtype=np.int64, count=self.count)
+            self.columns[field] = (codes, lookup)
+        return self.columns[field]
+
+    # Cluster the vectors with k-means, searches then only look at the nprobe nearest clusters
+    def buildIndex(self, partitions: int = None, iterations: int = 10):
+        with self.lock:
+            vectors = self.vectors[:self.count]
+            partitions = min(partitions or self.partitions or int(np.sqrt(self.count)), self.count)
+            if partitions < 2:
+                return
+            rng = np.random.default_rng(0)
+            centroids = vectors[rng.choice(self.count, partitions, replace=False)].copy()
+            for _ in range(iterations):
+                self.centroids = centroids
+                assignments = self._nearestPartitions(vectors, 1)[:, 0]
+                for p in range(partitions):
+                    members = vectors[assignments == p]
+                    if len(members):
+                        centroids[p] = _normalize(members.mean(axis=0))
+            self.centroids = centroids
+            self.assignments = self._nearestPartitions(vectors, 1)[:, 0]
+            self.index_changed = True
+
+    def _nearestPartitions(self, vectors: np.ndarray, n: int) -> np.ndarray:
+        scores = vectors @ self.centroids.T
+        n = min(n, self.centroids.shape[0])
+        return np.argsort(-scores, axis=1)[:, :n]
+
+    # Write what changed since the last persist. Added documents and vectors and the ids of deleted documents are
+    # appended to a log, which is folded into a new snapshot once it's as large as the snapshot, so persisting every
+    # few files of a long load doesn't rewrite everything every time. The vectors are memory-mapped when loaded again.
+    def persist(self):
+        if self.path is None:
+            return
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            if self.logged is None or self.logged + self.count - self.persisted + len(self.deleted) > max(1000, self.snapshot):
+                self._writeSnapshot()
+            elif self.count > self.persisted or self.deleted:
+                self._appendLog()
+            self.persisted = self.count
+            self.deleted = []
+            # Only the centroids are kept, assignments are computed again on load
+            if self.index_changed:
+                if self.centroids is not None:
+                    np.savez(os.path.join(self.path, "index.npz"), centroids=self.centroids)
+                elif os.path.exists(os.path.join(self.path, "index.npz")):
+                    os.remove(os.path.join(self.path, "index.npz"))
+                self.index_changed = False
+
+    # documents.json names the vectors file of the snapshot and replacing it is what commits the snapshot,
+    # log entries of an older snapshot are ignored, so a crash at any point leaves a consistent store
+    def _writeSnapshot(self):
+        snapshot_id = uuid.uuid4().hex
+        np.save(os.path.join(self.path, f"vectors.{snapshot_id}.npy"), self.vectors[:self.count] if self.vectors is not None else np.zeros((0, 0), dtype=np.float32))
+        with open(os.path.join(self.path, "documents.tmp.json"), "w") as f:
+            json.dump({"snapshot": snapshot_id, "documents": self.documents}, f)
+        os.replace(os.path.join(self.path, "documents.tmp.json"), os.path.join(self.path, "documents.json"))
+        for name in os.listdir(self.path):
+            if name in ("documents.log", "vectors.log", "vectors.npy") or (name.startswith("vectors.") and name.endswith(".npy") and name != f"vectors.{snapshot_id}.npy"):
+                os.remove(os.path.join(self.path, name))
+        self.snapshot_id = snapshot_id
+        self.snapshot = self.count
+        self.logged = 0
+
+    # One entry per persist: a line in documents.log and an array in vectors.log, the vectors go first
+    def _appendLog(self):
+        added = self.documents[self.persisted:self.count]
+        with open(os.path.join(self.path, "vectors.log"), "ab") as f:
+            np.save(f, self.vectors[self.persisted:self.count] if added else np.zeros((0, 0), dtype=np.float32))
+        with open(os.path.join(self.path, "documents.log"), "a") as f:
+            f.write(json.dumps({"snapshot": self.snapshot_id, "deleted": self.deleted, "documents": added}) + "\n")
+        self.logged += len(added) + len(self.deleted)
+
+    def _load(self):
+        with open(os.path.join(self.path, "documents.json")) as f:
+            snapshot = json.load(f)
+        # Stores written before the log existed hold a plain list and vectors.npy
+        if isinstance(snapshot, list):
+            snapshot = {"snapshot": None, "documents": snapshot}
+        self.snapshot_id = snapshot["snapshot"]
+        self.documents = snapshot["documents"]
+        vectors = np.load(os.path.join(self.path, f"vectors.{self.snapshot_id}.npy" if self.snapshot_id else "vectors.npy"), mmap_mode="r")
+        self.count = len(self.documents)
+        self.vectors = vectors if self.count else None
+        self.snapshot = self.count
+        self._replayLog()
+        self.persisted = self.count
+        if os.path.exists(os.path.join(self.path, "index.npz")):
+            self.centroids = np.load(os.path.join(self.path, "index.npz"))["centroids"]
+            self.assignments = self._nearestPartitions(self.vectors[:self.count], 1)[:, 0] if self.count else np.zeros(0, dtype=np.int64)
+
+    # Apply the entries logged after the snapshot. When the last entry is torn, the files are rewritten on the next persist.
+    def _replayLog(self):
+        entries = []
+        torn = False
+        if os.path.exists(os.path.join(self.path, "documents.log")):
+            with open(os.path.join(self.path, "documents.log")) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        torn = True
+                        break
+        arrays = []
+        if os.path.exists(os.path.join(self.path, "vectors.log")):
+            with open(os.path.join(self.path, "vectors.log"), "rb") as f:
+                while True:
+                    try:
+                        arrays.append(np.load(f))
+                    except EOFError:
+                        break
+                    except (ValueError, OSError):
+                        torn = True
+                        break
+        self.logged = 0 if self.snapshot_id and not torn and len(entries) == len(arrays) else None
+        for entry, vectors in zip(entries, arrays):
+            if entry["snapshot"] != self.snapshot_id:
+                continue
+            if entry["deleted"]:
+                deleted = set(entry["deleted"])
+                self._remove(np.fromiter((d["_id"] not in deleted for d in self.documents), dtype=bool, count=self.count))
+            if entry["documents"]:
+                self._append(entry["documents"], vectors)
+            if self.logged is not None:
+                self.logged += len(entry["deleted"]) + len(entry["documents"])
+
+class PartitionedVectorStore(VectorStore):
+    """A vector store per repository, so a search only looks at the documents of its own repository.
+    Calls are routed by the "name" in the document or filter, a filter without one goes to every partition."""
+
+    def __init__(self, factory, keys, drop):
+        # factory(key) returns the VectorStore of a partition, keys() lists the existing ones, drop(key) removes one
+        self.factory = factory
+        self.keys = keys
+        self.drop = drop
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    # A collection and directory name for a repository: letters, digits and underscores, at most 48 characters
+    @staticmethod
+    def key(name: str) -> str:
+        return "repo_" + hashlib.sha1(name.encode()).hexdigest()[:24]
+
+    def _store(self, key: str) -> VectorStore:
+        with self.lock:
+            if key not in self.stores:
+                self.stores[key] = self.factory(key)
+            return self.stores[key]
+
+    def _route(self, filter: dict) -> list:
+        name = (filter or {}).get("name")
+        if isinstance(name, str):
+            return [self._store(self.key(name))]
+        return [self._store(key) for key in sorted(set(self.keys()) | set(self.stores))]
+
+    def insert_one(self, document: dict):
+        return self._store(self.key(document["name"])).insert_one(document)
+
+    def insert_many(self, documents: list, ordered: bool = False):
+        partitions = {}
+        for document in documents:
+            partitions.setdefault(self.key(document["name"]), []).append(document)
+        for key, partition in partitions.items():
+            self._store(key).insert_many(partition, ordered=ordered)
+
+    def delete_many(self, filter: dict):
+        for store in self._route(filter):
+            store.delete_many(filter)
+
+    def find(self, filter: dict = None, vectorize: str = None, vector: list = None, limit: int = None, projection = None) -> list:
+        stores = self._route(filter)
+        if len(stores) == 1:
+            return stores[0].find(filter, vectorize=vectorize, vector=vector, limit=limit, projection=projection)
+        if vectorize is not None or vector is not None:
+            raise ValueError("A vector search across partitions needs a repository name in the filter")
+        results = []
+        for store in stores:
+            results += store.find(filter, limit=limit, projection=projection)
+        return results[:limit]
+
+    def vectorize(self, text: str) -> list:
+        raise NotImplementedError("Vectorize with the partition of a repository")
+
+    def persist(self):
+        with self.lock:
+            stores = list(self.stores.values())
+        for store in stores:
+            store.persist()
+
+    def dropRepository(self, name: str):
+        key = self.key(name)
+        with self.lock:
+            self.stores.pop(key, None)
+        self.drop(key)
+
+# Filter values are compared by key, lists and dicts by their JSON
+def _key(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _project(document: dict, projection) -> dict:
+    if not projection:
+        return dict(document)
+    fields = [field for field, included in projection.items() if included] if isinstance(projection, dict) else projection
+    result = {"_id": document.get("_id")}
+    for field in fields:
+        if field in document:
+            result[field] = document[field]
+    return result
\ No newline at end of file
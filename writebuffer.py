@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+#
+# Buffers documents and writes them to the collection with insert_many instead of one insert_one per file.
+# A flush splits the buffer in chunks that are inserted concurrently, and documents that failed are retried.
+#
+
+class WriteBuffer():
+    """Batches inserts into a collection"""
+
+    def __init__(self, collection, batch_size: int = 50, chunk_size: int = 20, concurrency: int = 4, flush_interval: float = 10.0, retries: int = 3, before_flush = None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.flush_interval = flush_interval
+        self.retries = retries
+        # Called with no arguments right before the documents are written, e.g. to delete what they replace
+        self.before_flush = before_flush
+        self.pending = []
+        self.failed = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {"documents": 0, "batches": 0, "requests": 0, "retries": 0, "failed": 0, "seconds": 0.0}
+
+    # Add a document, the buffer is flushed when it's full or hasn't been flushed for flush_interval seconds
+    def add(self, document: dict):
+        # An _id up front so we know which documents to retry after a partial failure
+        document.setdefault("_id", uuid.uuid4().hex)
+        with self.lock:
+            self.pending.append(document)
+            if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        documents, self.pending = self.pending, []
+        started = time.perf_counter()
+        with tracing.span("astra.flush", documents=len(documents)):
+            if self.before_flush is not None:
+                self.before_flush()
+
+            chunks = [documents[i:i + self.chunk_size] for i in range(0, len(documents), self.chunk_size)]
+            # The chunks report their counts instead of updating the stats from the executor threads
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks))) as executor:
+                for failed, requests in executor.map(self._insertChunk, chunks):
+                    self.failed.extend(failed)
+                    self.stats["failed"] += len(failed)
+                    self.stats["requests"] += requests
+                    self.stats["retries"] += requests - 1
+
+        self.stats["documents"] += len(documents)
+        self.stats["batches"] += 1
+        self.stats["seconds"] += time.perf_counter() - started
+
+    # Insert one chunk, retrying whatever wasn't inserted.
+    # Returns the documents that never made it and the number of requests that took.
+    def _insertChunk(self, documents: list) -> tuple:
+        for attempt in range(self.retries + 1):
+            tracing.count("astra.calls", operation="insert_many")
+            tracing.count("astra.documents", len(documents))
+            try:
+                self.collection.insert_many(documents, ordered=False)
+                return [], attempt + 1
+            except Exception as e:
+                # astrapy reports what did get inserted on the exception
+                inserted = set(getattr(getattr(e, "partial_result", None), "inserted_ids", None) or [])
+                documents = [d for d in documents if d["_id"] not in inserted]
+                if attempt == self.retries:
+                    tracing.count("astra.failed", len(documents), error=type(e).__name__)
+                    return documents, attempt + 1
+                time.sleep(min(10, 0.5 * 2 ** attempt))
+        return documents, self.retries + 1
+
+    def throughput(self) -> float:
+        return self.stats["documents"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+if __name__ == "__main__":
+    # Measure the write throughput against a local stand-in that simulates the round trip of a request
+    class LocalCollection():
+        def __init__(self, latency: float):
+            self.latency = latency
+            self.documents = {}
+
+        def insert_one(self, document):
+            time.sleep(self.latency)
+            self.documents[document.setdefault("_id", uuid.uuid4().hex)] = document
+
+        def insert_many(self, documents, ordered = True):
+            time.sleep(self.latency)
+            for document in documents:
+                self.documents[document["_id"]] = document
+
+    count = 500
+    documents = [{"path": f"file_{i}.py", "$vectorize": "x" * 1000} for i in range(count)]
+
+    collection = LocalCollection(latency=0.02)
+    started = time.perf_counter()
+    for document in documents:
+        collection.insert_one(dict(document))
+    seconds = time.perf_counter() - started
+    print(f"insert_one:  {count / seconds:8.1f} documents/s")
+
+    collection = LocalCollection(latency=0.02)
+    buffer = WriteBuffer(collection)
+    for document in documents:
+        buffer.add(dict(document))
+    buffer.flush()
+    print(f"WriteBuffer: {buffer.throughput():8.1f} documents/s {buffer.stats}")
\ No newline at end of file